@@ -1,160 +1,2770 @@
 """AgentCore runtime with memory and Tavily search."""
 
+import time
+
+_INIT_START = time.perf_counter()  # Startup timings include the imports below
+
 import sys
 import os
+import asyncio
+import atexit
+import contextvars
+import json
+import queue
+import random
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
 from strands import Agent, tool
 from strands.models import BedrockModel
 from bedrock_agentcore.runtime import BedrockAgentCoreApp
 from bedrock_agentcore.memory import MemoryClient
 from tavily import TavilyClient
 
-# Ensure prints are flushed immediately
-sys.stdout.flush()
-print("[STARTUP] Initializing travel agent system...", flush=True)
+try:
+    import aiohttp
+except ImportError:  # Async search falls back to the sync Tavily client
+    aiohttp = None
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # Stage timings are still collected without OpenTelemetry
+    otel_trace = None
+
+# Container init timings in seconds, reported once the module has loaded
+startup_timings = {"imports": time.perf_counter() - _INIT_START}
+_startup_step_start = time.perf_counter()
+
+
+def _startup_step(name):
+    """Record the time since the previous startup step under this name."""
+    global _startup_step_start
+    now = time.perf_counter()
+    startup_timings[name] = now - _startup_step_start
+    _startup_step_start = now
+
+
+# Ensure prints are flushed immediately
+sys.stdout.flush()
+print("[STARTUP] Initializing travel agent system...", flush=True)
+
+# Configuration from environment variables
+MEMORY_ID = os.getenv("MEMORY_ID", "memory_rllrl-lfg7zBH6MH")
+BRANCH_NAME = os.getenv("BRANCH_NAME", "main")
+REGION = os.getenv("REGION", "eu-central-1")
+MODEL_ID = os.getenv("MODEL_ID", "eu.amazon.nova-micro-v1:0")
+GUARDRAIL_ID = os.getenv("GUARDRAIL_ID")
+GUARDRAIL_VERSION = os.getenv("GUARDRAIL_VERSION", "DRAFT")
+
+# Model routing: each turn is classified as "canned" (answered without a model),
+# "simple" or "planning"; MODEL_ROUTES (JSON) maps routes to model IDs, e.g.
+# '{"planning": "eu.amazon.nova-lite-v1:0"}', and MODEL_PRICES (JSON) sets
+# [input, output] USD per 1K tokens for the per-route cost counters
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+CANNED_REPLIES_ENABLED = os.getenv("CANNED_REPLIES_ENABLED", "true").lower() == "true"
+DEFAULT_MODEL_PRICES = {
+    "eu.amazon.nova-micro-v1:0": [0.000035, 0.00014],
+    "eu.amazon.nova-lite-v1:0": [0.00006, 0.00024],
+    "eu.amazon.nova-pro-v1:0": [0.0008, 0.0032],
+}
+
+# Session agent cache limits (idle TTL in seconds, memory budget in MB, 0 disables)
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "500"))
+SESSION_CACHE_IDLE_TTL = float(os.getenv("SESSION_CACHE_IDLE_TTL", "1800"))
+SESSION_CACHE_MAX_MB = float(os.getenv("SESSION_CACHE_MAX_MB", "256"))
+
+# Per-session history cache (filled from AgentCore Memory once, then appended locally)
+HISTORY_CACHE_MAX_SESSIONS = int(os.getenv("HISTORY_CACHE_MAX_SESSIONS", "1000"))
+HISTORY_CACHE_MAX_TURNS = int(os.getenv("HISTORY_CACHE_MAX_TURNS", "20"))
+HISTORY_CONTEXT_TURNS = int(os.getenv("HISTORY_CONTEXT_TURNS", "5"))
+HISTORY_MAX_EVENTS = int(os.getenv("HISTORY_MAX_EVENTS", "100"))
+
+# Conversation context budget (estimated tokens) applied before every agent call;
+# the most recent turns are kept verbatim, older ones are compacted or dropped
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "2"))
+CONTEXT_TRUNCATE_CHARS = int(os.getenv("CONTEXT_TRUNCATE_CHARS", "600"))
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+
+# Write-behind queue for storing turns in AgentCore Memory
+MEMORY_WRITE_BEHIND_ENABLED = os.getenv("MEMORY_WRITE_BEHIND_ENABLED", "true").lower() == "true"
+MEMORY_WRITE_QUEUE_SIZE = int(os.getenv("MEMORY_WRITE_QUEUE_SIZE", "1000"))
+MEMORY_WRITE_MAX_RETRIES = int(os.getenv("MEMORY_WRITE_MAX_RETRIES", "5"))
+MEMORY_WRITE_FLUSH_TIMEOUT = float(os.getenv("MEMORY_WRITE_FLUSH_TIMEOUT", "10"))
+
+# Search result cache (TTLs in seconds per query class, JSON overrides in SEARCH_CACHE_TTLS)
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "true").lower() == "true"
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1000"))
+SEARCH_CACHE_REDIS_URL = os.getenv("SEARCH_CACHE_REDIS_URL")
+DEFAULT_SEARCH_CACHE_TTLS = {
+    "flights": 900,
+    "hotels": 1800,
+    "weather": 1800,
+    "events": 3600,
+    "general": 21600,
+}
+
+# Response cache for first-turn questions (opt-in; TTL in seconds, similarity 0 disables
+# the near-match tier and keeps exact matches only)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "500"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+RESPONSE_CACHE_MAX_INPUT_CHARS = int(os.getenv("RESPONSE_CACHE_MAX_INPUT_CHARS", "300"))
+
+# Per-stage timings: JSON lines are appended here when set
+STAGE_TIMINGS_FILE = os.getenv("STAGE_TIMINGS_FILE")
+
+# Async Tavily HTTP client (timeouts in seconds)
+SEARCH_ASYNC_ENABLED = os.getenv("SEARCH_ASYNC_ENABLED", "true").lower() == "true"
+TAVILY_API_URL = os.getenv("TAVILY_API_URL", "https://api.tavily.com/search")
+SEARCH_HTTP_TIMEOUT = float(os.getenv("SEARCH_HTTP_TIMEOUT", "20"))
+SEARCH_HTTP_CONNECT_TIMEOUT = float(os.getenv("SEARCH_HTTP_CONNECT_TIMEOUT", "5"))
+SEARCH_MAX_CONCURRENCY = int(os.getenv("SEARCH_MAX_CONCURRENCY", "16"))
+SEARCH_POOL_SIZE = int(os.getenv("SEARCH_POOL_SIZE", "32"))
+SEARCH_KEEPALIVE_TIMEOUT = float(os.getenv("SEARCH_KEEPALIVE_TIMEOUT", "30"))
+
+# Search results are compacted into a table before they reach the model: results
+# already shown in the same turn are dropped and each call fits a token budget
+SEARCH_COMPACT_ENABLED = os.getenv("SEARCH_COMPACT_ENABLED", "true").lower() == "true"
+SEARCH_RESULT_TOKEN_BUDGET = int(os.getenv("SEARCH_RESULT_TOKEN_BUDGET", "350"))
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "100"))
+SEARCH_DEDUP_SIMILARITY = float(os.getenv("SEARCH_DEDUP_SIMILARITY", "0.8"))
+
+# Per-session index of offers (price, dates, provider, URL) parsed from search
+# results, queried by the find_offers tool for follow-up questions
+OFFER_INDEX_ENABLED = os.getenv("OFFER_INDEX_ENABLED", "true").lower() == "true"
+OFFER_INDEX_MAX_SESSIONS = int(os.getenv("OFFER_INDEX_MAX_SESSIONS", "1000"))
+OFFER_INDEX_MAX_OFFERS = int(os.getenv("OFFER_INDEX_MAX_OFFERS", "100"))
+
+# Batch search tool limits
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "6"))
+SEARCH_BATCH_CONCURRENCY = int(os.getenv("SEARCH_BATCH_CONCURRENCY", "4"))
+
+# Concurrent requests for one session: "queue" waits for the running turn, "reject"
+# answers busy (HTTP 429 at the Lambda) and "coalesce" shares the running turn's
+# answer with an identical message and queues the rest; timeouts in seconds
+SESSION_CONCURRENCY_POLICY = os.getenv("SESSION_CONCURRENCY_POLICY", "queue").lower()
+SESSION_QUEUE_TIMEOUT = float(os.getenv("SESSION_QUEUE_TIMEOUT", "60"))
+# Agent calls running at once per container (0 disables) and how long a request may wait
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "8"))
+GLOBAL_QUEUE_TIMEOUT = float(os.getenv("GLOBAL_QUEUE_TIMEOUT", "30"))
+BUSY_RETRY_AFTER = int(os.getenv("BUSY_RETRY_AFTER", "2"))
+
+# Pre-built agents handed to new sessions, filled in the background after startup
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", "2"))
+# Open the Memory connection at startup so the first request skips the TLS handshake
+WARM_CONNECTIONS = os.getenv("WARM_CONNECTIONS", "true").lower() == "true"
+
+_startup_step("config")
+
+# Create the AgentCore app
+print("[MEMORY] Initializing AgentCore app...", flush=True)
+app = BedrockAgentCoreApp()
+print(f"[MEMORY] Memory ID: {MEMORY_ID}", flush=True)
+_startup_step("app")
+
+# Initialize memory client
+print(f"[MEMORY] Initializing MemoryClient for region: {REGION}", flush=True)
+memory_client = MemoryClient(region_name=REGION)
+print("[MEMORY] MemoryClient initialized", flush=True)
+_startup_step("memory_client")
+
+# Initialize Tavily client
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+if TAVILY_API_KEY:
+    tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
+    print("[SEARCH] Tavily client initialized", flush=True)
+else:
+    tavily_client = None
+    print("[SEARCH] WARNING: TAVILY_API_KEY not set, search will be disabled", flush=True)
+_startup_step("tavily_client")
+
+
+class StageTimer:
+    """Wall-clock timings for the stages of one request.
+    
+    Each stage is also recorded as an OpenTelemetry span; the container runs
+    under opentelemetry-instrument, so spans are exported to the configured
+    OTLP endpoint and join the trace started by the Lambda. The totals can
+    also be appended to STAGE_TIMINGS_FILE as one JSON line per request.
+    Stages that run more than once (model calls, searches) are summed.
+    """
+    
+    _file_lock = threading.Lock()
+    
+    def __init__(self, component, trace_id=None, session_id=None):
+        self.component = component
+        self.trace_id = trace_id
+        self.session_id = session_id
+        self.stages = {}
+        self.counts = {}
+        self.fields = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+    
+    def set(self, **fields):
+        """Attach extra fields (e.g. token counts) to the exported record."""
+        self.fields.update(fields)
+    
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages[name] = round(self.stages.get(name, 0.0) + seconds * 1000, 2)
+            self.counts[name] = self.counts.get(name, 0) + 1
+    
+    def export(self, **fields):
+        """Log the timings and append them to STAGE_TIMINGS_FILE, if configured."""
+        record = {
+            "component": self.component,
+            "trace_id": self.trace_id,
+            "session_id": self.session_id,
+            "total_ms": round((time.perf_counter() - self._start) * 1000, 2),
+            "stages": self.stages,
+            "counts": self.counts,
+        }
+        record.update(self.fields)
+        record.update(fields)
+        print(f"[TIMING] {json.dumps(record)}", flush=True)
+        if not STAGE_TIMINGS_FILE:
+            return
+        try:
+            with self._file_lock, open(STAGE_TIMINGS_FILE, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"[TIMING] Could not write {STAGE_TIMINGS_FILE}: {e}", flush=True)
+
+
+# Timer of the request being handled; tools read it to attribute their time
+_current_timer = contextvars.ContextVar("stage_timer", default=None)
+_tracer = otel_trace.get_tracer("travel-agent") if otel_trace is not None else None
+
+
+@contextmanager
+def stage(name, **attributes):
+    """Time a block as a stage of the current request (no-op outside a request)."""
+    timer = _current_timer.get()
+    if timer is not None and timer.trace_id:
+        attributes.setdefault("lambda.trace_id", timer.trace_id)
+    span = _tracer.start_as_current_span(name, attributes=attributes) if _tracer else nullcontext()
+    start = time.perf_counter()
+    try:
+        with span:
+            yield
+    finally:
+        if timer is not None:
+            timer.add(name, time.perf_counter() - start)
+
+
+def _estimate_agent_bytes(agent) -> int:
+    """Estimate the memory held by an agent's conversation state.
+    
+    The model, tools and prompt are small compared to the message history,
+    which is the part that grows with every turn, so only that is counted.
+    """
+    messages = getattr(agent, "messages", None)
+    if not isinstance(messages, list):
+        return 0
+    try:
+        return len(json.dumps(messages, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class SessionAgentCache:
+    """Thread-safe LRU cache of per-session agents.
+    
+    Entries are evicted when the cache exceeds its entry limit, when a
+    session has been idle for longer than the TTL, or when the estimated
+    size of all cached conversations exceeds the memory budget. Entries are
+    kept in access order, so idle and least recently used sessions are
+    always at the front.
+    """
+    
+    def __init__(self, max_entries=500, idle_ttl=1800.0, max_bytes=None,
+                 sizer=_estimate_agent_bytes, clock=time.monotonic):
+        """
+        Args:
+            max_entries: Maximum number of cached agents
+            idle_ttl: Seconds a session may be idle before eviction (0 disables)
+            max_bytes: Memory budget for all cached agents (None disables)
+            sizer: Callable returning the estimated size of an agent in bytes
+            clock: Monotonic clock, injectable for tests
+        """
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._sizer = sizer
+        self._clock = clock
+        self._lock = threading.RLock()
+        # session_id -> [agent, last_access, size_bytes]
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"capacity": 0, "idle": 0, "memory": 0}
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+    
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._entries
+    
+    def get(self, session_id):
+        """Return the cached agent for a session, or None."""
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            entry[1] = self._clock()
+            self._entries.move_to_end(session_id)
+            return entry[0]
+    
+    def get_or_create(self, session_id, factory):
+        """Return the cached agent for a session, creating it on a miss.
+        
+        The factory runs outside the lock so that a slow agent construction
+        does not block other sessions. If two threads race on the same
+        session, the first agent stored wins and the other is discarded.
+        
+        Args:
+            session_id: Session identifier
+            factory: Zero-argument callable that builds a new agent
+        
+        Returns:
+            The agent for this session
+        """
+        agent = self.get(session_id)
+        if agent is not None:
+            with self._lock:
+                self.hits += 1
+            return agent
+        
+        new_agent = factory()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                # Another thread created it first
+                self.hits += 1
+                entry[1] = self._clock()
+                self._entries.move_to_end(session_id)
+                return entry[0]
+            self.misses += 1
+            size = self._sizer(new_agent)
+            self._entries[session_id] = [new_agent, self._clock(), size]
+            self._total_bytes += size
+            self._enforce_limits()
+            return new_agent
+    
+    def refresh_size(self, session_id):
+        """Re-measure a session's agent after a turn and enforce the memory budget."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            size = self._sizer(entry[0])
+            self._total_bytes += size - entry[2]
+            entry[2] = size
+            self._enforce_limits()
+    
+    def pop(self, session_id, default=None):
+        """Remove a session from the cache and return its agent."""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is None:
+                return default
+            self._total_bytes -= entry[2]
+            return entry[0]
+    
+    def clear(self):
+        """Remove all cached agents."""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+    
+    def stats(self):
+        """Return cache counters as a dictionary."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": dict(self.evictions),
+            }
+    
+    def _evict_oldest(self, reason):
+        session_id, entry = self._entries.popitem(last=False)
+        self._total_bytes -= entry[2]
+        self.evictions[reason] += 1
+        print(f"[AGENT] Evicted agent for session {session_id} ({reason})", flush=True)
+    
+    def _evict_idle(self):
+        if not self.idle_ttl:
+            return
+        cutoff = self._clock() - self.idle_ttl
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest[1] > cutoff:
+                break
+            self._evict_oldest("idle")
+    
+    def _enforce_limits(self):
+        self._evict_idle()
+        while len(self._entries) > self.max_entries:
+            self._evict_oldest("capacity")
+        if self.max_bytes:
+            # Always keep the most recently used session
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                self._evict_oldest("memory")
+
+
+# Session-based agents
+session_agents = SessionAgentCache(
+    max_entries=SESSION_CACHE_MAX_ENTRIES,
+    idle_ttl=SESSION_CACHE_IDLE_TTL,
+    max_bytes=int(SESSION_CACHE_MAX_MB * 1024 * 1024) if SESSION_CACHE_MAX_MB else None,
+)
+
+
+def _load_search_cache_ttls() -> dict:
+    """Merge SEARCH_CACHE_TTLS (JSON object) over the default per-class TTLs."""
+    ttls = dict(DEFAULT_SEARCH_CACHE_TTLS)
+    overrides = os.getenv("SEARCH_CACHE_TTLS")
+    if overrides:
+        try:
+            ttls.update({k: float(v) for k, v in json.loads(overrides).items()})
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"[SEARCH] Ignoring invalid SEARCH_CACHE_TTLS: {e}", flush=True)
+    return ttls
+
+
+_QUERY_CLASS_KEYWORDS = (
+    ("flights", ("flight", "flights", "airline", "airfare", "fly", "ryanair", "wizz", "lufthansa")),
+    ("hotels", ("hotel", "hotels", "hostel", "accommodation", "airbnb", "apartment", "stay")),
+    ("weather", ("weather", "forecast", "temperature", "rain")),
+    ("events", ("event", "events", "concert", "festival", "exhibition", "tickets")),
+)
+
+_QUERY_PUNCTUATION_RE = re.compile(r"[^\w\s€$£-]")
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a search query for cache lookups (case, punctuation, whitespace)."""
+    query = _QUERY_PUNCTUATION_RE.sub(" ", query.lower())
+    return " ".join(query.split())
+
+
+def classify_query(query: str) -> str:
+    """Return the cache TTL class of a normalized query."""
+    words = set(query.split())
+    for query_class, keywords in _QUERY_CLASS_KEYWORDS:
+        if words.intersection(keywords):
+            return query_class
+    return "general"
+
+
+class SearchResultCache:
+    """Process-local TTL cache for Tavily responses.
+    
+    Entries are keyed on the normalized query and search parameters, expire
+    after a TTL chosen by query class (prices go stale faster than
+    attractions) and are bounded in number with LRU eviction. An optional
+    shared store with a redis-style ``get(key)``/``set(key, value, ex=ttl)``
+    interface is consulted on local misses so containers can share results.
+    """
+    
+    def __init__(self, max_entries=1000, ttls=None, shared_store=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttls = dict(ttls or DEFAULT_SEARCH_CACHE_TTLS)
+        self.shared_store = shared_store
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expires_at, response, fetch_seconds)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+    
+    @staticmethod
+    def make_key(query: str, max_results: int, include_answer: bool) -> str:
+        return f"search:{normalize_query(query)}|{max_results}|{int(bool(include_answer))}"
+    
+    def ttl_for(self, query: str) -> float:
+        query_class = classify_query(normalize_query(query))
+        return self.ttls.get(query_class, self.ttls.get("general", 0))
+    
+    def get(self, key):
+        """Return a cached response or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.saved_seconds += entry[2]
+                    return entry[1]
+                del self._entries[key]
+        
+        if self.shared_store is not None:
+            try:
+                raw = self.shared_store.get(key)
+            except Exception as e:
+                print(f"[SEARCH] Shared cache read failed: {e}", flush=True)
+                raw = None
+            if raw:
+                response = json.loads(raw)
+                with self._lock:
+                    self.shared_hits += 1
+                return response
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def set(self, key, response, ttl, fetch_seconds=0.0):
+        """Store a response for ttl seconds."""
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, response, fetch_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        
+        if self.shared_store is not None:
+            try:
+                self.shared_store.set(key, json.dumps(response), ex=int(ttl))
+            except Exception as e:
+                print(f"[SEARCH] Shared cache write failed: {e}", flush=True)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Return hit-rate metrics as a dictionary."""
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+def _create_shared_search_store():
+    """Connect to the optional shared search cache (redis), if configured."""
+    if not SEARCH_CACHE_REDIS_URL:
+        return None
+    try:
+        import redis
+        store = redis.Redis.from_url(SEARCH_CACHE_REDIS_URL)
+        print("[SEARCH] Shared search cache enabled", flush=True)
+        return store
+    except Exception as e:
+        print(f"[SEARCH] WARNING: Shared search cache unavailable: {e}", flush=True)
+        return None
+
+
+search_cache = SearchResultCache(
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    ttls=_load_search_cache_ttls(),
+    shared_store=_create_shared_search_store(),
+) if SEARCH_CACHE_ENABLED else None
+
+
+# Filler words ignored when comparing questions for the response cache
+_RESPONSE_CACHE_STOPWORDS = frozenset((
+    "a", "an", "the", "i", "me", "we", "us", "to", "for", "of", "in", "on", "at",
+    "and", "or", "is", "are", "be", "can", "could", "would", "you", "please",
+    "want", "like", "need", "some", "any", "plan", "help", "with", "what", "about",
+))
+
+# Questions that depend on the user's own context are never served from the cache
+_PERSONAL_INPUT_RE = re.compile(
+    r"\b(my|mine|our|ours|earlier|previous|previously|before|again|above|that one|"
+    r"those|these|same|instead|last time|you said|you suggested)\b"
+)
+
+
+# Words that introduce a place or time; "from rome" and "to rome" are different slots
+_SLOT_PREPOSITIONS = frozenset((
+    "from", "to", "in", "via", "at", "near", "between", "and", "into", "around", "over", "on",
+    "until", "till", "before", "after", "during",
+))
+_RELATIVE_DATE_WORDS = frozenset(("next", "this", "last", "coming"))
+_DATE_WORDS = frozenset((
+    "january", "february", "march", "april", "may", "june", "july", "august", "september",
+    "october", "november", "december", "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep",
+    "sept", "oct", "nov", "dec", "monday", "tuesday", "wednesday", "thursday", "friday",
+    "saturday", "sunday", "today", "tonight", "tomorrow", "christmas", "easter",
+))
+
+
+def question_terms(text: str) -> dict:
+    """Term counts of a normalized question without filler words."""
+    terms = {}
+    for word in text.split():
+        if word not in _RESPONSE_CACHE_STOPWORDS:
+            terms[word] = terms.get(word, 0) + 1
+    return terms
+
+
+def question_signature(text: str):
+    """Split a normalized question into its place/date slots and remaining terms.
+    
+    Slots keep the word that introduces a place or time ("from rome",
+    "to budapest", "in october", "next month") plus every date-like word,
+    so questions that swap origin and destination or change the month have
+    different slots. The remaining words are returned as term counts.
+    
+    Returns:
+        Tuple of (frozenset of slots, term-count dict of the other words)
+    """
+    words = text.split()
+    slots = set()
+    consumed = set()
+    for i, word in enumerate(words):
+        if word in _DATE_WORDS or any(ch.isdigit() for ch in word):
+            slots.add(word)
+            consumed.add(i)
+        if word in _SLOT_PREPOSITIONS or word in _RELATIVE_DATE_WORDS:
+            j = i + 1
+            while j < len(words) and words[j] in ("the", "a", "an"):
+                j += 1
+            if j < len(words) and words[j] not in _SLOT_PREPOSITIONS:
+                slots.add(f"{word} {words[j]}")
+                consumed.update((i, j))
+    remaining = " ".join(w for i, w in enumerate(words) if i not in consumed)
+    return frozenset(slots), question_terms(remaining)
+
+
+def cosine_similarity(a: dict, b: dict) -> float:
+    """Cosine similarity of two term-count vectors."""
+    if not a or not b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(count * b.get(term, 0) for term, count in a.items())
+    if not dot:
+        return 0.0
+    norm_a = sum(c * c for c in a.values()) ** 0.5
+    norm_b = sum(c * c for c in b.values()) ** 0.5
+    return dot / (norm_a * norm_b)
+
+
+class ResponseCache:
+    """Process-local TTL cache of agent answers to first-turn questions.
+    
+    Lookups try the normalized question first and then, when a similarity
+    threshold is set, a near match: a cached question with exactly the same
+    place and date slots (see question_signature) whose other content words
+    reach the threshold by bag-of-words cosine. Keys include the UTC date so relative
+    dates ("next weekend") are never answered from a previous day. Entries
+    are bounded in number with LRU eviction.
+    """
+    
+    def __init__(self, max_entries=500, ttl=3600, similarity=0.92, max_input_chars=300,
+                 clock=time.monotonic, today=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.max_input_chars = max_input_chars
+        self._clock = clock
+        self._today = today or (lambda: datetime.now(timezone.utc).strftime("%Y-%m-%d"))
+        self._lock = threading.Lock()
+        # key -> (expires_at, response, (slots, terms), answer_seconds)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_seconds = 0.0
+    
+    def make_key(self, user_input: str):
+        """Return the cache key of a question, or None if it must bypass the cache."""
+        question = normalize_query(user_input)
+        if not question or len(question) > self.max_input_chars or _PERSONAL_INPUT_RE.search(question):
+            return None
+        return f"{self._today()}|{question}"
+    
+    def bypass(self):
+        """Count a request that was not eligible for the cache."""
+        with self._lock:
+            self.bypassed += 1
+    
+    def get(self, key):
+        """Return (response, match) with match "exact" or "similar", or (None, None)."""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.saved_seconds += entry[3]
+                    return entry[1], "exact"
+                del self._entries[key]
+            
+            if self.similarity > 0:
+                day, _, question = key.partition("|")
+                slots, terms = question_signature(question)
+                best_key, best_score = None, self.similarity
+                for other_key, (expires_at, _, (other_slots, other_terms), _) in self._entries.items():
+                    if expires_at <= now or not other_key.startswith(day + "|") or other_slots != slots:
+                        continue
+                    # Questions that are all places and dates match on their slots alone
+                    score = cosine_similarity(terms, other_terms) if terms or other_terms else 1.0
+                    if score >= best_score:
+                        best_key, best_score = other_key, score
+                if best_key is not None:
+                    entry = self._entries[best_key]
+                    self._entries.move_to_end(best_key)
+                    self.similar_hits += 1
+                    self.saved_seconds += entry[3]
+                    return entry[1], "similar"
+            
+            self.misses += 1
+        return None, None
+    
+    def set(self, key, response, answer_seconds=0.0):
+        """Store the answer to a question for the configured TTL."""
+        if self.ttl <= 0 or not response:
+            return
+        question = key.partition("|")[2]
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, response, question_signature(question), answer_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Return hit-rate metrics as a dictionary."""
+        with self._lock:
+            lookups = self.hits + self.similar_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": (self.hits + self.similar_hits) / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=RESPONSE_CACHE_TTL,
+    similarity=RESPONSE_CACHE_SIMILARITY,
+    max_input_chars=RESPONSE_CACHE_MAX_INPUT_CHARS,
+) if RESPONSE_CACHE_ENABLED else None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into a single execution.
+    
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is in flight wait on the same future and receive its
+    result or exception. Threaded callers use ``do`` and asyncio callers use
+    ``do_async``; both share one registry, so they coalesce with each other.
+    Nothing is cached once the call completes.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+    
+    def _join(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.executions += 1
+            return future, True
+    
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def do(self, key, fn):
+        """Run fn() for key, or wait for the in-flight call with the same key."""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+    
+    async def do_async(self, key, coro_fn):
+        """Await coro_fn() for key, or await the in-flight call with the same key."""
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+            }
+
+
+# Concurrent identical searches share one Tavily request
+search_flight = SingleFlight()
+
+
+class GateBusy(Exception):
+    """A request was not admitted by the SessionGate.
+    
+    ``reason`` is "session_busy" when the session already has a turn running
+    and "overloaded" when the container has no free agent slot.
+    """
+    
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class GateTicket:
+    """Admission of one request; release it exactly once when the turn ends."""
+    
+    def __init__(self, gate, session_id, session_entry, flight_key, future):
+        self._gate = gate
+        self.session_id = session_id
+        self._session_entry = session_entry
+        self._flight_key = flight_key
+        self.future = future
+        self._released = False
+    
+    def release(self, result=None):
+        """Free the session and global slots; later calls are no-ops.
+        
+        The result is handed to coalesced followers; releasing without one
+        tells them the turn did not complete.
+        """
+        with self._gate._lock:
+            if self._released:
+                return
+            self._released = True
+        self._gate._release(self, result)
+
+
+class SessionGate:
+    """Serialize agent calls per session and bound them per container.
+    
+    A session's cached agent holds its conversation, so two turns of one
+    session must not run at once. Requests wait for the session according to
+    the policy ("queue", "reject" or "coalesce") and then for one of
+    ``max_concurrent`` container-wide slots, which protects the model quota
+    under bursts. Waiting requests are counted for queue-depth metrics.
+    """
+    
+    POLICIES = ("queue", "reject", "coalesce")
+    
+    def __init__(self, policy="queue", queue_timeout=60.0, max_concurrent=8, global_timeout=30.0):
+        if policy not in self.POLICIES:
+            print(f"[GATE] Unknown policy {policy!r}, using 'queue'", flush=True)
+            policy = "queue"
+        self.policy = policy
+        self.queue_timeout = queue_timeout
+        self.global_timeout = global_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+        self._lock = threading.Lock()
+        # session_id -> [threading.Lock, requests holding or waiting for it]
+        self._sessions = {}
+        # (session_id, normalized input) -> Future of the running turn
+        self._in_flight = {}
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.wait_seconds = 0.0
+    
+    def enter(self, session_id, user_input):
+        """Admit a request for a session.
+        
+        Returns:
+            (ticket, None) when the caller should run the turn and release the
+            ticket afterwards, or (None, future) when an identical message of
+            the session is already running and its answer can be awaited
+        
+        Raises:
+            GateBusy: If the session or the container stayed busy
+        """
+        flight_key = (session_id, normalize_query(user_input))
+        with self._lock:
+            if self.policy == "coalesce":
+                running = self._in_flight.get(flight_key)
+                if running is not None:
+                    self.coalesced += 1
+                    return None, running
+            entry = self._sessions.setdefault(session_id, [threading.Lock(), 0])
+            entry[1] += 1
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            future = None
+            if self.policy == "coalesce":
+                future = self._in_flight[flight_key] = Future()
+        
+        start = time.perf_counter()
+        reason = None
+        if self.policy == "reject":
+            acquired = entry[0].acquire(blocking=False)
+        else:
+            acquired = entry[0].acquire(timeout=self.queue_timeout)
+        if not acquired:
+            reason = "session_busy"
+        elif self._slots is not None and not self._slots.acquire(timeout=self.global_timeout):
+            entry[0].release()
+            reason = "overloaded"
+        
+        with self._lock:
+            self.waiting -= 1
+            self.wait_seconds += time.perf_counter() - start
+            if reason is None:
+                self.active += 1
+                self.admitted += 1
+            else:
+                self.rejected += 1
+                self._leave_session(session_id, entry)
+                if future is not None and self._in_flight.get(flight_key) is future:
+                    del self._in_flight[flight_key]
+        if reason is not None:
+            if future is not None:
+                future.set_exception(GateBusy(reason))
+            raise GateBusy(reason)
+        return GateTicket(self, session_id, entry, flight_key, future), None
+    
+    def _leave_session(self, session_id, entry):
+        entry[1] -= 1
+        if entry[1] == 0 and self._sessions.get(session_id) is entry:
+            del self._sessions[session_id]
+    
+    def _release(self, ticket, result):
+        with self._lock:
+            self.active -= 1
+            self._leave_session(ticket.session_id, ticket._session_entry)
+            if ticket.future is not None and self._in_flight.get(ticket._flight_key) is ticket.future:
+                del self._in_flight[ticket._flight_key]
+        if self._slots is not None:
+            self._slots.release()
+        ticket._session_entry[0].release()
+        if ticket.future is not None:
+            if result is None:
+                ticket.future.set_exception(RuntimeError("The running request did not complete"))
+            else:
+                ticket.future.set_result(result)
+    
+    def stats(self):
+        """Return admission and queue-depth metrics as a dictionary."""
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "active": self.active,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "sessions": len(self._sessions),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "coalesced": self.coalesced,
+                "avg_wait_ms": round(self.wait_seconds / max(self.admitted + self.rejected, 1) * 1000, 1),
+            }
+
+
+session_gate = SessionGate(
+    policy=SESSION_CONCURRENCY_POLICY,
+    queue_timeout=SESSION_QUEUE_TIMEOUT,
+    max_concurrent=MAX_CONCURRENT_REQUESTS,
+    global_timeout=GLOBAL_QUEUE_TIMEOUT,
+)
+
+
+def busy_response(reason):
+    """Entrypoint reply for a request that was not admitted.
+    
+    Chat replies are plain text, so the Lambda recognizes this object by its
+    "error" field and answers HTTP 429 with Retry-After.
+    """
+    messages = {
+        "session_busy": "A previous message of this conversation is still being answered.",
+        "overloaded": "The travel agent is busy right now.",
+    }
+    return {"error": reason, "message": messages.get(reason, reason), "retry_after": BUSY_RETRY_AFTER}
+
+
+def tavily_search(query: str, max_results: int = 5, include_answer: bool = True) -> dict:
+    """Run a Tavily search, serving repeated queries from the result cache.
+    
+    Concurrent misses for the same key are coalesced into one request.
+    
+    Args:
+        query: Search query
+        max_results: Maximum number of results
+        include_answer: Whether Tavily should include a generated summary
+    
+    Returns:
+        Raw Tavily response dictionary
+    """
+    key = SearchResultCache.make_key(query, max_results, include_answer)
+    if search_cache is not None:
+        response = search_cache.get(key)
+        if response is not None:
+            print(f"[SEARCH] Cache hit: {query}", flush=True)
+            return response
+    
+    def fetch():
+        start = time.perf_counter()
+        with stage("tavily_search"):
+            response = tavily_client.search(query=query, max_results=max_results, include_answer=include_answer)
+        if search_cache is not None:
+            search_cache.set(key, response, search_cache.ttl_for(query), time.perf_counter() - start)
+        return response
+    
+    return search_flight.do(key, fetch)
+
+
+def format_search_results(response: dict) -> str:
+    """Format a Tavily response as text for the model."""
+    results = []
+    
+    # Add AI-generated answer if available
+    if response.get("answer"):
+        results.append(f"Summary: {response['answer']}\n")
+    
+    # Add search results
+    for i, result in enumerate(response.get("results", []), 1):
+        title = result.get("title", "No title")
+        url = result.get("url", "")
+        content = result.get("content", "")
+        
+        results.append(f"{i}. {title}")
+        if content:
+            results.append(f"   {content[:200]}...")
+        if url:
+            results.append(f"   Source: {url}")
+        results.append("")
+    
+    return "\n".join(results)
+
+
+_PRICE_RE = re.compile(
+    r"(?:[€$£]\s?\d[\d.,]*\d|[€$£]\s?\d|\b\d[\d.,]*\s?(?:€|(?:eur|euros?|usd|gbp|huf|ft)\b))",
+    re.IGNORECASE,
+)
+_MONTHS = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+_RESULT_DATE_RE = re.compile(
+    rf"\b(?:\d{{1,2}}\s{_MONTHS}(?:\s\d{{4}})?|{_MONTHS}\s\d{{1,2}}\b(?:,?\s\d{{4}})?|\d{{4}}-\d{{2}}-\d{{2}})",
+    re.IGNORECASE,
+)
+_PROVIDER_RE = re.compile(
+    r"\b(ryanair|wizz ?air|easyjet|lufthansa|austrian airlines|klm|air france|british airways|ita airways|"
+    r"vueling|eurowings|turkish airlines|emirates|qatar airways|lot polish airlines|"
+    r"hilton|marriott|hyatt|radisson|novotel|ibis|mercure|holiday inn|sheraton|kempinski|best western)\b",
+    re.IGNORECASE,
+)
+_HOTEL_NAME_RE = re.compile(r"\b(?:Hotel [A-Z][\w'&-]+(?: [A-Z][\w'&-]+)?|[A-Z][\w'&-]+ Hotel)\b")
+
+
+def _text_tokens(text: str) -> int:
+    """Rough token count of a string (characters / CONTEXT_CHARS_PER_TOKEN)."""
+    return int(len(text) / CONTEXT_CHARS_PER_TOKEN) + 1 if text else 0
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+
+def _first_sentence(text: str, limit: int) -> str:
+    """First sentence of a snippet, clipped to limit characters."""
+    return _clip(_SENTENCE_END_RE.split(" ".join(text.split()), 1)[0], limit)
+
+
+def extract_result_fields(title: str, content: str) -> dict:
+    """Pull prices, dates and an airline or hotel name out of a search result."""
+    text = f"{title} {content}"
+    prices = list(dict.fromkeys(m.group(0).strip() for m in _PRICE_RE.finditer(text)))[:2]
+    dates = list(dict.fromkeys(m.group(0).strip() for m in _RESULT_DATE_RE.finditer(text)))[:2]
+    provider = _PROVIDER_RE.search(text) or _HOTEL_NAME_RE.search(text)
+    return {
+        "price": ", ".join(prices),
+        "dates": ", ".join(dates),
+        "provider": provider.group(0) if provider else "",
+    }
+
+
+def _canonical_url(url: str) -> str:
+    """URL without scheme, www., query string, fragment or trailing slash."""
+    url = re.sub(r"^https?://(www\.)?", "", url.strip().lower())
+    return url.split("#", 1)[0].split("?", 1)[0].rstrip("/")
+
+
+class SearchResultLedger:
+    """Search results already shown to the model during one turn.
+    
+    A result is a duplicate when its URL was shown before or when its title
+    and snippet share at least ``similarity`` of their words (Jaccard) with
+    an earlier result, which catches the same page returned by overlapping
+    queries of a batch or syndicated on another site. The ledger also sums
+    the token savings of compaction for the turn's stage timings.
+    """
+    
+    def __init__(self, similarity=0.8):
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self._urls = set()
+        self._word_sets = []
+        self.calls = 0
+        self.duplicates = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+    
+    def is_duplicate(self, url: str, text: str) -> bool:
+        """Return True for a result shown before, otherwise remember it."""
+        key = _canonical_url(url) if url else None
+        words = set(normalize_query(text).split())
+        with self._lock:
+            duplicate = key in self._urls if key else False
+            if not duplicate and words:
+                for seen in self._word_sets:
+                    if len(words & seen) / len(words | seen) >= self.similarity:
+                        duplicate = True
+                        break
+            if duplicate:
+                self.duplicates += 1
+                return True
+            if key:
+                self._urls.add(key)
+            if words:
+                self._word_sets.append(words)
+            return False
+    
+    def record(self, tokens_in: int, tokens_out: int):
+        with self._lock:
+            self.calls += 1
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+    
+    def report(self) -> dict:
+        """Stage timing fields for the turn."""
+        with self._lock:
+            return {
+                "search_calls": self.calls,
+                "search_tokens_in": self.tokens_in,
+                "search_tokens_out": self.tokens_out,
+                "search_duplicates": self.duplicates,
+            }
+
+
+# Ledger of the turn being answered, shared by all of its search calls
+_current_search_ledger = contextvars.ContextVar("search_ledger", default=None)
+
+
+def compact_search_results(response: dict, ledger=None, budget_tokens=350, snippet_chars=100) -> str:
+    """Format a Tavily response as a compact table for the model.
+    
+    Each result becomes one row of title, price, dates, provider, the first
+    sentence of its snippet and its URL. Results already in the ledger are dropped, and rows
+    are removed from the end until the text fits budget_tokens.
+    """
+    ledger = ledger if ledger is not None else SearchResultLedger(SEARCH_DEDUP_SIMILARITY)
+    rows = []
+    duplicates = 0
+    for result in response.get("results", []):
+        title = _clip(result.get("title") or "No title", 80)
+        content = result.get("content") or ""
+        # Query strings are mostly tracking parameters
+        url = (result.get("url") or "").split("#", 1)[0].split("?", 1)[0]
+        if ledger.is_duplicate(url, f"{title} {content[:200]}"):
+            duplicates += 1
+            continue
+        fields = extract_result_fields(title, content)
+        rows.append(" | ".join((
+            title, fields["price"] or "-", fields["dates"] or "-", fields["provider"] or "-",
+            _first_sentence(content, snippet_chars) or "-", url or "-",
+        )))
+    
+    header = []
+    if response.get("answer"):
+        header.append(f"Summary: {_clip(response['answer'], 400)}")
+    if rows:
+        header.append("title | price | dates | provider | details | url")
+    
+    dropped = 0
+    while True:
+        notes = []
+        if duplicates:
+            notes.append(f"({duplicates} results already shown above omitted)")
+        if dropped:
+            notes.append(f"({dropped} more results omitted to save context)")
+        text = "\n".join(header + rows + notes)
+        if _text_tokens(text) <= budget_tokens or not rows:
+            break
+        rows.pop()
+        dropped += 1
+    if _text_tokens(text) > budget_tokens:
+        text = text[:int(budget_tokens * CONTEXT_CHARS_PER_TOKEN)]
+    
+    ledger.record(_text_tokens(format_search_results(response)), _text_tokens(text))
+    return text
+
+
+def render_search_results(response: dict) -> str:
+    """Text of a Tavily response for the model, compacted unless disabled."""
+    if not SEARCH_COMPACT_ENABLED:
+        return format_search_results(response)
+    return compact_search_results(
+        response,
+        ledger=_current_search_ledger.get(),
+        budget_tokens=SEARCH_RESULT_TOKEN_BUDGET,
+        snippet_chars=SEARCH_SNIPPET_CHARS,
+    )
+
+
+_CURRENCY_CODES = {
+    "€": "EUR", "eur": "EUR", "euro": "EUR", "euros": "EUR", "$": "USD", "usd": "USD",
+    "£": "GBP", "gbp": "GBP", "huf": "HUF", "ft": "HUF",
+}
+
+
+def parse_price(text: str):
+    """Parse a price such as "€39.99", "1,234 USD" or "25.000 Ft" into (amount, currency)."""
+    match = re.search(r"\d[\d.,]*", text)
+    if not match:
+        return None, ""
+    number = match.group(0).rstrip(".,")
+    if "," in number and "." in number:
+        decimal = "," if number.rfind(",") > number.rfind(".") else "."
+        number = number.replace("." if decimal == "," else ",", "").replace(",", ".")
+    elif "," in number:
+        number = number.replace(",", "") if re.fullmatch(r"\d{1,3}(,\d{3})+", number) else number.replace(",", ".")
+    elif re.fullmatch(r"\d{1,3}(\.\d{3})+", number):
+        number = number.replace(".", "")
+    currency = re.sub(r"[\d\s.,]", "", text).lower()
+    try:
+        return float(number), _CURRENCY_CODES.get(currency, currency.upper())
+    except ValueError:
+        return None, ""
+
+
+def extract_offers(query: str, response: dict):
+    """Offers (results with a price or a provider) found in a Tavily response."""
+    query_class = classify_query(normalize_query(query))
+    offers = []
+    for result in response.get("results", []):
+        title = " ".join((result.get("title") or "").split())
+        content = result.get("content") or ""
+        fields = extract_result_fields(title, content)
+        if not fields["price"] and not fields["provider"]:
+            continue
+        offer_type = classify_query(normalize_query(title))
+        if offer_type == "general":
+            offer_type = query_class
+        if offer_type == "general":
+            offer_type = classify_query(normalize_query(content))
+        price, currency = parse_price(fields["price"].split(", ")[0]) if fields["price"] else (None, "")
+        offers.append({
+            "type": offer_type,
+            "title": title,
+            "price": price,
+            "currency": currency,
+            "dates": fields["dates"],
+            "provider": fields["provider"],
+            "url": (result.get("url") or "").split("#", 1)[0].split("?", 1)[0],
+            "query": query,
+        })
+    return offers
+
+
+class OfferIndex:
+    """Offers found by the searches of one session.
+    
+    Follow-up questions ("what was the cheaper flight again?") are answered
+    from here by the find_offers tool instead of a new search. The same
+    offer (URL and price) is kept once, and the oldest offers are dropped
+    beyond ``max_offers``.
+    """
+    
+    SORTS = ("price", "price_desc", "recent")
+    
+    def __init__(self, max_offers=100):
+        self.max_offers = max_offers
+        self._lock = threading.Lock()
+        # (url or title, price) -> offer, oldest first
+        self._offers = OrderedDict()
+    
+    def add(self, offers):
+        with self._lock:
+            for offer in offers:
+                key = (offer["url"] or offer["title"], offer["price"])
+                self._offers.pop(key, None)
+                self._offers[key] = offer
+            while len(self._offers) > self.max_offers:
+                self._offers.popitem(last=False)
+    
+    def find(self, offer_type=None, max_price=None, provider=None, text=None, sort="price", limit=5):
+        """Return offers matching all given filters, sorted and limited.
+        
+        Args:
+            offer_type: "flights", "hotels", "events", ... (any when empty)
+            max_price: Highest price, in the offer's own currency
+            provider: Airline or hotel name, matched case-insensitively
+            text: Words that must all appear in the title, dates or query
+            sort: "price" (cheapest first), "price_desc" or "recent"
+            limit: Maximum number of offers
+        """
+        words = normalize_query(text).split() if text else []
+        with self._lock:
+            offers = list(self._offers.values())
+        matches = []
+        for offer in offers:
+            if offer_type and offer["type"] != offer_type:
+                continue
+            if max_price is not None and (offer["price"] is None or offer["price"] > max_price):
+                continue
+            if provider and provider.lower() not in offer["provider"].lower():
+                continue
+            if words:
+                haystack = normalize_query(f"{offer['title']} {offer['dates']} {offer['query']}")
+                if not all(word in haystack for word in words):
+                    continue
+            matches.append(offer)
+        if sort == "recent":
+            matches.reverse()
+        elif sort in ("price", "price_desc"):
+            priced = sorted((o for o in matches if o["price"] is not None), key=lambda o: o["price"],
+                            reverse=sort == "price_desc")
+            matches = priced + [o for o in matches if o["price"] is None]
+        return matches[:limit]
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._offers)
+
+
+class SessionOfferIndexes:
+    """Bounded LRU map of session ID to its OfferIndex."""
+    
+    def __init__(self, max_sessions=1000, max_offers=100):
+        self.max_sessions = max_sessions
+        self.max_offers = max_offers
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+    
+    def get(self, session_id):
+        """Return the session's index, creating it if needed."""
+        with self._lock:
+            index = self._indexes.get(session_id)
+            if index is None:
+                index = self._indexes[session_id] = OfferIndex(self.max_offers)
+                while len(self._indexes) > self.max_sessions:
+                    self._indexes.popitem(last=False)
+            else:
+                self._indexes.move_to_end(session_id)
+            return index
+    
+    def pop(self, session_id):
+        with self._lock:
+            self._indexes.pop(session_id, None)
+
+
+offer_indexes = SessionOfferIndexes(OFFER_INDEX_MAX_SESSIONS, OFFER_INDEX_MAX_OFFERS) if OFFER_INDEX_ENABLED else None
+
+# Offer index of the session being answered, filled by its search calls
+_current_offer_index = contextvars.ContextVar("offer_index", default=None)
+
+
+def format_offers(offers) -> str:
+    """Format offers as a table for the model."""
+    lines = ["type | title | price | dates | provider | url"]
+    for offer in offers:
+        price = f"{offer['price']:g} {offer['currency']}".strip() if offer["price"] is not None else "-"
+        lines.append(" | ".join((
+            offer["type"], _clip(offer["title"], 80), price, offer["dates"] or "-",
+            offer["provider"] or "-", offer["url"] or "-",
+        )))
+    return "\n".join(lines)
+
+
+def index_search_results(query: str, response: dict):
+    """Add the offers of a search response to the current session's index."""
+    index = _current_offer_index.get()
+    if index is not None:
+        index.add(extract_offers(query, response))
+
+
+def lookup_offers(offer_type="", max_price=0, provider="", text="", sort="price", limit=5) -> str:
+    """Query the current session's offer index and format the matches for the model."""
+    index = _current_offer_index.get()
+    if index is None or not len(index):
+        return "No offers found in this conversation yet. Use search_web to find some."
+    offers = index.find(
+        offer_type=offer_type or None,
+        max_price=max_price or None,
+        provider=provider or None,
+        text=text or None,
+        sort=sort if sort in OfferIndex.SORTS else "price",
+        limit=max(1, min(int(limit or 5), 20)),
+    )
+    if not offers:
+        return "No saved offers match. Use search_web to look for new ones."
+    print(f"[OFFERS] Found {len(offers)} saved offers", flush=True)
+    return format_offers(offers)
+
+
+class AsyncTavilyClient:
+    """Async Tavily client with a pooled keep-alive aiohttp session.
+    
+    Strands runs each agent invocation on its own short-lived event loop,
+    while an aiohttp session is bound to the loop it was created on. The
+    client therefore owns a background event loop thread where the session
+    and its connection pool live for the whole process; ``search`` can be
+    awaited from any loop and is bridged onto it.
+    """
+    
+    def __init__(self, api_key, api_url=TAVILY_API_URL, timeout=SEARCH_HTTP_TIMEOUT,
+                 connect_timeout=SEARCH_HTTP_CONNECT_TIMEOUT, max_concurrency=SEARCH_MAX_CONCURRENCY,
+                 pool_size=SEARCH_POOL_SIZE, keepalive_timeout=SEARCH_KEEPALIVE_TIMEOUT):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._lock = threading.Lock()
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+    
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="tavily-http", daemon=True)
+                thread.start()
+                self._loop = loop
+            return self._loop
+    
+    async def _get_session(self):
+        # Runs on the background loop only, so no locking is needed
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout),
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+    
+    async def _search(self, query, max_results, include_answer):
+        session = await self._get_session()
+        async with self._semaphore:
+            async with session.post(self.api_url, json={
+                "query": query,
+                "max_results": max_results,
+                "include_answer": include_answer,
+            }) as response:
+                response.raise_for_status()
+                return await response.json()
+    
+    async def search(self, query: str, max_results: int = 5, include_answer: bool = True) -> dict:
+        """Search Tavily; awaitable from any event loop."""
+        future = asyncio.run_coroutine_threadsafe(
+            self._search(query, max_results, include_answer), self._ensure_loop()
+        )
+        return await asyncio.wrap_future(future)
+    
+    def close(self):
+        """Close the HTTP session and stop the background loop."""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result(timeout=5)
+            self._session = None
+        loop.call_soon_threadsafe(loop.stop)
+
+
+async_tavily_client = (
+    AsyncTavilyClient(api_key=TAVILY_API_KEY)
+    if tavily_client and SEARCH_ASYNC_ENABLED and aiohttp is not None
+    else None
+)
+
+if async_tavily_client is not None:
+    atexit.register(async_tavily_client.close)
+
+
+async def tavily_search_async(query: str, max_results: int = 5, include_answer: bool = True) -> dict:
+    """Async counterpart of tavily_search using the pooled HTTP client.
+    
+    Shares the result cache and in-flight coalescing with the sync path, and
+    falls back to the sync Tavily client if the async request fails.
+    """
+    key = SearchResultCache.make_key(query, max_results, include_answer)
+    if search_cache is not None:
+        response = search_cache.get(key)
+        if response is not None:
+            print(f"[SEARCH] Cache hit: {query}", flush=True)
+            return response
+    
+    async def fetch():
+        start = time.perf_counter()
+        with stage("tavily_search"):
+            try:
+                response = await async_tavily_client.search(query, max_results=max_results, include_answer=include_answer)
+            except Exception as e:
+                print(f"[SEARCH] Async search failed, using sync client: {e}", flush=True)
+                response = await asyncio.to_thread(
+                    tavily_client.search, query=query, max_results=max_results, include_answer=include_answer
+                )
+        if search_cache is not None:
+            search_cache.set(key, response, search_cache.ttl_for(query), time.perf_counter() - start)
+        return response
+    
+    return await search_flight.do_async(key, fetch)
+
+
+# Search tool
+@tool
+def search_web(query: str) -> str:
+    """
+    Search the web for current information.
+    
+    Use this to find:
+    - Flight prices and availability
+    - Hotel options and reviews
+    - Activities and attractions
+    - Weather and events
+    - Any real-time travel information
+    
+    Args:
+        query: Search query (e.g., "flights from Budapest to Paris October 2025")
+    
+    Returns:
+        Search results with relevant information
+    """
+    try:
+        if not tavily_client:
+            return "Search is not available (TAVILY_API_KEY not configured)"
+        
+        print(f"[SEARCH] Query: {query}", flush=True)
+        
+        # Perform search
+        response = tavily_search(query, max_results=5, include_answer=True)
+        
+        # Format results
+        index_search_results(query, response)
+        result_text = render_search_results(response)
+        print(f"[SEARCH] Found {len(response.get('results', []))} results", flush=True)
+        return result_text if result_text else "No results found"
+    
+    except Exception as e:
+        print(f"[SEARCH] ERROR: {e}", flush=True)
+        import traceback
+        traceback.print_exc()
+        return f"Search error: {str(e)}"
+
+
+@tool(name="search_web")
+async def search_web_async(query: str) -> str:
+    """
+    Search the web for current information.
+    
+    Use this to find:
+    - Flight prices and availability
+    - Hotel options and reviews
+    - Activities and attractions
+    - Weather and events
+    - Any real-time travel information
+    
+    Args:
+        query: Search query (e.g., "flights from Budapest to Paris October 2025")
+    
+    Returns:
+        Search results with relevant information
+    """
+    try:
+        print(f"[SEARCH] Query (async): {query}", flush=True)
+        response = await tavily_search_async(query, max_results=5, include_answer=True)
+        index_search_results(query, response)
+        result_text = render_search_results(response)
+        print(f"[SEARCH] Found {len(response.get('results', []))} results", flush=True)
+        return result_text if result_text else "No results found"
+    
+    except Exception as e:
+        print(f"[SEARCH] ERROR: {e}", flush=True)
+        import traceback
+        traceback.print_exc()
+        return f"Search error: {str(e)}"
+
+
+async def _search_one(query: str) -> str:
+    """Search and format one query of a batch; errors are reported inline."""
+    try:
+        if async_tavily_client:
+            response = await tavily_search_async(query, max_results=5, include_answer=True)
+        else:
+            response = await asyncio.to_thread(tavily_search, query, 5, True)
+        index_search_results(query, response)
+        return render_search_results(response) or "No results found"
+    except Exception as e:
+        print(f"[SEARCH] ERROR in batch query '{query}': {e}", flush=True)
+        return f"Search error: {str(e)}"
+
+
+async def run_search_batch(queries) -> str:
+    """Run a batch of searches concurrently and merge the formatted results.
+    
+    Duplicate and blank queries are dropped, the batch is capped at
+    SEARCH_BATCH_MAX_QUERIES and at most SEARCH_BATCH_CONCURRENCY searches
+    run at the same time.
+    """
+    # Drop duplicates and blanks, keep order
+    unique_queries = list(dict.fromkeys(q.strip() for q in queries if q and q.strip()))
+    if not unique_queries:
+        return "No search queries provided"
+    skipped = unique_queries[SEARCH_BATCH_MAX_QUERIES:]
+    unique_queries = unique_queries[:SEARCH_BATCH_MAX_QUERIES]
+    
+    print(f"[SEARCH] Batch of {len(unique_queries)} queries", flush=True)
+    semaphore = asyncio.Semaphore(SEARCH_BATCH_CONCURRENCY)
+    
+    async def bounded(query):
+        async with semaphore:
+            return await _search_one(query)
+    
+    results = await asyncio.gather(*[bounded(q) for q in unique_queries])
+    
+    sections = [f"### Results for: {query}\n{text}" for query, text in zip(unique_queries, results)]
+    if skipped:
+        sections.append(f"Skipped {len(skipped)} queries (limit is {SEARCH_BATCH_MAX_QUERIES} per batch): "
+                        + "; ".join(skipped))
+    return "\n\n".join(sections)
+
+
+@tool
+async def search_web_batch(queries: list[str]) -> str:
+    """
+    Run several web searches at once and return all results together.
+    
+    Prefer this over multiple search_web calls when planning a trip, e.g.
+    search flights, hotels and activities for the same trip in one step.
+    
+    Args:
+        queries: List of search queries (e.g., ["flights Budapest to Paris October 2025",
+            "hotels in Paris October 2025", "things to do in Paris in October"])
+    
+    Returns:
+        Search results for each query, in the order given
+    """
+    if not tavily_client:
+        return "Search is not available (TAVILY_API_KEY not configured)"
+    return await run_search_batch(queries)
+
+
+@tool
+def find_offers(offer_type: str = "", max_price: float = 0, provider: str = "", text: str = "",
+                sort: str = "price", limit: int = 5) -> str:
+    """
+    Look up flights, hotels and other offers found by earlier searches in this conversation.
+    
+    Use this for follow-up questions about offers already found (e.g. "what was
+    the cheaper flight again?") before searching again.
+    
+    Args:
+        offer_type: "flights", "hotels" or "events" (empty for any)
+        max_price: Highest price to include (0 for no limit)
+        provider: Airline or hotel name (e.g., "Ryanair")
+        text: Words the offer must mention (e.g., "Rome October")
+        sort: "price" (cheapest first), "price_desc" or "recent"
+        limit: Maximum number of offers to return
+    
+    Returns:
+        Matching offers with price, dates, provider and URL
+    """
+    return lookup_offers(offer_type, max_price, provider, text, sort, limit)
+
+
+SYSTEM_PROMPT_TEMPLATE = """I am a travel planning assistant built by Adam Laszlo.
+
+I help you plan trips. When planning, I need:
+1. Origin city (where you're traveling from)
+2. Destination city (where you're going)  
+3. Travel dates (specific dates)
+
+Once I have these details, I use search_web_batch to search for all of these in one step:
+- Current flight options and prices
+- Hotel recommendations
+- Activities and attractions
+
+For a single follow-up lookup I use search_web.
+
+{search_info}
+
+I remember our conversation, so you don't need to repeat information you've already told me."""
+
+
+class AgentResources:
+    """Process-wide models, tools and system prompt shared by all sessions.
+    
+    Building a BedrockModel sets up a boto client and resolves credentials,
+    so it is done once per container instead of once per session. Session
+    agents only hold their own conversation state on top of these.
+    ``model`` is the default model and ``models`` holds one model per routed
+    model ID.
+    """
+    
+    def __init__(self, model, tools, system_prompt, models=None):
+        self.model = model
+        self.tools = tools
+        self.system_prompt = system_prompt
+        self.models = models or {MODEL_ID: model}
+
+
+def build_agent_resources() -> AgentResources:
+    """Build the shared model, tool list and system prompt."""
+    # The async search tool is used when aiohttp is available, sync otherwise
+    if async_tavily_client:
+        tools = [search_web_async, search_web_batch]
+    elif tavily_client:
+        tools = [search_web, search_web_batch]
+    else:
+        tools = []
+    if tools and offer_indexes is not None:
+        tools.append(find_offers)
+    
+    # Configure models with optional guardrails, one per distinct routed model ID
+    if GUARDRAIL_ID:
+        print(f"[GUARDRAILS] Enabling guardrails: {GUARDRAIL_ID} (version: {GUARDRAIL_VERSION})", flush=True)
+    else:
+        print("[GUARDRAILS] No guardrail configured", flush=True)
+    model_ids = [MODEL_ID] + [m for m in dict.fromkeys(model_routes.values()) if m != MODEL_ID]
+    models = {model_id: _create_model(model_id) for model_id in model_ids}
+    
+    search_info = "Use search_web to find real-time travel information." if tavily_client else "Search is currently unavailable."
+    if tools and offer_indexes is not None:
+        search_info += " Use find_offers to look up offers found earlier in this conversation before searching again."
+    system_prompt = SYSTEM_PROMPT_TEMPLATE.format(search_info=search_info)
+    
+    print(f"[AGENT] Shared resources built: models={model_ids}, {len(tools)} tools", flush=True)
+    return AgentResources(model=models[MODEL_ID], tools=tools, system_prompt=system_prompt, models=models)
+
+
+def _create_model(model_id: str):
+    """Create a BedrockModel, with the configured guardrail if any."""
+    if GUARDRAIL_ID:
+        return BedrockModel(
+            model_id=model_id,
+            guardrail_id=GUARDRAIL_ID,
+            guardrail_version=GUARDRAIL_VERSION,
+            guardrail_trace="enabled"
+        )
+    return BedrockModel(model_id=model_id)
+
+
+def _load_json_table(name: str, defaults: dict) -> dict:
+    """Merge a JSON object from the environment variable `name` over defaults."""
+    table = dict(defaults)
+    overrides = os.getenv(name)
+    if overrides:
+        try:
+            table.update(json.loads(overrides))
+        except (ValueError, TypeError) as e:
+            print(f"[ROUTER] Ignoring invalid {name}: {e}", flush=True)
+    return table
+
+
+model_routes = _load_json_table("MODEL_ROUTES", {"simple": MODEL_ID, "planning": MODEL_ID})
+model_prices = _load_json_table("MODEL_PRICES", DEFAULT_MODEL_PRICES)
+
+# Small talk answered without a model: (intent, words that signal it, words
+# that may accompany it, English reply, Hungarian reply)
+_CANNED_INTENTS = (
+    ("thanks",
+     {"thanks", "thank", "thx", "ty", "köszönöm", "köszi", "kösz"},
+     {"you", "so", "much", "very", "a", "lot", "many", "great", "ok", "okay", "cool", "perfect",
+      "nagyon", "szépen", "szuper", "oké", "rendben"},
+     "You're welcome! Let me know if you'd like to plan another trip.",
+     "Szívesen! Szólj, ha másik utat is megterveznél."),
+    ("greeting",
+     {"hi", "hello", "hey", "szia", "sziasztok", "helló", "üdv"},
+     {"there", "again", "good", "morning", "afternoon", "evening", "jó", "napot", "reggelt", "estét"},
+     "Hi! Where would you like to travel? Tell me where you're starting from, "
+     "your destination and your dates, and I'll plan the trip.",
+     "Szia! Hová utaznál? Írd meg, honnan indulsz, hová mennél és mikor, és megtervezem az utat."),
+    ("goodbye",
+     {"bye", "goodbye", "viszlát", "viszontlátásra", "pá"},
+     {"good", "for", "now", "see", "you", "thanks", "köszi"},
+     "Goodbye, and have a great trip!",
+     "Viszlát, jó utat!"),
+)
+_HUNGARIAN_WORDS = frozenset((
+    "köszönöm", "köszi", "kösz", "nagyon", "szépen", "szia", "sziasztok", "helló", "üdv", "jó",
+    "napot", "reggelt", "estét", "viszlát", "viszontlátásra", "pá", "szuper", "oké", "rendben",
+))
 
-# Configuration from environment variables
-MEMORY_ID = os.getenv("MEMORY_ID", "memory_rllrl-lfg7zBH6MH")
-BRANCH_NAME = os.getenv("BRANCH_NAME", "main")
-REGION = os.getenv("REGION", "eu-central-1")
-MODEL_ID = os.getenv("MODEL_ID", "eu.amazon.nova-micro-v1:0")
-GUARDRAIL_ID = os.getenv("GUARDRAIL_ID")
-GUARDRAIL_VERSION = os.getenv("GUARDRAIL_VERSION", "DRAFT")
+_PLANNING_KEYWORDS = frozenset((
+    "plan", "planning", "itinerary", "trip", "route", "budget", "compare", "days", "nights",
+    "week", "weekend", "vacation", "holiday", "multi", "stopover", "cities",
+))
+_DATE_RE = re.compile(
+    r"\b(\d{1,2}[./-]\d{1,2}|\d{4}-\d{2}-\d{2}|20\d\d|january|february|march|april|may|june|july|"
+    r"august|september|october|november|december|jan|feb|mar|apr|jun|jul|aug|sep|sept|oct|nov|dec|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday|tomorrow|next week|next month)\b"
+)
+_PLACE_RE = re.compile(r"\b(?:from|to|via|in|and)\s+[A-Z][\w-]+")
 
-# Create the AgentCore app
-print("[MEMORY] Initializing AgentCore app...", flush=True)
-app = BedrockAgentCoreApp()
-print(f"[MEMORY] Memory ID: {MEMORY_ID}", flush=True)
 
-# Initialize memory client
-print(f"[MEMORY] Initializing MemoryClient for region: {REGION}", flush=True)
-memory_client = MemoryClient(region_name=REGION)
-print("[MEMORY] MemoryClient initialized", flush=True)
+def canned_reply(user_input: str):
+    """Reply for pure small talk ("thanks!", "hi"), or None."""
+    words = normalize_query(user_input).split()
+    if not words or len(words) > 6:
+        return None
+    for _, signals, companions, english, hungarian in _CANNED_INTENTS:
+        if set(words) & signals and all(w in signals or w in companions for w in words):
+            return hungarian if _HUNGARIAN_WORDS.intersection(words) else english
+    return None
 
-# Initialize Tavily client
-TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
-if TAVILY_API_KEY:
-    tavily_client = TavilyClient(api_key=TAVILY_API_KEY)
-    print("[SEARCH] Tavily client initialized", flush=True)
-else:
-    tavily_client = None
-    print("[SEARCH] WARNING: TAVILY_API_KEY not set, search will be disabled", flush=True)
 
-# Session-based agents
-session_agents = {}
+def planning_score(user_input: str) -> int:
+    """Count the signals that a message asks for trip planning.
+    
+    Signals are a long message, a date, two or more places, planning words
+    and topics that need a search (flights, hotels, weather, events).
+    """
+    question = normalize_query(user_input)
+    words = set(question.split())
+    return sum((
+        len(user_input) > 160,
+        bool(_DATE_RE.search(question)),
+        len(_PLACE_RE.findall(user_input)) >= 2,
+        bool(words & _PLANNING_KEYWORDS),
+        classify_query(question) != "general",
+    ))
 
 
-# Search tool
-@tool
-def search_web(query: str) -> str:
+def _last_user_text(messages) -> str:
+    """Text of the last user turn, skipping messages that only hold tool results."""
+    starts = _turn_starts(messages or [])
+    if not starts:
+        return ""
+    return " ".join(
+        block["text"] for block in messages[starts[-1]].get("content", [])
+        if isinstance(block, dict) and "text" in block
+    )
+
+
+def route_request(user_input: str, messages=None):
+    """Choose the route of a turn with cheap heuristics.
+    
+    Args:
+        user_input: Current user message
+        messages: The session's conversation so far; a short reply ("yes,
+            the cheaper one") stays on the planning route of the message
+            before it
+    
+    Returns:
+        Tuple of (route, canned reply or None)
     """
-    Search the web for current information.
+    if CANNED_REPLIES_ENABLED:
+        reply = canned_reply(user_input)
+        if reply is not None:
+            return "canned", reply
+    if planning_score(user_input) >= 2:
+        return "planning", None
+    if len(user_input.split()) <= 8 and planning_score(_last_user_text(messages)) >= 2:
+        return "planning", None
+    return "simple", None
+
+
+def route_model(agent, route: str):
+    """Point the session agent at the model of a route; returns the model ID."""
+    model_id = model_routes.get(route, MODEL_ID)
+    model = agent_resources.models.get(model_id)
+    if model is not None:
+        agent.model = model
+    else:
+        model_id = MODEL_ID
+        agent.model = agent_resources.model
+    return model_id
+
+
+def _model_usage(response):
+    """(input tokens, output tokens) reported by Strands for an agent call."""
+    usage = getattr(getattr(response, "metrics", None), "accumulated_usage", None)
+    if not isinstance(usage, dict):
+        return 0, 0
+    return int(usage.get("inputTokens") or 0), int(usage.get("outputTokens") or 0)
+
+
+class ModelRouteStats:
+    """Per-route request, latency, token and cost counters."""
     
-    Use this to find:
-    - Flight prices and availability
-    - Hotel options and reviews
-    - Activities and attractions
-    - Weather and events
-    - Any real-time travel information
+    def __init__(self, prices=None):
+        self.prices = prices if prices is not None else model_prices
+        self._lock = threading.Lock()
+        self._routes = {}
+    
+    def record(self, route, model_id, seconds, response=None):
+        """Count a turn of a route; token usage and cost come from the response metrics."""
+        input_tokens, output_tokens = _model_usage(response)
+        price_in, price_out = self.prices.get(model_id, (0.0, 0.0))
+        with self._lock:
+            counters = self._routes.setdefault(route, {
+                "requests": 0, "seconds": 0.0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0,
+            })
+            counters["requests"] += 1
+            counters["seconds"] += seconds
+            counters["input_tokens"] += input_tokens
+            counters["output_tokens"] += output_tokens
+            counters["cost_usd"] += (input_tokens * price_in + output_tokens * price_out) / 1000
+    
+    def stats(self):
+        """Return the counters of each route as a dictionary."""
+        with self._lock:
+            return {
+                route: {
+                    "requests": c["requests"],
+                    "avg_ms": round(c["seconds"] / c["requests"] * 1000, 1),
+                    "input_tokens": c["input_tokens"],
+                    "output_tokens": c["output_tokens"],
+                    "cost_usd": round(c["cost_usd"], 6),
+                }
+                for route, c in self._routes.items()
+            }
+
+
+route_stats = ModelRouteStats()
+
+
+def _message_text(message) -> str:
+    """Extract the text of a message returned by AgentCore Memory."""
+    content = message.get("content", {})
+    if isinstance(content, dict):
+        return content.get("text", "")
+    return str(content)
+
+
+def turns_to_messages(turns):
+    """Flatten memory turns into [{"role", "content"}] chat messages."""
+    messages = []
+    for turn in turns:
+        for message in turn:
+            role = message.get("role", "").lower()
+            if role in ("user", "assistant"):
+                messages.append({"role": role, "content": _message_text(message)})
+    return messages
+
+
+def turns_to_agent_messages(turns):
+    """Convert memory turns into a strands conversation to seed an agent.
+    
+    The model requires the conversation to start with a user message and
+    alternate roles, so consecutive messages with the same role are merged
+    and a trailing user message (a turn without an answer) is dropped.
+    """
+    agent_messages = []
+    for message in turns_to_messages(turns):
+        if not message["content"]:
+            continue
+        if not agent_messages and message["role"] != "user":
+            continue
+        if agent_messages and agent_messages[-1]["role"] == message["role"]:
+            agent_messages[-1]["content"].append({"text": message["content"]})
+        else:
+            agent_messages.append({"role": message["role"], "content": [{"text": message["content"]}]})
+    if agent_messages and agent_messages[-1]["role"] == "user":
+        agent_messages.pop()
+    return agent_messages
+
+
+def _event_time(event) -> float:
+    """Timestamp of a Memory event as epoch seconds.
+    
+    Accepts the datetime returned by boto3 as well as epoch numbers and ISO
+    strings, which is also how getHistory's "since" parameter is parsed.
+    """
+    value = event.get("eventTimestamp")
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return 0.0
+
+
+def events_to_turns(events):
+    """Group Memory events (oldest first) into turns, starting a turn at each USER message."""
+    turns = []
+    for event in events:
+        for item in event.get("payload", []):
+            message = item.get("conversational")
+            if not message:
+                continue
+            if message.get("role") == "USER" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+    return turns
+
+
+def page_history_events(events, page_size, before=None, after=None, since=None):
+    """Select one page of a session's events for the getHistory API.
     
     Args:
-        query: Search query (e.g., "flights from Budapest to Paris October 2025")
+        events: All events of the session, oldest first
+        page_size: Maximum number of events in the page
+        before: Event ID; return the newest events older than it
+        after: Event ID; return the oldest events newer than it
+        since: Epoch seconds or ISO timestamp; return the oldest events after it
     
     Returns:
-        Search results with relevant information
+        Dict with the page's "events" (oldest first), "has_more" (further
+        events exist in the paging direction) and "reset" (the cursor event
+        no longer exists, so the latest page is returned instead)
     """
-    try:
-        if not tavily_client:
-            return "Search is not available (TAVILY_API_KEY not configured)"
-        
-        print(f"[SEARCH] Query: {query}", flush=True)
-        
-        # Perform search
-        response = tavily_client.search(
-            query=query,
-            max_results=5,
-            include_answer=True
-        )
-        
-        # Format results
-        results = []
+    ids = [event.get("eventId") for event in events]
+    reset = False
+    if after is not None or since is not None:
+        if after is not None and after not in ids:
+            reset = True
+        else:
+            if after is not None:
+                start = ids.index(after) + 1
+            else:
+                threshold = _event_time({"eventTimestamp": since})
+                start = next((i for i, event in enumerate(events) if _event_time(event) > threshold), len(events))
+            return {"events": events[start:start + page_size],
+                    "has_more": start + page_size < len(events), "reset": False}
+    
+    end = len(events)
+    if before is not None:
+        if before in ids:
+            end = ids.index(before)
+        else:
+            reset = True
+    start = max(0, end - page_size)
+    return {"events": events[start:end], "has_more": start > 0, "reset": reset}
+
+
+def history_page_body(page):
+    """Build the getHistory response body for a page of events.
+    
+    The cursor's "before" is passed back to load older messages, its
+    "after" (or "timestamp" as "since") to fetch only newer ones.
+    """
+    events = page["events"]
+    return {
+        "messages": turns_to_messages(events_to_turns(events)),
+        "cursor": {
+            "before": events[0].get("eventId") if events else None,
+            "after": events[-1].get("eventId") if events else None,
+            "timestamp": _event_time(events[-1]) if events else None,
+        },
+        "has_more": page["has_more"],
+        "reset": page["reset"],
+    }
+
+
+_OMITTED_TOOL_RESULT = "[Earlier tool result omitted to save context]"
+
+
+def estimate_tokens(messages) -> int:
+    """Rough token count of a Strands conversation (characters / CONTEXT_CHARS_PER_TOKEN)."""
+    chars = 0
+    for message in messages:
+        for block in message.get("content", []):
+            if isinstance(block, dict) and "text" in block:
+                chars += len(block["text"])
+            else:
+                chars += len(json.dumps(block, default=str))
+    return int(chars / CONTEXT_CHARS_PER_TOKEN) + 1 if chars else 0
+
+
+def _turn_starts(messages):
+    """Indexes of user messages that start a turn (not tool results)."""
+    return [
+        i for i, message in enumerate(messages)
+        if message.get("role") == "user"
+        and any(isinstance(block, dict) and "text" in block for block in message.get("content", []))
+    ]
+
+
+def compact_messages(messages, budget_tokens, keep_turns=2, truncate_chars=600):
+    """Shrink a conversation in place until it fits the token budget.
+    
+    The last keep_turns turns are never changed. In older turns, in order
+    and only while over budget:
+    
+    1. Tool results (search results) are replaced by a short placeholder;
+       the tool call itself is kept so the conversation stays valid.
+    2. Long text blocks are cut to truncate_chars characters.
+    3. Whole turns are dropped, oldest first.
+    
+    The kept turns alone may still exceed the budget; they are left intact
+    so follow-up questions can refer to the latest results.
+    
+    Returns:
+        Tuple of (tokens_before, tokens_after)
+    """
+    before = estimate_tokens(messages)
+    if before <= budget_tokens:
+        return before, before
+    
+    # Messages from index `protected` on belong to the turns kept verbatim
+    starts = _turn_starts(messages)
+    if keep_turns <= 0:
+        protected = len(messages)
+    elif len(starts) >= keep_turns:
+        protected = starts[-keep_turns]
+    else:
+        protected = 0
+    
+    for message in messages[:protected]:
+        content = message.get("content", [])
+        for j, block in enumerate(content):
+            if isinstance(block, dict) and "toolResult" in block:
+                content[j] = {"toolResult": dict(block["toolResult"], content=[{"text": _OMITTED_TOOL_RESULT}])}
+    tokens = estimate_tokens(messages)
+    
+    if tokens > budget_tokens:
+        for message in messages[:protected]:
+            content = message.get("content", [])
+            for j, block in enumerate(content):
+                if isinstance(block, dict) and len(block.get("text", "")) > truncate_chars:
+                    content[j] = {"text": block["text"][:truncate_chars].rstrip() + " [...]"}
+        tokens = estimate_tokens(messages)
+    
+    while tokens > budget_tokens and len(starts) > max(keep_turns, 1):
+        del messages[:starts[1]]
+        starts = _turn_starts(messages)
+        tokens = estimate_tokens(messages)
+    return before, tokens
+
+
+def compact_agent_context(agent, timer=None):
+    """Apply the context budget to an agent's conversation before it is invoked."""
+    messages = getattr(agent, "messages", None)
+    if not isinstance(messages, list) or CONTEXT_TOKEN_BUDGET <= 0:
+        return
+    before, after = compact_messages(messages, CONTEXT_TOKEN_BUDGET, CONTEXT_KEEP_TURNS, CONTEXT_TRUNCATE_CHARS)
+    if before != after:
+        print(f"[CONTEXT] Compacted history: {before} -> {after} tokens (saved {before - after})", flush=True)
+    if timer is not None:
+        timer.set(context_tokens=after, context_tokens_saved=before - after)
+
+
+class SessionHistoryCache:
+    """Bounded per-session cache of conversation turns.
+    
+    A session's turns are read from AgentCore Memory once and then kept up
+    to date locally as turns are stored, so Memory is only re-read on a
+    cache miss. This relies on every turn of a session reaching the same
+    container, which the Lambda ensures by passing runtimeSessionId.
+    """
+    
+    def __init__(self, max_sessions=1000, max_turns=20):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self._lock = threading.Lock()
+        # session_id -> {"turns": [...], "complete": bool}
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, session_id, k=None):
+        """Return the last k cached turns, or None on a miss.
         
-        # Add AI-generated answer if available
-        if response.get("answer"):
-            results.append(f"Summary: {response['answer']}\n")
+        Args:
+            session_id: Session identifier
+            k: Number of turns needed (None for all cached turns)
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            usable = (
+                entry is not None
+                and (k is None or entry["complete"] or len(entry["turns"]) >= k)
+            )
+            if not usable:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            turns = entry["turns"]
+            return list(turns[-k:]) if k else list(turns)
+    
+    def store(self, session_id, turns, k):
+        """Cache turns loaded from Memory for a request of k turns."""
+        with self._lock:
+            self._entries[session_id] = {
+                "turns": list(turns)[-self.max_turns:],
+                # Memory returned fewer turns than asked for: this is all of it
+                "complete": len(turns) < k,
+            }
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+    
+    def append(self, session_id, user_text, assistant_text):
+        """Record a new turn for a cached session."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            entry["turns"].append([
+                {"role": "USER", "content": {"text": user_text}},
+                {"role": "ASSISTANT", "content": {"text": assistant_text}},
+            ])
+            if len(entry["turns"]) > self.max_turns:
+                del entry["turns"][:-self.max_turns]
+                entry["complete"] = False
+    
+    def invalidate(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+history_cache = SessionHistoryCache(
+    max_sessions=HISTORY_CACHE_MAX_SESSIONS,
+    max_turns=HISTORY_CACHE_MAX_TURNS,
+)
+
+
+class MemoryWriteBehind:
+    """Background writer that persists conversation turns to AgentCore Memory.
+    
+    Turns are queued so the response does not wait on the Memory write. The
+    worker drains whatever is queued, merges consecutive turns of the same
+    session into a single create_event call, and retries failures with
+    exponential backoff. When the bounded queue is full the turn is written
+    synchronously instead, which applies backpressure rather than dropping
+    data. ``flush`` is registered to run at interpreter shutdown.
+    """
+    
+    def __init__(self, write_fn, max_queue=1000, max_retries=5, base_delay=0.2,
+                 max_delay=5.0, max_batch_turns=20):
+        """
+        Args:
+            write_fn: Callable(actor_id, session_id, messages) that stores one event
+            max_queue: Maximum number of queued turns
+            max_retries: Retries per batch before it is dropped
+            base_delay: Initial backoff delay in seconds
+            max_delay: Maximum backoff delay in seconds
+            max_batch_turns: Maximum turns drained per batch
+        """
+        self._write_fn = write_fn
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_batch_turns = max_batch_turns
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._thread = None
+        self.written_turns = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed_turns = 0
+        self.sync_writes = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+    
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="memory-write-behind", daemon=True)
+            self._thread.start()
+    
+    def submit(self, actor_id, session_id, messages):
+        """Queue a turn for writing; writes synchronously when the queue is full."""
+        item = (actor_id, session_id, list(messages), time.monotonic())
+        with self._lock:
+            self._ensure_worker()
+            try:
+                self._queue.put_nowait(item)
+                self._pending += 1
+                return
+            except queue.Full:
+                self.sync_writes += 1
+        print("[MEMORY] Write queue full, storing turn synchronously", flush=True)
+        self._write_batch([item])
+    
+    def flush(self, timeout=None):
+        """Wait until all queued turns are written.
         
-        # Add search results
-        for i, result in enumerate(response.get("results", []), 1):
-            title = result.get("title", "No title")
-            url = result.get("url", "")
-            content = result.get("content", "")
+        Returns:
+            True if the queue drained within the timeout
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._pending,
+                "written_turns": self.written_turns,
+                "batches": self.batches,
+                "retries": self.retries,
+                "failed_turns": self.failed_turns,
+                "sync_writes": self.sync_writes,
+                "last_lag_seconds": round(self.last_lag, 3),
+                "max_lag_seconds": round(self.max_lag, 3),
+            }
+    
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            while len(items) < self.max_batch_turns:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
             
-            results.append(f"{i}. {title}")
-            if content:
-                results.append(f"   {content[:200]}...")
-            if url:
-                results.append(f"   Source: {url}")
-            results.append("")
-        
-        result_text = "\n".join(results)
-        print(f"[SEARCH] Found {len(response.get('results', []))} results", flush=True)
-        return result_text if result_text else "No results found"
+            # Group by session, keeping turn order within each session
+            batches = OrderedDict()
+            for item in items:
+                batches.setdefault((item[0], item[1]), []).append(item)
+            for batch in batches.values():
+                self._write_batch(batch)
+            
+            with self._idle:
+                self._pending -= len(items)
+                self._idle.notify_all()
+    
+    def _write_batch(self, batch):
+        actor_id, session_id = batch[0][0], batch[0][1]
+        messages = [message for item in batch for message in item[2]]
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._write_fn(actor_id, session_id, messages)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"[MEMORY] Giving up storing {len(batch)} turns for {session_id}: {e}", flush=True)
+                    with self._lock:
+                        self.failed_turns += len(batch)
+                    return
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                print(f"[MEMORY] Error storing turns for {session_id}, retrying in {delay:.2f}s: {e}", flush=True)
+                with self._lock:
+                    self.retries += 1
+                time.sleep(delay * random.uniform(0.5, 1.0))
+        
+        lag = time.monotonic() - batch[0][3]
+        with self._lock:
+            self.written_turns += len(batch)
+            self.batches += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+
+
+def _write_memory_event(actor_id, session_id, messages):
+    memory_client.create_event(
+        memory_id=MEMORY_ID,
+        actor_id=actor_id,
+        session_id=session_id,
+        messages=messages
+    )
+
+
+memory_writer = MemoryWriteBehind(
+    _write_memory_event,
+    max_queue=MEMORY_WRITE_QUEUE_SIZE,
+    max_retries=MEMORY_WRITE_MAX_RETRIES,
+) if MEMORY_WRITE_BEHIND_ENABLED else None
+
+if memory_writer is not None:
+    atexit.register(memory_writer.flush, MEMORY_WRITE_FLUSH_TIMEOUT)
+
+
+def list_session_events(session_id: str):
+    """Return a session's conversation events from AgentCore Memory, oldest first."""
+    with stage("memory_load"):
+        events = memory_client.list_events(
+            memory_id=MEMORY_ID,
+            actor_id=f"travel-user-{session_id}",
+            session_id=session_id,
+            branch_name=BRANCH_NAME,
+            max_results=HISTORY_MAX_EVENTS
+        ) or []
+    return sorted(events, key=_event_time)
+
+
+def load_history_turns(session_id: str, k: int):
+    """Return the last k turns of a session (oldest first) from the cache or AgentCore Memory."""
+    turns = history_cache.get(session_id, k=k)
+    if turns is not None:
+        return turns
+    
+    print(f"[MEMORY] Loading conversation history for session: {session_id}", flush=True)
+    turns = events_to_turns(list_session_events(session_id))[-k:] if k > 0 else []
+    history_cache.store(session_id, turns, k)
+    print(f"[MEMORY] Loaded {len(turns)} previous turns", flush=True)
+    return turns
+
+
+def _create_agent(session_id: str):
+    """Create a new travel agent for a session on top of the shared resources.
+    
+    The agent's conversation is seeded from the session history, so a
+    session that was evicted or started on another container continues
+    where it left off.
+    """
+    print(f"[AGENT] Creating agent for session: {session_id}", flush=True)
     
+    try:
+        messages = turns_to_agent_messages(load_history_turns(session_id, HISTORY_CONTEXT_TURNS))
     except Exception as e:
-        print(f"[SEARCH] ERROR: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
-        return f"Search error: {str(e)}"
+        print(f"[MEMORY] Error loading history: {e}", flush=True)
+        messages = []
+    
+    agent = agent_warm_pool.take() if agent_warm_pool is not None else None
+    if agent is not None:
+        agent.messages = messages
+        print("[AGENT] Using pre-built agent from the warm pool", flush=True)
+        return agent
+    
+    agent = _build_agent(messages)
+    print(f"[AGENT] Agent created with {len(agent_resources.tools)} tools", flush=True)
+    return agent
+
+
+def _build_agent(messages=None):
+    return Agent(
+        name="TravelPlanningAgent",
+        model=agent_resources.model,
+        tools=agent_resources.tools,
+        system_prompt=agent_resources.system_prompt,
+        messages=messages or []
+    )
+
+
+class AgentWarmPool:
+    """Pool of pre-built, unused agents for sessions that have no agent yet.
+    
+    Building an agent registers and validates its tools; doing that ahead of
+    time keeps it off a new user's first request. The pool is filled by a
+    background thread after startup and topped up whenever an agent is taken.
+    If it is empty, callers build an agent inline as before.
+    """
+    
+    def __init__(self, factory, size):
+        """
+        Args:
+            factory: Zero-argument callable that builds a fresh agent
+            size: Number of agents to keep ready
+        """
+        self._factory = factory
+        self.size = size
+        self._agents = []
+        self._lock = threading.Lock()
+        self._wanted = threading.Event()
+        self._thread = None
+        self.taken = 0
+        self.empty = 0
+        self.built = 0
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._agents)
+    
+    def start(self):
+        """Start the background thread that keeps the pool full."""
+        if self._thread is None and self.size > 0:
+            self._thread = threading.Thread(target=self._run, name="agent-warm-pool", daemon=True)
+            self._thread.start()
+            self._wanted.set()
+    
+    def fill(self):
+        """Build agents until the pool is full."""
+        while True:
+            with self._lock:
+                if len(self._agents) >= self.size:
+                    return
+            try:
+                agent = self._factory()
+            except Exception as e:
+                print(f"[AGENT] Warm pool could not build an agent: {e}", flush=True)
+                return
+            with self._lock:
+                self._agents.append(agent)
+                self.built += 1
+    
+    def take(self):
+        """Return a pre-built agent, or None if the pool is empty."""
+        with self._lock:
+            if self._agents:
+                self.taken += 1
+                agent = self._agents.pop()
+            else:
+                self.empty += 1
+                agent = None
+        self._wanted.set()
+        return agent
+    
+    def stats(self):
+        with self._lock:
+            return {"ready": len(self._agents), "size": self.size, "taken": self.taken,
+                    "empty": self.empty, "built": self.built}
+    
+    def _run(self):
+        while True:
+            self._wanted.wait()
+            self._wanted.clear()
+            self.fill()
 
 
 def get_or_create_agent(session_id: str):
-    """Get or create travel agent for a specific session."""
-    if session_id not in session_agents:
-        print(f"[AGENT] Creating agent for session: {session_id}", flush=True)
-        
-        # Create agent with search tool only
-        tools = [search_web] if tavily_client else []
-        
-        # Configure model with optional guardrails
-        if GUARDRAIL_ID:
-            print(f"[GUARDRAILS] Enabling guardrails: {GUARDRAIL_ID} (version: {GUARDRAIL_VERSION})", flush=True)
-            model = BedrockModel(
-                model_id=MODEL_ID,
-                guardrail_id=GUARDRAIL_ID,
-                guardrail_version=GUARDRAIL_VERSION,
-                guardrail_trace="enabled"
-            )
+    """Get or create travel agent for a specific session.
+    
+    Agents live in a bounded LRU cache, so idle or least recently used
+    sessions are evicted and recreated on their next request.
+    """
+    return session_agents.get_or_create(session_id, lambda: _create_agent(session_id))
+
+
+_startup_step("module_setup")
+
+# Build the shared model and tool registry once at startup
+agent_resources = build_agent_resources()
+_startup_step("agent_resources")
+
+agent_warm_pool = AgentWarmPool(_build_agent, WARM_POOL_SIZE) if WARM_POOL_SIZE > 0 else None
+
+
+def warm_connections():
+    """Open the Memory client's connection before the first request.
+    
+    Reads a session that does not exist; the result is discarded.
+    """
+    start = time.perf_counter()
+    try:
+        memory_client.list_events(
+            memory_id=MEMORY_ID,
+            actor_id="travel-user-warmup",
+            session_id="warmup",
+            branch_name=BRANCH_NAME,
+            max_results=1
+        )
+    except Exception as e:
+        print(f"[STARTUP] Connection warm-up failed: {e}", flush=True)
+    startup_timings["warm_connections"] = time.perf_counter() - start
+
+
+def start_background_warmup():
+    """Fill the warm pool and open connections without delaying readiness."""
+    if agent_warm_pool is not None:
+        agent_warm_pool.start()
+    if WARM_CONNECTIONS:
+        threading.Thread(target=warm_connections, name="warm-connections", daemon=True).start()
+
+
+def record_turn(session_id: str, actor_id: str, user_input: str, result: str):
+    """Bookkeeping after a completed turn: cache sizes, Memory and history."""
+    session_agents.refresh_size(session_id)
+    
+    # Store conversation turn in AgentCore memory (in the background if enabled)
+    turn_messages = [(user_input, "user"), (result, "assistant")]
+    with stage("memory_write"):
+        if memory_writer is not None:
+            memory_writer.submit(actor_id, session_id, turn_messages)
+            print("[MEMORY] Conversation turn queued for storage", flush=True)
         else:
-            print("[GUARDRAILS] No guardrail configured", flush=True)
-            model = MODEL_ID
-        
-        agent = Agent(
-            name="TravelPlanningAgent",
-            model=model,
-            tools=tools
+            print("[MEMORY] Storing conversation turn...", flush=True)
+            try:
+                _write_memory_event(actor_id, session_id, turn_messages)
+                print("[MEMORY] Conversation turn stored successfully", flush=True)
+            except Exception as e:
+                print(f"[MEMORY] Error storing turn: {e}", flush=True)
+    history_cache.append(session_id, user_input, result)
+
+
+def _model_latency_seconds(response):
+    """Model time reported by Strands for an agent call, if available."""
+    metrics = getattr(getattr(response, "metrics", None), "accumulated_metrics", None)
+    latency_ms = metrics.get("latencyMs") if isinstance(metrics, dict) else None
+    if isinstance(latency_ms, (int, float)):
+        return latency_ms / 1000
+    return None
+
+
+def _only_small_talk(messages) -> bool:
+    """True when every user message so far was small talk with a canned reply."""
+    for message in messages:
+        if message.get("role") != "user":
+            continue
+        text = " ".join(
+            block["text"] for block in message.get("content", [])
+            if isinstance(block, dict) and "text" in block
         )
-        
-        search_info = "Use search_web to find real-time travel information." if tavily_client else "Search is currently unavailable."
-        
-        agent.system_prompt = f"""I am a travel planning assistant built by Adam Laszlo.
+        if canned_reply(text) is None:
+            return False
+    return True
 
-I help you plan trips. When planning, I need:
-1. Origin city (where you're traveling from)
-2. Destination city (where you're going)  
-3. Travel dates (specific dates)
 
-Once I have these details, I use search_web to find:
-- Current flight options and prices
-- Hotel recommendations
-- Activities and attractions
+def response_cache_key(agent, user_input: str, payload: dict):
+    """Response cache key for this request, or None when it must run the agent.
+    
+    Only the first turn of a session is cacheable: follow-ups depend on the
+    conversation so far, as do questions that refer to the user's context.
+    Small talk answered with a canned reply ("hi") does not count as a turn.
+    """
+    if response_cache is None:
+        return None
+    key = None
+    if not payload.get("no_cache") and _only_small_talk(getattr(agent, "messages", None) or []):
+        key = response_cache.make_key(user_input)
+    if key is None:
+        response_cache.bypass()
+    return key
 
-{search_info}
 
-I remember our conversation, so you don't need to repeat information you've already told me."""
-        
-        session_agents[session_id] = agent
-        print(f"[AGENT] Agent created with {len(tools)} tools", flush=True)
+def add_cached_turn(agent, user_input: str, answer: str):
+    """Append a turn answered without the model (cache or canned reply) to the agent's conversation."""
+    agent.messages.extend([
+        {"role": "user", "content": [{"text": user_input}]},
+        {"role": "assistant", "content": [{"text": answer}]},
+    ])
+
+
+async def stream_cached_answer(answer: str):
+    """Yield a cached answer as a single chunk."""
+    yield answer
+
+
+async def stream_agent_response(agent, session_id: str, actor_id: str, user_input: str, timer=None,
+                                cache_key=None, ticket=None, route=None, model_id=None):
+    """Yield the agent's text deltas as they are generated.
     
-    return session_agents[session_id]
+    AgentCore sends each yielded chunk to the caller as a server-sent event.
+    The turn is recorded once the stream completes.
+    
+    Args:
+        agent: Session agent
+        session_id: Session ID
+        actor_id: Memory actor ID
+        user_input: Current user message
+        timer: StageTimer of the request, exported when the stream ends
+        cache_key: Response cache key to store the completed answer under
+        ticket: SessionGate ticket released when the stream ends
+        route: Model route of the turn, counted in route_stats with model_id
+        model_id: Model ID the route used
+    
+    Yields:
+        Text chunks of the response
+    """
+    # The generator runs in the app's event loop, outside the entrypoint's context
+    token = _current_timer.set(timer) if timer is not None else None
+    ledger = SearchResultLedger(SEARCH_DEDUP_SIMILARITY)
+    ledger_token = _current_search_ledger.set(ledger)
+    offers_token = _current_offer_index.set(offer_indexes.get(session_id) if offer_indexes else None)
+    parts = []
+    first_chunk = None
+    final = None
+    try:
+        invoke_start = time.perf_counter()
+        try:
+            with stage("agent_invoke"):
+                async for event in agent.stream_async(user_input):
+                    if isinstance(event, dict) and "result" in event:
+                        final = event["result"]
+                    text = event.get("data") if isinstance(event, dict) else None
+                    if text:
+                        if first_chunk is None:
+                            first_chunk = time.perf_counter() - invoke_start
+                            if timer is not None:
+                                timer.add("first_chunk", first_chunk)
+                        parts.append(text)
+                        yield text
+        except Exception as e:
+            print(f"[ENTRYPOINT] ERROR while streaming: {type(e).__name__}: {str(e)}", flush=True)
+            yield f"I apologize, but I encountered an error: {str(e)}"
+            return
+        
+        result = "".join(parts)
+        invoke_seconds = time.perf_counter() - invoke_start
+        record_turn(session_id, actor_id, user_input, result)
+        if route is not None:
+            route_stats.record(route, model_id, invoke_seconds, final)
+        if cache_key is not None:
+            response_cache.set(cache_key, result, invoke_seconds)
+        if ticket is not None:
+            ticket.release(result)
+        print(f"[ENTRYPOINT] Streamed response: {len(result)} characters", flush=True)
+    finally:
+        if ticket is not None:
+            ticket.release()
+        _current_search_ledger.reset(ledger_token)
+        _current_offer_index.reset(offers_token)
+        if timer is not None:
+            _current_timer.reset(token)
+            if ledger.calls:
+                timer.set(**ledger.report())
+            timer.export(action="chat", stream=True)
 
 
 # Define the entrypoint for AgentCore
@@ -167,7 +2777,8 @@ def travel_agent_entrypoint(payload):
         payload: Dictionary with user input and session_id
     
     Returns:
-        String response from the agent or history data
+        String response from the agent or history data, or an async
+        generator of text chunks when the payload sets "stream"
     """
     os.environ['PYTHONUNBUFFERED'] = '1'
     
@@ -176,55 +2787,48 @@ def travel_agent_entrypoint(payload):
     print("=" * 80 + "\n", flush=True)
     sys.stdout.flush()
     
+    # Stage timings are tagged with the Lambda's trace ID so both sides can be joined
+    action = payload.get("action", "")
+    session_id = payload.get("session_id") or payload.get("sessionId", "default_session")
+    timer = StageTimer("runtime", trace_id=payload.get("trace_id"), session_id=session_id)
+    token = _current_timer.set(timer)
+    streaming = False
+    ticket = None
+    
     try:
         print(f"[ENTRYPOINT] Received payload: {payload}", flush=True)
         
         # Check if this is a getHistory action
-        action = payload.get("action", "")
-        session_id = payload.get("session_id") or payload.get("sessionId", "default_session")
         
         if action == "getHistory":
             print(f"[ENTRYPOINT] Handling getHistory action for session: {session_id}", flush=True)
             k = payload.get("k", 3)
             
-            # Build actor_id from session
-            actor_id = f"travel-user-{session_id}"
-            
-            # Load conversation history from AgentCore memory
             try:
-                recent_turns = memory_client.get_last_k_turns(
-                    memory_id=MEMORY_ID,
-                    actor_id=actor_id,
-                    session_id=session_id,
-                    k=k,
-                    branch_name=BRANCH_NAME
-                )
+                # Cursor requests page through the session's Memory events
+                if any(payload.get(key) is not None for key in ("page_size", "before", "after", "since")):
+                    page = page_history_events(
+                        list_session_events(session_id),
+                        int(payload.get("page_size") or k),
+                        before=payload.get("before"),
+                        after=payload.get("after"),
+                        since=payload.get("since"),
+                    )
+                    body = history_page_body(page)
+                    print(f"[ENTRYPOINT] Returning {len(body['messages'])} messages from history page", flush=True)
+                    return json.dumps(body)
                 
-                # Build messages array
-                messages = []
-                for turn in recent_turns:
-                    for message in turn:
-                        role = message.get("role", "").lower()
-                        content = message.get("content", {})
-                        if isinstance(content, dict):
-                            text = content.get("text", "")
-                        else:
-                            text = str(content)
-                        
-                        if role == "user":
-                            messages.append({"role": "user", "content": text})
-                        elif role == "assistant":
-                            messages.append({"role": "assistant", "content": text})
+                # Load the last k turns from the cache or AgentCore memory
+                recent_turns = load_history_turns(session_id, k)
+                messages = turns_to_messages(recent_turns)
                 
                 print(f"[ENTRYPOINT] Returning {len(messages)} messages from history", flush=True)
                 
                 # Return as JSON string
-                import json
                 return json.dumps({"messages": messages})
                 
             except Exception as e:
                 print(f"[ENTRYPOINT] Error loading history: {e}", flush=True)
-                import json
                 return json.dumps({"messages": []})
         
         # Extract user input for regular queries
@@ -239,71 +2843,98 @@ def travel_agent_entrypoint(payload):
         # Build actor_id from session
         actor_id = f"travel-user-{session_id}"
         
-        # Load conversation history from AgentCore memory
-        print("[MEMORY] Loading conversation history...", flush=True)
+        # One turn per session at a time and a bounded number per container
         try:
-            recent_turns = memory_client.get_last_k_turns(
-                memory_id=MEMORY_ID,
-                actor_id=actor_id,
-                session_id=session_id,
-                k=5,
-                branch_name=BRANCH_NAME
-            )
-            
-            # Build context from history
-            context_parts = []
-            if recent_turns and len(recent_turns) > 0:
-                context_parts.append("Previous conversation:")
-                for turn in recent_turns:
-                    for message in turn:
-                        role = message.get("role", "").lower()
-                        content = message.get("content", {})
-                        if isinstance(content, dict):
-                            text = content.get("text", "")
-                        else:
-                            text = str(content)
-                        
-                        if role == "user":
-                            context_parts.append(f"User: {text}")
-                        elif role == "assistant":
-                            context_parts.append(f"Assistant: {text}")
-                
-                context_parts.append(f"\nCurrent request:\nUser: {user_input}")
-                full_input = "\n".join(context_parts)
-                print(f"[MEMORY] Loaded {len(recent_turns)} previous turns", flush=True)
-            else:
-                full_input = user_input
-                print("[MEMORY] No previous conversation history", flush=True)
+            with stage("gate_wait"):
+                ticket, running = session_gate.enter(session_id, user_input)
+        except GateBusy as e:
+            print(f"[GATE] Request not admitted: {e.reason}", flush=True)
+            timer.set(gate=e.reason)
+            return busy_response(e.reason)
+        if running is not None:
+            print("[GATE] Identical message already running, sharing its answer", flush=True)
+            timer.set(gate="coalesced")
+            try:
+                result = running.result(timeout=SESSION_QUEUE_TIMEOUT)
+            except (GateBusy, FutureTimeoutError):
+                return busy_response("session_busy")
+            return stream_cached_answer(result) if payload.get("stream") else result
         
-        except Exception as e:
-            print(f"[MEMORY] Error loading history: {e}", flush=True)
-            full_input = user_input
+        # Get or create agent; new agents are seeded with the session history,
+        # cached agents already hold the conversation in memory
+        with stage("agent_create"):
+            agent = get_or_create_agent(session_id)
+        
+        # Keep the conversation sent to the model within the token budget
+        with stage("context_compact"):
+            compact_agent_context(agent, timer)
+        
+        # Small talk gets a canned reply and planning requests the larger model
+        route, model_id = "default", MODEL_ID
+        if MODEL_ROUTING_ENABLED:
+            route, reply = route_request(user_input, agent.messages)
+            timer.set(route=route)
+            if reply is not None:
+                print("[ROUTER] Canned reply", flush=True)
+                route_stats.record(route, None, 0.0)
+                add_cached_turn(agent, user_input, reply)
+                record_turn(session_id, actor_id, user_input, reply)
+                ticket.release(reply)
+                return stream_cached_answer(reply) if payload.get("stream") else reply
+            model_id = route_model(agent, route)
+            timer.set(model=model_id)
+            print(f"[ROUTER] Route {route} -> {model_id}", flush=True)
+        
+        # Popular first questions are answered from the response cache
+        cache_key = response_cache_key(agent, user_input, payload)
+        if cache_key is not None:
+            cached, match = response_cache.get(cache_key)
+            timer.set(response_cache=match or "miss")
+            if cached is not None:
+                print(f"[ENTRYPOINT] Response cache {match} hit", flush=True)
+                add_cached_turn(agent, user_input, cached)
+                record_turn(session_id, actor_id, user_input, cached)
+                ticket.release(cached)
+                return stream_cached_answer(cached) if payload.get("stream") else cached
         
-        # Get or create agent
-        agent = get_or_create_agent(session_id)
+        # Stream text chunks as they are generated when the caller asks for it
+        if payload.get("stream"):
+            print("[ENTRYPOINT] Streaming agent response...", flush=True)
+            streaming = True
+            stream = stream_agent_response(agent, session_id, actor_id, user_input, timer=timer,
+                                           cache_key=cache_key, ticket=ticket, route=route,
+                                           model_id=model_id)
+            # A stream that is never iterated still frees the session
+            weakref.finalize(stream, ticket.release)
+            return stream
         
-        # Invoke agent with full context
+        # Invoke agent
         print("[ENTRYPOINT] Invoking agent...", flush=True)
-        response = agent(full_input)
+        invoke_start = time.perf_counter()
+        ledger = SearchResultLedger(SEARCH_DEDUP_SIMILARITY)
+        ledger_token = _current_search_ledger.set(ledger)
+        offers_token = _current_offer_index.set(offer_indexes.get(session_id) if offer_indexes else None)
+        try:
+            with stage("agent_invoke"):
+                response = agent(user_input)
+        finally:
+            _current_search_ledger.reset(ledger_token)
+            _current_offer_index.reset(offers_token)
+        if ledger.calls:
+            timer.set(**ledger.report())
+        model_seconds = _model_latency_seconds(response)
+        if model_seconds is not None:
+            timer.add("model", model_seconds)
+        
+        invoke_seconds = time.perf_counter() - invoke_start
+        route_stats.record(route, model_id, invoke_seconds, response)
         
         # Extract text
         result = str(response)
-        
-        # Store conversation turn in AgentCore memory
-        print("[MEMORY] Storing conversation turn...", flush=True)
-        try:
-            memory_client.create_event(
-                memory_id=MEMORY_ID,
-                actor_id=actor_id,
-                session_id=session_id,
-                messages=[
-                    (user_input, "user"),
-                    (result, "assistant")
-                ]
-            )
-            print("[MEMORY] Conversation turn stored successfully", flush=True)
-        except Exception as e:
-            print(f"[MEMORY] Error storing turn: {e}", flush=True)
+        record_turn(session_id, actor_id, user_input, result)
+        if cache_key is not None:
+            response_cache.set(cache_key, result, invoke_seconds)
+        ticket.release(result)
         
         print(f"[ENTRYPOINT] Returning response: {len(result)} characters", flush=True)
         return result
@@ -313,6 +2944,13 @@ def travel_agent_entrypoint(payload):
         import traceback
         traceback.print_exc()
         return f"I apologize, but I encountered an error: {str(e)}"
+    
+    finally:
+        _current_timer.reset(token)
+        if not streaming:
+            if ticket is not None:
+                ticket.release()
+            timer.export(action=action or "chat")
 
 
 # Verify entrypoint
@@ -320,10 +2958,17 @@ print("[RUNTIME] Entrypoint registered successfully!", flush=True)
 print(f"[RUNTIME] Memory ID: {MEMORY_ID}", flush=True)
 print(f"[RUNTIME] Region: {REGION}", flush=True)
 print(f"[RUNTIME] Memory: Built-in AgentCore memory enabled", flush=True)
-print(f"[RUNTIME] Tools: search_web", flush=True)
+tool_names = [getattr(t, "tool_name", None) or getattr(t, "__name__", str(t)) for t in agent_resources.tools]
+print(f"[RUNTIME] Tools: {', '.join(tool_names) or 'none'}", flush=True)
 print("[RUNTIME] Ready to process requests!", flush=True)
 
+_startup_step("entrypoint")
+startup_timings["total"] = time.perf_counter() - _INIT_START
+print(f"[STARTUP] Init timings (ms): {json.dumps({k: round(v * 1000, 1) for k, v in startup_timings.items()})}",
+      flush=True)
+
 # Run the app
 if __name__ == "__main__":
+    start_background_warmup()
     print("[RUNTIME] Starting AgentCore app...", flush=True)
     app.run()
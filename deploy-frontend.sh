@@ -36,7 +36,14 @@ fi
 # Step 1: Update Lambda function
 echo "⚡ Updating Lambda function: $LAMBDA_FUNCTION"
 cd lambda
-zip -q lambda.zip handler.py
+# Ship bytecode for the Lambda's Python version when available: /var/task is
+# read-only, so otherwise handler.py is recompiled on every cold start
+if command -v python3.13 > /dev/null; then
+  python3.13 -c "import py_compile; py_compile.compile('handler.py', invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)"
+  zip -q lambda.zip handler.py __pycache__/handler.cpython-313.pyc
+else
+  zip -q lambda.zip handler.py
+fi
 aws lambda update-function-code \
   --function-name $LAMBDA_FUNCTION \
   --zip-file fileb://lambda.zip \
@@ -23,6 +23,7 @@ const translations = {
         inputPlaceholder: 'Ask about flights, hotels, or activities...',
         welcomeMessage: 'Welcome! I can help you plan flights, hotels, and activities. What would you like to do?',
         errorMessage: 'Sorry, there was an error processing your request. Please try again.',
+        busyMessage: 'Still working on your previous message. Please wait a moment and try again.',
         signInRequired: 'Please sign in to continue',
         noAccount: "Don't have an account?",
         haveAccount: 'Already have an account?'
@@ -39,6 +40,7 @@ const translations = {
         inputPlaceholder: 'Kérdezz repülőjáratokról, szállásokról vagy programokról...',
         welcomeMessage: 'Üdvözöllek! Segíthetek repülőjáratok, szállások és programok tervezésében. Miben segíthetek?',
         errorMessage: 'Sajnálom, hiba történt a kérés feldolgozása során. Kérlek, próbáld újra.',
+        busyMessage: 'Még az előző üzeneteden dolgozom. Kérlek, várj egy kicsit, és próbáld újra.',
         signInRequired: 'Kérlek, jelentkezz be a folytatáshoz',
         noAccount: 'Nincs még fiókod?',
         haveAccount: 'Már van fiókod?'
@@ -205,12 +207,19 @@ async function sendMessage() {
         
         removeMessage(loadingId);
         
+        if (response.status === 429) {
+            // A previous message of this conversation is still being answered
+            addSystemMessage(translations[currentLanguage].busyMessage);
+            return;
+        }
+        
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         
         const data = await response.json();
         addMessage(data.response, 'assistant');
+        appendPendingHistory(message, data.response);
         
     } catch (error) {
         console.error('Error:', error);
@@ -307,51 +316,150 @@ function generateId() {
     return 'msg_' + Date.now() + '_' + Math.random().toString(36).substring(2, 11);
 }
 
+const HISTORY_PAGE_SIZE = 3;  // Memory events per history request (one event may hold several turns)
+const HISTORY_MAX_PAGES = 10;  // Catch-up pages before falling back to the latest page
+const HISTORY_CACHE_MAX_MESSAGES = 50;
+
+function readCachedHistory() {
+    try {
+        return JSON.parse(localStorage.getItem(`history_${sessionId}`)) || null;
+    } catch (e) {
+        return null;
+    }
+}
+
+function writeCachedHistory(messages, after, etag, pending) {
+    try {
+        localStorage.setItem(`history_${sessionId}`, JSON.stringify({
+            messages: messages.slice(-HISTORY_CACHE_MAX_MESSAGES),
+            after: after,
+            etag: etag,
+            pending: (pending || []).slice(-HISTORY_CACHE_MAX_MESSAGES)
+        }));
+    } catch (e) {
+        console.log('Could not cache conversation history:', e);
+    }
+}
+
+function clearCachedHistory() {
+    try {
+        localStorage.removeItem(`history_${sessionId}`);
+    } catch (e) {
+        console.log('Could not clear cached history:', e);
+    }
+}
+
+// Turns sent from this tab are shown on reload until the server history includes them
+function appendPendingHistory(userMessage, assistantMessage) {
+    const cached = readCachedHistory() || { messages: [], after: null, etag: null, pending: [] };
+    const pending = (cached.pending || []).concat([
+        { role: 'user', content: userMessage },
+        { role: 'assistant', content: assistantMessage }
+    ]);
+    writeCachedHistory(cached.messages, cached.after, cached.etag, pending);
+}
+
+// Drop pending messages that the server history now contains
+function unconfirmedPending(pending, fetched) {
+    const remaining = fetched.slice();
+    return (pending || []).filter(message => {
+        const index = remaining.findIndex(m => m.role === message.role && m.content === message.content);
+        if (index === -1) {
+            return true;
+        }
+        remaining.splice(index, 1);
+        return false;
+    });
+}
+
+async function fetchHistoryPage(request, etag) {
+    const headers = {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${currentUser.access_token}`,
+    };
+    if (etag) {
+        headers['If-None-Match'] = etag;
+    }
+    return fetch(API_URL, {
+        method: 'POST',
+        headers: headers,
+        body: JSON.stringify(request)
+    });
+}
+
 async function loadConversationHistory() {
     try {
         console.log('Loading conversation history for session:', sessionId);
         console.log('Current language when loading history:', currentLanguage);
-        console.log('Welcome message will be:', translations[currentLanguage].welcomeMessage);
         
-        const response = await fetch(API_URL, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'Authorization': `Bearer ${currentUser.access_token}`,
-            },
-            body: JSON.stringify({
-                action: 'getHistory',
-                sessionId: sessionId,
-                k: 3  // Get last 3 turns (6 messages)
-            })
-        });
-
-        if (!response.ok) {
-            console.log('No history available or error loading history');
-            addSystemMessage(translations[currentLanguage].welcomeMessage);
-            return;
+        // Only fetch events newer than the cached ones; otherwise the latest page
+        let cached = readCachedHistory();
+        let messages = cached ? cached.messages : [];
+        let pending = cached ? (cached.pending || []) : [];
+        let after = cached ? cached.after : null;
+        let etag = cached ? cached.etag : null;
+        let fetched = [];
+        let caughtUp = false;
+        
+        // Follow the cursor until the server has no newer events
+        for (let page = 0; page < HISTORY_MAX_PAGES; page++) {
+            const request = { action: 'getHistory', sessionId: sessionId, page_size: HISTORY_PAGE_SIZE };
+            if (after) {
+                request.after = after;
+            }
+            const response = await fetchHistoryPage(request, page === 0 ? etag : null);
+            if (response.status === 304) {
+                console.log('Conversation history unchanged');
+                caughtUp = true;
+                break;
+            }
+            if (!response.ok) {
+                console.log('No history available or error loading history');
+                // Keep the pages read so far; the cursor already points past them
+                messages = messages.concat(fetched);
+                caughtUp = true;
+                break;
+            }
+            const data = await response.json();
+            const cursor = data.cursor || {};
+            etag = response.headers.get('ETag');
+            // Messages are returned oldest first; a reset means the cached cursor is gone
+            if (!request.after || data.reset) {
+                messages = data.messages || [];
+                fetched = messages.slice();
+                after = cursor.after || null;
+                caughtUp = true;
+                break;
+            }
+            fetched = fetched.concat(data.messages || []);
+            after = cursor.after || after;
+            if (!data.has_more) {
+                messages = messages.concat(fetched);
+                caughtUp = true;
+                break;
+            }
         }
-
-        const data = await response.json();
-        const messages = data.messages || [];
+        
+        // Too far behind: show the latest page instead of the whole backlog
+        if (!caughtUp) {
+            console.log('Cached history is too far behind, loading the latest page');
+            clearCachedHistory();
+            const response = await fetchHistoryPage(
+                { action: 'getHistory', sessionId: sessionId, page_size: HISTORY_PAGE_SIZE }, null);
+            const data = response.ok ? await response.json() : {};
+            messages = data.messages || [];
+            fetched = messages.slice();
+            after = (data.cursor || {}).after || null;
+            etag = response.ok ? response.headers.get('ETag') : null;
+        }
+        
+        pending = unconfirmedPending(pending, fetched);
+        writeCachedHistory(messages, after, etag, pending);
+        messages = messages.concat(pending);
         
         if (messages.length > 0) {
             console.log(`Loading ${messages.length} previous messages`);
-            
-            // Group messages into pairs (user + assistant)
-            const pairs = [];
-            for (let i = 0; i < messages.length; i += 2) {
-                if (messages[i] && messages[i + 1]) {
-                    pairs.push([messages[i], messages[i + 1]]);
-                }
-            }
-            
-            // Reverse pairs for LIFO, but keep user-assistant order within each pair
-            pairs.reverse().forEach(pair => {
-                addMessage(pair[0].content, pair[0].role); // user
-                addMessage(pair[1].content, pair[1].role); // assistant
-            });
-            
+            messages.forEach(message => addMessage(message.content, message.role));
             console.log('Conversation history loaded successfully');
         } else {
             console.log('No previous conversation history found');
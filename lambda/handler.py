@@ -1,13 +1,24 @@
 """Lambda proxy function that calls AgentCore Runtime."""
 
+import base64
 import json
 import os
-import uuid
-import boto3
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
 from typing import Dict, Any
 
-# Initialize Bedrock AgentCore client
-agent_core_client = boto3.client('bedrock-agentcore')
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # Spans are only emitted when an OpenTelemetry layer is present
+    otel_trace = None
+
+# Bedrock AgentCore client, created on first use by get_agent_core_client()
+agent_core_client = None
+_agent_core_client_lock = threading.Lock()
 
 # Get AgentCore Runtime ARN from environment
 AGENT_RUNTIME_ARN = os.environ.get("AGENT_RUNTIME_ARN")
@@ -17,10 +28,339 @@ MEMORY_ID = os.environ.get("MEMORY_ID", "memory_rllrl-lfg7zBH6MH")
 BRANCH_NAME = os.environ.get("BRANCH_NAME", "main")
 REGION = os.environ.get("REGION", "eu-central-1")
 
+# Ask the runtime to stream the response as server-sent events. Off by default:
+# the Lambda still returns one JSON body, so streaming only pays off once the
+# Function URL streams to the browser (RESPONSE_STREAM plus a streaming reader)
+AGENT_STREAMING = os.environ.get("AGENT_STREAMING", "false").lower() == "true"
+
+# Runtime replies that mean "not admitted, retry later" (answered with HTTP 429)
+RUNTIME_BUSY_ERRORS = ("session_busy", "overloaded")
+
+# Logging: level, fraction of requests logged at DEBUG, max characters per field
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0"))
+LOG_MAX_FIELD_CHARS = int(os.environ.get("LOG_MAX_FIELD_CHARS", "256"))
+
+# AgentCore client connection settings. The read timeout stays below the
+# Lambda timeout (300s) so a hung invocation surfaces as an error response.
+AGENTCORE_CONNECT_TIMEOUT = float(os.environ.get("AGENTCORE_CONNECT_TIMEOUT", "5"))
+AGENTCORE_READ_TIMEOUT = float(os.environ.get("AGENTCORE_READ_TIMEOUT", "290"))
+AGENTCORE_MAX_POOL_CONNECTIONS = int(os.environ.get("AGENTCORE_MAX_POOL_CONNECTIONS", "10"))
+AGENTCORE_MAX_ATTEMPTS = int(os.environ.get("AGENTCORE_MAX_ATTEMPTS", "3"))
+AGENTCORE_RETRY_MODE = os.environ.get("AGENTCORE_RETRY_MODE", "adaptive")
+AGENTCORE_TCP_KEEPALIVE = os.environ.get("AGENTCORE_TCP_KEEPALIVE", "true").lower() == "true"
+
+# Read history straight from AgentCore Memory (ListEvents) instead of
+# invoking the runtime; the runtime is only used as a fallback
+HISTORY_DIRECT_READ = os.environ.get("HISTORY_DIRECT_READ", "true").lower() == "true"
+HISTORY_MAX_EVENTS = int(os.environ.get("HISTORY_MAX_EVENTS", "100"))
+
+# Per-stage timings: JSON lines are appended here when set (e.g. /tmp/stages.jsonl)
+STAGE_TIMINGS_FILE = os.environ.get("STAGE_TIMINGS_FILE")
+
+_LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+
+def _random_fraction():
+    """Uniform float in [0, 1) for log sampling, without importing random."""
+    return int.from_bytes(os.urandom(7), "big") / (1 << 56)
+
+
+class RequestLogger:
+    """Structured logger for a single request.
+    
+    Fields are collected while the request is handled and written as one
+    JSON line when it finishes. Debug records (payload dumps and the like)
+    are only written when LOG_LEVEL is DEBUG or the request is sampled via
+    LOG_SAMPLE_RATE. String fields are truncated to LOG_MAX_FIELD_CHARS.
+    """
+    
+    def __init__(self, context=None, level=None, sample_rate=None, max_field_chars=None):
+        level = _LOG_LEVELS.get(level or LOG_LEVEL, 20)
+        sample_rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.max_field_chars = LOG_MAX_FIELD_CHARS if max_field_chars is None else max_field_chars
+        self.sampled = level > 10 and sample_rate > 0 and _random_fraction() < sample_rate
+        self.debug_enabled = level <= 10 or self.sampled
+        self.min_level = 10 if self.debug_enabled else level
+        self.request_id = getattr(context, "aws_request_id", None)
+        self.fields = {}
+        self.level = "INFO"
+        self._start = time.perf_counter()
+    
+    def _truncate(self, value):
+        if isinstance(value, str) and len(value) > self.max_field_chars:
+            return f"{value[:self.max_field_chars]}...(+{len(value) - self.max_field_chars} chars)"
+        return value
+    
+    def _write(self, level, message, fields):
+        record = {"level": level, "message": message, "request_id": self.request_id}
+        record.update({key: self._truncate(value) for key, value in fields.items()})
+        print(json.dumps(record, default=str))
+    
+    def set(self, **fields):
+        """Add fields to the request summary line."""
+        self.fields.update(fields)
+    
+    def debug(self, message, **fields):
+        """Write a debug record immediately, if debug is enabled for this request."""
+        if self.debug_enabled:
+            self._write("DEBUG", message, fields)
+    
+    def warning(self, message, **fields):
+        """Record a warning in the request summary."""
+        if _LOG_LEVELS["WARNING"] >= self.min_level:
+            self.fields.setdefault("warnings", []).append(message)
+            self.fields.update(fields)
+            if self.level == "INFO":
+                self.level = "WARNING"
+    
+    def error(self, message, exc=None, **fields):
+        """Record an error (and optionally its traceback) in the request summary."""
+        self.level = "ERROR"
+        self.fields["error"] = message
+        if exc is not None:
+            self.fields["error_type"] = type(exc).__name__
+            import traceback  # Only needed on the error path
+            self.fields["traceback"] = "".join(traceback.format_exception(exc))[-2000:]
+        self.fields.update(fields)
+    
+    def emit(self, response):
+        """Write the single summary line for the request."""
+        fields = dict(self.fields)
+        fields["status"] = response.get("statusCode")
+        fields["response_bytes"] = len(response.get("body", ""))
+        fields["duration_ms"] = round((time.perf_counter() - self._start) * 1000, 1)
+        traceback_text = fields.pop("traceback", None)
+        record = {"level": self.level, "message": "request", "request_id": self.request_id}
+        record.update({key: self._truncate(value) for key, value in fields.items()})
+        if traceback_text:
+            record["traceback"] = traceback_text
+        if _LOG_LEVELS.get(self.level, 20) >= self.min_level:
+            print(json.dumps(record, default=str))
+
+_NON_WHITESPACE_RE = re.compile(r"\S")
+
+
+class ThinkingTagFilter:
+    """Incrementally remove <thinking>...</thinking> blocks from text.
+    
+    Chunks are fed one at a time. Tags split across chunk boundaries are
+    handled by holding back only the few trailing characters that could
+    still turn into a tag, so the extra memory is bounded by the tag length
+    rather than the response size. Whitespace following a closing tag is
+    dropped. A block that is never closed is dropped up to the end of the
+    text, since a stream cannot wait for the rest of the response to decide.
+    
+    Works the same for buffered responses via strip_thinking().
+    """
+    
+    OPEN_TAG = "<thinking>"
+    CLOSE_TAG = "</thinking>"
+    
+    def __init__(self):
+        self._pending = ""
+        self._inside = False
+        self._skip_whitespace = False
+    
+    @staticmethod
+    def _partial_tag_length(text: str, start: int, tag: str) -> int:
+        """Length of the suffix of text[start:] that is a proper prefix of tag.
+        
+        Tags contain a single '<', so only a suffix starting at the last '<'
+        can be a candidate.
+        """
+        index = text.rfind("<", max(start, len(text) - len(tag) + 1))
+        if index == -1 or not tag.startswith(text[index:]):
+            return 0
+        return len(text) - index
+    
+    def feed(self, chunk: str) -> str:
+        """Consume a chunk and return the text that is safe to emit."""
+        text = self._pending + chunk if self._pending else chunk
+        self._pending = ""
+        output = []
+        pos = 0
+        end = len(text)
+        while pos < end:
+            if self._skip_whitespace:
+                match = _NON_WHITESPACE_RE.search(text, pos)
+                if match is None:
+                    break
+                pos = match.start()
+                self._skip_whitespace = False
+            
+            if self._inside:
+                close = text.find(self.CLOSE_TAG, pos)
+                if close == -1:
+                    keep = self._partial_tag_length(text, pos, self.CLOSE_TAG)
+                    self._pending = text[end - keep:] if keep else ""
+                    break
+                pos = close + len(self.CLOSE_TAG)
+                self._inside = False
+                self._skip_whitespace = True
+            else:
+                open_ = text.find(self.OPEN_TAG, pos)
+                if open_ == -1:
+                    keep = self._partial_tag_length(text, pos, self.OPEN_TAG)
+                    output.append(text[pos:end - keep])
+                    self._pending = text[end - keep:] if keep else ""
+                    break
+                output.append(text[pos:open_])
+                pos = open_ + len(self.OPEN_TAG)
+                self._inside = True
+        return "".join(output)
+    
+    def flush(self) -> str:
+        """Return any held-back text at the end of the stream."""
+        pending, self._pending = self._pending, ""
+        return "" if self._inside else pending
+
+
+def strip_thinking(text: str) -> str:
+    """Remove thinking blocks from a complete response."""
+    thinking_filter = ThinkingTagFilter()
+    return thinking_filter.feed(text) + thinking_filter.flush()
+
+
+def iter_event_stream_text(body):
+    """Yield text chunks from a server-sent event stream returned by AgentCore.
+    
+    The runtime emits each chunk as ``data: <json string>``; non-JSON data
+    lines are passed through as-is.
+    """
+    if hasattr(body, 'iter_lines'):
+        lines = body.iter_lines()
+    else:
+        lines = body.read().splitlines()
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.startswith('data:'):
+            continue
+        data = line[5:].lstrip()
+        try:
+            chunk = json.loads(data)
+        except json.JSONDecodeError:
+            chunk = data
+        if isinstance(chunk, str):
+            yield chunk
+        elif isinstance(chunk, dict) and chunk.get('error'):
+            raise Exception(f"Agent stream error: {chunk['error']}")
+
+
+def iter_clean_response_chunks(body):
+    """Yield response text from an AgentCore event stream with thinking blocks removed."""
+    thinking_filter = ThinkingTagFilter()
+    for chunk in iter_event_stream_text(body):
+        cleaned = thinking_filter.feed(chunk)
+        if cleaned:
+            yield cleaned
+    tail = thinking_filter.flush()
+    if tail:
+        yield tail
+
+
+def create_agent_core_client():
+    """Create a bedrock-agentcore client with explicit connection settings.
+    
+    boto3 is imported here rather than at module load so that cold starts
+    which never reach AgentCore (health checks, CORS preflight, validation
+    errors) do not pay for it.
+    """
+    import boto3
+    from botocore.config import Config
+    
+    config = Config(
+        connect_timeout=AGENTCORE_CONNECT_TIMEOUT,
+        read_timeout=AGENTCORE_READ_TIMEOUT,
+        max_pool_connections=AGENTCORE_MAX_POOL_CONNECTIONS,
+        retries={"mode": AGENTCORE_RETRY_MODE, "max_attempts": AGENTCORE_MAX_ATTEMPTS},
+        tcp_keepalive=AGENTCORE_TCP_KEEPALIVE,
+    )
+    return boto3.client('bedrock-agentcore', config=config)
+
+
+def get_agent_core_client():
+    """Return the shared AgentCore client, creating it on first use.
+    
+    The client is kept for the lifetime of the execution environment so
+    warm invocations reuse its connection pool.
+    """
+    global agent_core_client
+    if agent_core_client is None:
+        with _agent_core_client_lock:
+            if agent_core_client is None:
+                agent_core_client = create_agent_core_client()
+    return agent_core_client
+
+
+def new_trace_context():
+    """Create a W3C trace ID and the traceparent header passed to AgentCore.
+    
+    Returns:
+        Tuple of (trace_id, traceparent)
+    """
+    if otel_trace is not None:
+        span_context = otel_trace.get_current_span().get_span_context()
+        if span_context.is_valid:
+            trace_id = format(span_context.trace_id, "032x")
+            return trace_id, f"00-{trace_id}-{format(span_context.span_id, '016x')}-01"
+    trace_id = os.urandom(16).hex()
+    return trace_id, f"00-{trace_id}-{os.urandom(8).hex()}-01"
+
+
+class StageTimer:
+    """Wall-clock timings for the stages of one request.
+    
+    Each stage is also recorded as an OpenTelemetry span when OpenTelemetry
+    is available, and the totals are appended to STAGE_TIMINGS_FILE as one
+    JSON line per request for offline p50/p99 breakdowns.
+    """
+    
+    def __init__(self, component, trace_id=None):
+        self.component = component
+        self.trace_id = trace_id
+        self.stages = {}
+        self._tracer = otel_trace.get_tracer(__name__) if otel_trace is not None else None
+        self._start = time.perf_counter()
+    
+    @contextmanager
+    def stage(self, name):
+        """Time a block of code as the named stage."""
+        span = self._tracer.start_as_current_span(name) if self._tracer else nullcontext()
+        start = time.perf_counter()
+        try:
+            with span:
+                yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+    
+    def add(self, name, seconds):
+        self.stages[name] = round(self.stages.get(name, 0.0) + seconds * 1000, 2)
+    
+    def export(self, **fields):
+        """Append this request's timings to STAGE_TIMINGS_FILE, if configured."""
+        if not STAGE_TIMINGS_FILE:
+            return
+        record = {
+            "component": self.component,
+            "trace_id": self.trace_id,
+            "total_ms": round((time.perf_counter() - self._start) * 1000, 2),
+            "stages": self.stages,
+        }
+        record.update(fields)
+        try:
+            with open(STAGE_TIMINGS_FILE, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError:
+            pass
+
 
 def lambda_handler(event: Dict[str, Any], context: Any):
     """Handle Lambda Function URL requests and invoke AgentCore Runtime.
     
+    Writes one structured log line per request.
+    
     Args:
         event: Lambda Function URL event
         context: Lambda context
@@ -28,7 +368,22 @@ def lambda_handler(event: Dict[str, Any], context: Any):
     Returns:
         Lambda Function URL response
     """
-    print(f"Received event: {json.dumps(event)}")
+    log = RequestLogger(context)
+    trace_id, traceparent = new_trace_context()
+    timer = StageTimer("lambda", trace_id=trace_id)
+    response = _handle_request(event, log, timer, traceparent)
+    if timer.stages:
+        log.set(trace_id=trace_id, stages_ms=timer.stages)
+        timer.export(status=response.get("statusCode"))
+    log.emit(response)
+    return response
+
+
+def _handle_request(event: Dict[str, Any], log: RequestLogger, timer: StageTimer,
+                    traceparent: str) -> Dict[str, Any]:
+    """Route a request and invoke AgentCore Runtime."""
+    if log.debug_enabled:
+        log.debug("Received event", event=json.dumps(event))
     
     # Handle CORS preflight for Lambda Function URL
     request_context = event.get('requestContext', {})
@@ -38,15 +393,15 @@ def lambda_handler(event: Dict[str, Any], context: Any):
     if not http_method:
         http_method = event.get('httpMethod', 'POST')
     
-    print(f"HTTP Method: {http_method}")
+    log.set(method=http_method)
     
     if http_method == 'OPTIONS':
-        print("Handling OPTIONS request")
         return create_response(200, {})
     
     # Handle GET requests (health check only)
     if http_method == 'GET':
         path = event.get('rawPath', event.get('path', '/'))
+        log.set(path=path)
         if path == '/health':
             return create_response(200, {
                 "status": "healthy",
@@ -58,180 +413,407 @@ def lambda_handler(event: Dict[str, Any], context: Any):
     
     try:
         # Parse request body
-        body_str = event.get("body", "{}")
-        print(f"Raw body: {body_str}")
-        
-        # Handle base64 encoded body
-        if event.get("isBase64Encoded", False):
-            import base64
-            body_str = base64.b64decode(body_str).decode('utf-8')
-            print(f"Decoded body: {body_str}")
-        
-        body = json.loads(body_str)
+        with timer.stage("parse_body"):
+            body_str = event.get("body", "{}")
+            
+            # Handle base64 encoded body
+            if event.get("isBase64Encoded", False):
+                body_str = base64.b64decode(body_str).decode('utf-8')
+            log.debug("Request body", body=body_str)
+            
+            body = json.loads(body_str)
         action = body.get("action", "")
         message = body.get("message", "")
         session_id = body.get("session_id") or body.get("sessionId", "default-session")
         
-        print(f"Parsed - Action: {action}, Message: {message}, Session: {session_id}")
+        log.set(action=action or "chat", session_id=session_id, message_chars=len(message))
         
         # Handle getHistory action
         if action == "getHistory":
-            return handle_get_history(session_id, body.get("k", 3))
+            cursor = {key: body.get(key) for key in ("page_size", "before", "after", "since")}
+            return handle_get_history(session_id, body.get("k", 3), log=log, timer=timer,
+                                      traceparent=traceparent, cursor=cursor,
+                                      if_none_match=_request_header(event, "if-none-match"))
         
         if not message:
-            print("ERROR: Missing message in request")
+            log.warning("Missing message in request")
             return create_response(400, {"error": "Missing message"})
         
-        print(f"Invoking AgentCore Runtime: {AGENT_RUNTIME_ARN}")
-        print(f"Session: {session_id}, Message: {message}")
-        
-        # Generate trace ID
-        trace_id = str(uuid.uuid4())[:8]
-        
         # Prepare payload as JSON bytes
         # AgentCore entrypoint expects 'input' and 'session_id' keys
         # Note: Using both sessionId and session_id for compatibility
         payload = json.dumps({
             "input": message,
             "sessionId": session_id,
-            "session_id": session_id
+            "session_id": session_id,
+            "stream": AGENT_STREAMING,
+            "trace_id": timer.trace_id
         }).encode('utf-8')
         
-        print(f"Payload: {payload.decode('utf-8')}")
+        log.debug("Invoking AgentCore Runtime", runtime_arn=AGENT_RUNTIME_ARN, payload=payload.decode('utf-8'))
         
-        # Invoke AgentCore Runtime
-        response = agent_core_client.invoke_agent_runtime(
-            agentRuntimeArn=AGENT_RUNTIME_ARN,
-            traceId=trace_id,
-            payload=payload
-        )
+        # Invoke AgentCore Runtime; the runtime session ID routes every turn of a
+        # session to the same container, which holds its agent and history
+        with timer.stage("invoke_agent_runtime"):
+            response = get_agent_core_client().invoke_agent_runtime(
+                agentRuntimeArn=AGENT_RUNTIME_ARN,
+                traceId=timer.trace_id,
+                traceParent=traceparent,
+                runtimeSessionId=to_runtime_session_id(session_id),
+                payload=payload
+            )
         
         # Parse response
-        result = ""
+        with timer.stage("read_response"):
+            result, already_cleaned = _read_agent_response(response, log)
         
-        # AgentCore returns response in 'response' field
-        if 'response' in response:
-            response_data = response['response']
-            
-            # Check if it's a StreamingBody object
-            if hasattr(response_data, 'read'):
-                # It's a streaming body, read it
-                result = response_data.read().decode('utf-8')
-                # Try to parse as JSON in case it's JSON-encoded
-                try:
-                    result = json.loads(result)
-                except (json.JSONDecodeError, TypeError):
-                    pass  # It's not JSON, use as-is
-            elif isinstance(response_data, list):
-                # It's a list of strings
-                result = ''.join(response_data)
-            elif isinstance(response_data, str):
-                # It's already a string
-                result = response_data
-            else:
-                # Convert to string as fallback
-                result = str(response_data)
-        # Fallback: try to read from body as event stream
-        elif 'body' in response:
-            event_stream = response['body']
-            try:
-                for event_data in event_stream:
-                    # Handle different event types
-                    if 'chunk' in event_data:
-                        chunk_bytes = event_data['chunk'].get('bytes', b'')
-                        if chunk_bytes:
-                            result += chunk_bytes.decode('utf-8')
-                    elif 'internalServerException' in event_data:
-                        raise Exception(f"Internal server error: {event_data['internalServerException']}")
-                    elif 'throttlingException' in event_data:
-                        raise Exception(f"Throttling error: {event_data['throttlingException']}")
-            except Exception as e:
-                print(f"Error reading event stream: {e}")
-                # Try reading body directly
-                if hasattr(event_stream, 'read'):
-                    result = event_stream.read().decode('utf-8')
+        # The runtime answers busy sessions or containers with an error object
+        if isinstance(result, dict) and result.get("error") in RUNTIME_BUSY_ERRORS:
+            log.warning("Runtime busy", busy_reason=result["error"])
+            return create_response(429, {
+                "error": result.get("message") or result["error"],
+                "reason": result["error"],
+                "session_id": session_id
+            }, headers={"Retry-After": str(result.get("retry_after", 1))})
         
-        print(f"Response received: {len(result)} characters")
-        print(f"Response keys: {list(response.keys())}")
-        print(f"Full response structure: {type(response)}")
-        print(f"Result content: {result[:200] if result else 'EMPTY'}")  # First 200 chars
+        log.set(result_chars=len(result))
+        log.debug("Response received", response_keys=list(response.keys()), result=result)
         
         if not result:
-            print("WARNING: Empty result from AgentCore")
-            print(f"Raw response['response']: {response.get('response', 'NOT FOUND')}")
+            log.warning("Empty result from AgentCore")
         
         # Clean up the response
-        cleaned_result = result
-        
-        # Remove <thinking> tags and their content
-        import re
-        cleaned_result = re.sub(r'<thinking>.*?</thinking>\s*', '', cleaned_result, flags=re.DOTALL)
-        
-        # Remove any leading/trailing whitespace
-        cleaned_result = cleaned_result.strip()
+        with timer.stage("clean_response"):
+            cleaned_result = result
+            
+            # Remove <thinking> tags and their content
+            if not already_cleaned:
+                cleaned_result = strip_thinking(cleaned_result)
+            
+            # Remove any leading/trailing whitespace
+            cleaned_result = cleaned_result.strip()
         
-        print(f"Cleaned result: {len(cleaned_result)} characters")
+        log.set(cleaned_chars=len(cleaned_result))
         
-        final_response = create_response(200, {
+        return create_response(200, {
             "response": cleaned_result if cleaned_result else "No response from agent",
             "session_id": session_id
         })
-        
-        print(f"Returning response with status: {final_response['statusCode']}")
-        print(f"Response body length: {len(final_response['body'])}")
-        
-        return final_response
     
     except Exception as e:
-        print(f"Error invoking AgentCore Runtime: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.error(f"Error invoking AgentCore Runtime: {str(e)}", exc=e)
         return create_response(500, {"error": str(e)})
 
 
-def handle_get_history(session_id: str, k: int = 3) -> Dict[str, Any]:
-    """Load conversation history from AgentCore memory by invoking the runtime.
+def to_runtime_session_id(session_id: str) -> str:
+    """Runtime session ID for a chat session (at least 33 characters, zero padded)."""
+    if len(session_id) < 33:
+        return session_id + '0' * (33 - len(session_id))
+    return session_id
+
+
+def _read_agent_response(response: Dict[str, Any], log: RequestLogger):
+    """Read the agent's reply from an invoke_agent_runtime response.
+    
+    Returns:
+        Tuple of (result, already_cleaned); streamed replies are cleaned of
+        thinking blocks while they are read
+    """
+    result = ""
+    already_cleaned = False
+    
+    # Streamed responses are consumed chunk by chunk as they arrive, with
+    # thinking blocks filtered on the fly
+    if 'response' in response and 'text/event-stream' in response.get('contentType', ''):
+        stream_start = time.perf_counter()
+        chunks = []
+        for chunk in iter_clean_response_chunks(response['response']):
+            if not chunks:
+                log.set(first_chunk_ms=round((time.perf_counter() - stream_start) * 1000, 1))
+            chunks.append(chunk)
+        result = ''.join(chunks)
+        already_cleaned = True
+    # AgentCore returns response in 'response' field
+    elif 'response' in response:
+        response_data = response['response']
+        
+        # Check if it's a StreamingBody object
+        if hasattr(response_data, 'read'):
+            # It's a streaming body, read it
+            result = response_data.read().decode('utf-8')
+            # Try to parse as JSON in case it's JSON-encoded
+            try:
+                result = json.loads(result)
+            except (json.JSONDecodeError, TypeError):
+                pass  # It's not JSON, use as-is
+        elif isinstance(response_data, list):
+            # It's a list of strings
+            result = ''.join(response_data)
+        elif isinstance(response_data, str):
+            # It's already a string
+            result = response_data
+        else:
+            # Convert to string as fallback
+            result = str(response_data)
+    # Fallback: try to read from body as event stream
+    elif 'body' in response:
+        event_stream = response['body']
+        try:
+            for event_data in event_stream:
+                # Handle different event types
+                if 'chunk' in event_data:
+                    chunk_bytes = event_data['chunk'].get('bytes', b'')
+                    if chunk_bytes:
+                        result += chunk_bytes.decode('utf-8')
+                elif 'internalServerException' in event_data:
+                    raise Exception(f"Internal server error: {event_data['internalServerException']}")
+                elif 'throttlingException' in event_data:
+                    raise Exception(f"Throttling error: {event_data['throttlingException']}")
+        except Exception as e:
+            log.warning("Error reading event stream", stream_error=str(e))
+            # Try reading body directly
+            if hasattr(event_stream, 'read'):
+                result = event_stream.read().decode('utf-8')
+    
+    
+    return result, already_cleaned
+
+
+def turns_to_messages(turns):
+    """Flatten memory turns into [{"role", "content"}] chat messages.
+    
+    Same normalization as turns_to_messages in the runtime, so both history
+    paths return identical messages.
+    """
+    messages = []
+    for turn in turns:
+        for message in turn:
+            role = message.get("role", "").lower()
+            if role in ("user", "assistant"):
+                content = message.get("content", {})
+                text = content.get("text", "") if isinstance(content, dict) else str(content)
+                messages.append({"role": role, "content": text})
+    return messages
+
+
+def list_session_events(session_id: str):
+    """Read a session's conversation events from AgentCore Memory, oldest first.
+    
+    Uses the runtime's actor ID and branch (no branch filter for "main"),
+    and follows ListEvents pages up to HISTORY_MAX_EVENTS events.
+    """
+    client = get_agent_core_client()
+    events = []
+    kwargs = {
+        "memoryId": MEMORY_ID,
+        "sessionId": session_id,
+        "actorId": f"travel-user-{session_id}",
+        "includePayloads": True,
+        "maxResults": min(HISTORY_MAX_EVENTS, 100),
+    }
+    # Like MemoryClient.list_events: main-branch events have no branch name,
+    # so filtering on "main" would match nothing
+    if BRANCH_NAME != "main":
+        kwargs["filter"] = {"branch": {"name": BRANCH_NAME, "includeParentBranches": False}}
+    while len(events) < HISTORY_MAX_EVENTS:
+        page = client.list_events(**kwargs)
+        events.extend(page.get("events", []))
+        if not page.get("nextToken"):
+            break
+        kwargs["nextToken"] = page["nextToken"]
+    return sorted(events, key=_event_time)
+
+
+def _event_time(event) -> float:
+    """Timestamp of a Memory event (datetime, epoch number or ISO string) as epoch seconds."""
+    value = event.get("eventTimestamp")
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return 0.0
+
+
+def events_to_turns(events):
+    """Group Memory events (oldest first) into turns, starting a turn at each USER message.
+    
+    Same grouping as MemoryClient.get_last_k_turns and the runtime.
+    """
+    turns = []
+    for event in events:
+        for item in event.get("payload", []):
+            message = item.get("conversational")
+            if not message:
+                continue
+            if message.get("role") == "USER" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+    return turns
+
+
+def page_history_events(events, page_size, before=None, after=None, since=None):
+    """Select one page of a session's events; same semantics as the runtime.
+    
+    Args:
+        events: All events of the session, oldest first
+        page_size: Maximum number of events in the page
+        before: Event ID; return the newest events older than it
+        after: Event ID; return the oldest events newer than it
+        since: Epoch seconds or ISO timestamp; return the oldest events after it
+    
+    Returns:
+        Dict with the page's "events" (oldest first), "has_more" and "reset"
+        (the cursor event no longer exists; the latest page is returned)
+    """
+    ids = [event.get("eventId") for event in events]
+    reset = False
+    if after is not None or since is not None:
+        if after is not None and after not in ids:
+            reset = True
+        else:
+            if after is not None:
+                start = ids.index(after) + 1
+            else:
+                threshold = _event_time({"eventTimestamp": since})
+                start = next((i for i, event in enumerate(events) if _event_time(event) > threshold), len(events))
+            return {"events": events[start:start + page_size],
+                    "has_more": start + page_size < len(events), "reset": False}
+    
+    end = len(events)
+    if before is not None:
+        if before in ids:
+            end = ids.index(before)
+        else:
+            reset = True
+    start = max(0, end - page_size)
+    return {"events": events[start:end], "has_more": start > 0, "reset": reset}
+
+
+def history_page_body(page):
+    """Build the getHistory response body for a page of events."""
+    events = page["events"]
+    return {
+        "messages": turns_to_messages(events_to_turns(events)),
+        "cursor": {
+            "before": events[0].get("eventId") if events else None,
+            "after": events[-1].get("eventId") if events else None,
+            "timestamp": _event_time(events[-1]) if events else None,
+        },
+        "has_more": page["has_more"],
+        "reset": page["reset"],
+    }
+
+
+def _request_header(event: Dict[str, Any], name: str):
+    """Return a request header (case-insensitive), or None."""
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def history_etag(session_id: str, events, k: int, cursor: Dict[str, Any]) -> str:
+    """Version token for a history response.
+    
+    Built from the session, the number of events and the newest event's ID
+    and timestamp, plus the page size. The before/after/since cursor is left
+    out: a client that reloads with the cursor of its last response asks for
+    the same history, which is unchanged while no new event was written.
+    """
+    view = ["page", int(cursor.get("page_size") or k)] if cursor else ["turns", k]
+    last = [events[-1].get("eventId"), _event_time(events[-1])] if events else None
+    fingerprint = json.dumps([session_id, view, last], sort_keys=True, default=str)
+    return f'W/"{len(events)}-{zlib.crc32(fingerprint.encode("utf-8")):08x}"'
+
+
+def handle_get_history(session_id: str, k: int = 3, log: RequestLogger = None,
+                       timer: StageTimer = None, traceparent: str = None,
+                       cursor: Dict[str, Any] = None, if_none_match: str = None) -> Dict[str, Any]:
+    """Load conversation history from AgentCore memory.
+    
+    History is read directly from Memory; if that fails (or is disabled),
+    the runtime is invoked with the getHistory action instead.
+    
+    Without cursor parameters the last k turns are returned. With any of
+    page_size, before, after (event IDs) or since (timestamp) one page of
+    events is returned together with a cursor for the next request.
+    
+    Responses read from Memory carry an ETag; a request whose If-None-Match
+    matches it gets a 304 without a body.
     
     Args:
         session_id: Session ID
         k: Number of turns to retrieve
+        cursor: Optional page_size/before/after/since parameters
+        if_none_match: If-None-Match request header
+        log: Request logger (a new one is used if omitted)
+        timer: Stage timer of the request (a new one is used if omitted)
+        traceparent: W3C traceparent passed to AgentCore
         
     Returns:
         Lambda response with conversation history
     """
+    log = log or RequestLogger()
+    if timer is None:
+        trace_id, traceparent = new_trace_context()
+        timer = StageTimer("lambda", trace_id=trace_id)
+    cursor = {key: value for key, value in (cursor or {}).items() if value is not None}
+    log.set(history_k=k, history_cursor=sorted(cursor) or None)
+    if HISTORY_DIRECT_READ and MEMORY_ID:
+        try:
+            with timer.stage("list_events"):
+                events = list_session_events(session_id)
+            etag = history_etag(session_id, events, k, cursor)
+            if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+                log.set(history_source="memory", history_not_modified=True)
+                return create_response(304, None, headers={"ETag": etag})
+            if cursor:
+                body = history_page_body(page_history_events(
+                    events, int(cursor.get("page_size") or k),
+                    before=cursor.get("before"), after=cursor.get("after"), since=cursor.get("since")))
+            else:
+                body = {"messages": turns_to_messages(events_to_turns(events)[-k:] if k > 0 else [])}
+            body["session_id"] = session_id
+            log.set(history_source="memory", history_messages=len(body["messages"]))
+            return create_response(200, body, headers={"ETag": etag})
+        except Exception as e:
+            log.warning("Direct history read failed, falling back to the runtime",
+                        error_type=type(e).__name__, history_error=str(e))
+    
     try:
-        print(f"Loading history for session: {session_id}, k={k}")
-        
-        # Generate trace ID
-        trace_id = str(uuid.uuid4())[:8]
-        
-        # Ensure session_id is at least 33 characters (AWS requirement)
-        # Pad with zeros if needed
-        runtime_session_id = session_id
-        if len(runtime_session_id) < 33:
-            runtime_session_id = runtime_session_id + '0' * (33 - len(runtime_session_id))
+        log.set(history_source="runtime")
         
-        print(f"Runtime session ID (padded): {runtime_session_id} (length: {len(runtime_session_id)})")
+        runtime_session_id = to_runtime_session_id(session_id)
+        log.debug("Runtime session ID (padded)", runtime_session_id=runtime_session_id)
         
         # Prepare payload for AgentCore to get history
         payload = json.dumps({
             "action": "getHistory",
             "sessionId": session_id,
             "session_id": session_id,
-            "k": k
+            "k": k,
+            "trace_id": timer.trace_id,
+            **cursor
         }).encode('utf-8')
         
-        print(f"Invoking AgentCore Runtime for history: {AGENT_RUNTIME_ARN}")
-        
         # Invoke AgentCore Runtime with getHistory action
-        response = agent_core_client.invoke_agent_runtime(
-            agentRuntimeArn=AGENT_RUNTIME_ARN,
-            traceId=trace_id,
-            runtimeSessionId=runtime_session_id,
-            payload=payload
-        )
-        
-        print(f"History response received: {type(response)}")
+        with timer.stage("invoke_agent_runtime"):
+            response = get_agent_core_client().invoke_agent_runtime(
+                agentRuntimeArn=AGENT_RUNTIME_ARN,
+                traceId=timer.trace_id,
+                traceParent=traceparent,
+                runtimeSessionId=runtime_session_id,
+                payload=payload
+            )
         
         # Process the response
         result = ""
@@ -249,7 +831,7 @@ def handle_get_history(session_id: str, k: int = 3) -> Dict[str, Any]:
             else:
                 result = str(response_data)
         
-        print(f"History result: {result}")
+        log.debug("History result", result=result)
         
         # Parse the result - it should be JSON with messages
         if isinstance(result, str):
@@ -258,23 +840,18 @@ def handle_get_history(session_id: str, k: int = 3) -> Dict[str, Any]:
             except:
                 pass
         
-        # Extract messages from result
-        if isinstance(result, dict):
-            messages = result.get('messages', [])
-        else:
-            messages = []
+        # Extract messages (and the page cursor, if any) from result
+        body = {key: result[key] for key in ("messages", "cursor", "has_more", "reset")
+                if isinstance(result, dict) and key in result}
+        body.setdefault("messages", [])
+        body["session_id"] = session_id
         
-        print(f"Loaded {len(messages)} messages from history")
+        log.set(history_messages=len(body["messages"]))
         
-        return create_response(200, {
-            "messages": messages,
-            "session_id": session_id
-        })
+        return create_response(200, body)
         
     except Exception as e:
-        print(f"Error loading history: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.error(f"Error loading history: {str(e)}", exc=e)
         # Return empty history on error (don't fail the app)
         return create_response(200, {
             "messages": [],
@@ -282,22 +859,24 @@ def handle_get_history(session_id: str, k: int = 3) -> Dict[str, Any]:
         })
 
 
-def create_response(status_code: int, body: Dict[str, Any]) -> Dict[str, Any]:
+def create_response(status_code: int, body: Dict[str, Any], headers: Dict[str, str] = None) -> Dict[str, Any]:
     """Create Lambda Function URL response.
     
     Args:
         status_code: HTTP status code
-        body: Response body
+        body: Response body (None for an empty body, e.g. 304)
+        headers: Extra response headers
         
     Returns:
         Lambda Function URL response
     """
     # Lambda Function URL handles CORS automatically, so we only need Content-Type
+    response_headers = {"Content-Type": "application/json"}
+    if headers:
+        response_headers.update(headers)
     return {
         "statusCode": status_code,
-        "headers": {
-            "Content-Type": "application/json",
-        },
-        "body": json.dumps(body),
+        "headers": response_headers,
+        "body": json.dumps(body) if body is not None else "",
         "isBase64Encoded": False,
     }
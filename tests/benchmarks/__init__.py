@@ -0,0 +1,5 @@
+"""Local benchmarks for the Lambda handler and AgentCore runtime.
+
+Benchmarks are plain scripts (not collected by pytest). Run them with
+``python -m tests.benchmarks.<module>`` from the repository root.
+"""
@@ -0,0 +1,61 @@
+"""Benchmark first-turn agent creation with and without shared resources.
+
+Compares building the model, tools and prompt for every new session (the
+previous behaviour) against reusing the process-wide AgentResources.
+
+    python -m tests.benchmarks.bench_agent_creation --sessions 200 --model-init-ms 40
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+from tests.benchmarks import stubs
+
+
+def measure(create, sessions):
+    samples = []
+    for i in range(sessions):
+        start = time.perf_counter()
+        create(f"bench-session-{i:05d}")
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    print(f"{label:<22} mean={statistics.mean(samples):8.3f}ms "
+          f"p50={stubs.percentile(samples, 50):8.3f}ms p99={stubs.percentile(samples, 99):8.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--model-init-ms', type=float, default=40.0,
+                        help='Simulated BedrockModel construction cost')
+    args = parser.parse_args()
+
+    stubs.Latency.model_init = args.model_init_ms / 1000.0
+    with contextlib.redirect_stdout(io.StringIO()):
+        runtime = stubs.import_runtime({'SESSION_CACHE_MAX_ENTRIES': str(args.sessions * 2)})
+
+    def per_session(session_id):
+        resources = runtime.build_agent_resources()
+        return runtime.Agent(name="TravelPlanningAgent", model=resources.model,
+                             tools=resources.tools, system_prompt=resources.system_prompt)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rebuilt = measure(per_session, args.sessions)
+        shared = measure(runtime.get_or_create_agent, args.sessions)
+
+    print(f"First-turn agent creation over {args.sessions} sessions "
+          f"(model init {args.model_init_ms}ms):")
+    report("per-session model", rebuilt)
+    report("shared resources", shared)
+    saved = statistics.mean(rebuilt) - statistics.mean(shared)
+    print(f"Saved {saved:.3f}ms per new session")
+
+
+if __name__ == '__main__':
+    main()
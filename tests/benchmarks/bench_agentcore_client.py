@@ -0,0 +1,150 @@
+"""Benchmark the Lambda's AgentCore client: default vs tuned botocore config.
+
+Runs the real boto3 client (boto3 must be installed) against a local HTTP
+server standing in for the bedrock-agentcore endpoint, with fake
+credentials. Measures, for each client configuration:
+
+- cold start: a fresh interpreter importing handler and serving its first
+  chat request (plus the import time alone, which no longer includes boto3)
+- warm invokes: sequential requests reusing the client
+- concurrent invokes: threads sharing one client, which is where the
+  connection pool size matters
+
+    python -m tests.benchmarks.bench_agentcore_client --cold-runs 5 --requests 200 --threads 32 --latency-ms 50
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tests.benchmarks import stubs
+
+LATENCY = {'seconds': 0.0}
+
+CLIENT_FACTORIES = {
+    'default': "lambda: __import__('boto3').client('bedrock-agentcore')",
+    'tuned': None,
+}
+
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {lambda_dir!r})
+import handler
+imported = time.perf_counter()
+factory = {factory}
+if factory is not None:
+    handler.create_agent_core_client = factory
+event = {{'requestContext': {{'http': {{'method': 'POST'}}}},
+         'body': json.dumps({{'message': 'Plan a trip', 'session_id': 'cold-start'}})}}
+response = handler.lambda_handler(event, None)
+assert response['statusCode'] == 200, response
+done = time.perf_counter()
+sys.stderr.write(json.dumps({{'import_ms': (imported - start) * 1000, 'total_ms': (done - start) * 1000}}))
+"""
+
+
+class _AgentCoreHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(LATENCY['seconds'])
+        body = json.dumps("Here is your trip plan.").encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_endpoint():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _AgentCoreHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def bench_env(endpoint):
+    return {
+        'AWS_ACCESS_KEY_ID': 'bench', 'AWS_SECRET_ACCESS_KEY': 'bench', 'AWS_DEFAULT_REGION': 'eu-central-1',
+        'AWS_ENDPOINT_URL_BEDROCK_AGENTCORE': endpoint,
+        'AGENT_RUNTIME_ARN': 'arn:aws:bedrock-agentcore:eu-central-1:123456789012:runtime/bench',
+        'AGENT_STREAMING': 'false', 'LOG_LEVEL': 'ERROR',
+    }
+
+
+def cold_start(name, env, runs):
+    samples = {'import_ms': [], 'total_ms': []}
+    script = COLD_START_SCRIPT.format(lambda_dir=stubs.LAMBDA_DIR, factory=CLIENT_FACTORIES[name])
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, '-c', script], env={**os.environ, **env},
+                              capture_output=True, text=True, check=True)
+        result = json.loads(proc.stderr.strip().splitlines()[-1])
+        for key in samples:
+            samples[key].append(result[key])
+    return {key: statistics.median(values) for key, values in samples.items()}
+
+
+def warm(handler, requests, threads):
+    event = {'requestContext': {'http': {'method': 'POST'}},
+             'body': json.dumps({'message': 'Plan a trip', 'session_id': 'warm'})}
+    handler.lambda_handler(event, None)  # create the client and open a connection
+
+    def one(_):
+        start = time.perf_counter()
+        handler.lambda_handler(event, None)
+        return (time.perf_counter() - start) * 1000
+
+    sequential = [one(i) for i in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        concurrent = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    return sequential, concurrent, requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cold-runs', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='Simulated AgentCore latency')
+    args = parser.parse_args()
+
+    try:
+        import boto3
+        import botocore  # noqa: F401
+    except ImportError:
+        sys.exit("boto3 and botocore are required: pip install boto3")
+
+    LATENCY['seconds'] = args.latency_ms / 1000.0
+    server, endpoint = start_endpoint()
+    env = bench_env(endpoint)
+    os.environ.update(env)
+
+    print(f"AgentCore stand-in at {endpoint}, latency {args.latency_ms}ms")
+    for name in CLIENT_FACTORIES:
+        cold = cold_start(name, env, args.cold_runs)
+        handler = stubs.import_handler()
+        if name == 'default':
+            handler.create_agent_core_client = lambda: boto3.client('bedrock-agentcore')
+        sequential, concurrent, throughput = warm(handler, args.requests, args.threads)
+        print(f"{name:<8} cold: import={cold['import_ms']:7.1f}ms first request={cold['total_ms']:7.1f}ms | "
+              f"warm p50={stubs.percentile(sequential, 50):6.1f}ms p99={stubs.percentile(sequential, 99):6.1f}ms | "
+              f"{args.threads} threads p99={stubs.percentile(concurrent, 99):7.1f}ms {throughput:7.1f} req/s")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
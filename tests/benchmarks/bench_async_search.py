@@ -0,0 +1,85 @@
+"""Benchmark sync vs async (pooled) Tavily search under concurrent sessions.
+
+Starts a local stub of the Tavily search endpoint and drives it with the
+blocking per-request client pattern used by the sync path and with the
+runtime's AsyncTavilyClient. Requires aiohttp for the async half.
+
+    python -m tests.benchmarks.bench_async_search --sessions 64 --queries 4 --latency-ms 150
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from tests.benchmarks import stubs
+
+
+def sync_search(url, query):
+    # New connection per request, like the default sync client
+    request = urllib.request.Request(
+        url, data=json.dumps({"query": query, "max_results": 5}).encode('utf-8'),
+        headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def run_sync(url, queries, workers):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda q: sync_search(url, q), queries))
+    return time.perf_counter() - start
+
+
+def run_async(runtime, url, queries, concurrency):
+    client = runtime.AsyncTavilyClient(api_key="bench", api_url=url,
+                                       max_concurrency=concurrency, pool_size=concurrency)
+
+    async def drive():
+        await asyncio.gather(*[client.search(q) for q in queries])
+
+    # Warm the pool once, then time
+    asyncio.run(client.search("warmup"))
+    start = time.perf_counter()
+    asyncio.run(drive())
+    elapsed = time.perf_counter() - start
+    client.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sessions', type=int, default=64)
+    parser.add_argument('--queries', type=int, default=4, help='Searches per session')
+    parser.add_argument('--latency-ms', type=float, default=150.0, help='Stub server latency')
+    parser.add_argument('--workers', type=int, default=16,
+                        help='Sync worker threads / async concurrency limit')
+    args = parser.parse_args()
+
+    stubs.Latency.search = args.latency_ms / 1000.0
+    server, url = stubs.start_stub_tavily_server()
+    queries = [f"flights session {s} query {q}" for s in range(args.sessions) for q in range(args.queries)]
+
+    try:
+        sync_elapsed = run_sync(url, queries, args.workers)
+        print(f"sync  : {len(queries)} searches in {sync_elapsed:.2f}s "
+              f"({len(queries) / sync_elapsed:.1f} req/s)")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            runtime = stubs.import_runtime({'TAVILY_API_URL': url})
+        if runtime.aiohttp is None:
+            print("async : skipped (aiohttp not installed)")
+            return
+        async_elapsed = run_async(runtime, url, queries, args.workers)
+        print(f"async : {len(queries)} searches in {async_elapsed:.2f}s "
+              f"({len(queries) / async_elapsed:.1f} req/s)")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Benchmark first-turn latency for new sessions with and without the warm pool.
+
+New sessions arrive one after another (with a gap between arrivals); each
+sends two turns. Compares the first turn with WARM_POOL_SIZE=0, the first
+turn with a warm pool, and the second (warm) turn. Also prints the
+runtime's container init timings.
+
+    python -m tests.benchmarks.bench_first_turn --sessions 100 --pool-size 4 --agent-init-ms 30 --gap-ms 20
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+from tests.benchmarks import stubs
+
+
+def run(pool_size, args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        runtime = stubs.import_runtime({'WARM_POOL_SIZE': str(pool_size), 'WARM_CONNECTIONS': 'false',
+                                        'SESSION_CACHE_MAX_ENTRIES': str(args.sessions * 2)})
+        runtime.start_background_warmup()
+        time.sleep(0.5 + pool_size * args.agent_init_ms / 1000.0)
+
+    first, warm = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(args.sessions):
+            session_id = f"bench-new-{pool_size}-{i:05d}"
+            for samples in (first, warm):
+                start = time.perf_counter()
+                runtime.travel_agent_entrypoint({'input': 'Plan a weekend in Lisbon', 'session_id': session_id})
+                samples.append((time.perf_counter() - start) * 1000)
+            time.sleep(args.gap_ms / 1000.0)
+    return runtime, first, warm
+
+
+def report(label, samples):
+    print(f"{label:<26} p50={stubs.percentile(samples, 50):8.2f}ms p99={stubs.percentile(samples, 99):8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--agent-init-ms', type=float, default=30.0, help='Simulated agent construction cost')
+    parser.add_argument('--memory-ms', type=float, default=0.0, help='Simulated Memory read latency')
+    parser.add_argument('--gap-ms', type=float, default=20.0, help='Time between new sessions')
+    args = parser.parse_args()
+
+    stubs.Latency.agent_init = args.agent_init_ms / 1000.0
+    stubs.Latency.memory_read = args.memory_ms / 1000.0
+
+    _, cold_first, warm_turns = run(0, args)
+    runtime, pooled_first, _ = run(args.pool_size, args)
+
+    print(f"{args.sessions} new sessions, agent init {args.agent_init_ms}ms, arrivals every {args.gap_ms}ms:")
+    report("first turn, no pool", cold_first)
+    report(f"first turn, pool of {args.pool_size}", pooled_first)
+    report("warm turn", warm_turns)
+    print(f"pool stats: {runtime.agent_warm_pool.stats()}")
+    print("init timings (ms): " + ", ".join(f"{name}={seconds * 1000:.1f}"
+                                             for name, seconds in runtime.startup_timings.items()))
+
+
+if __name__ == '__main__':
+    main()
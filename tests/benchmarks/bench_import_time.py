@@ -0,0 +1,69 @@
+"""Profile the Lambda handler's cold import with -X importtime.
+
+Imports handler in a fresh interpreter (as a Lambda cold start does),
+prints the slowest imports and fails if the cumulative import time exceeds
+the budget. Bytecode is not written, matching the read-only /var/task of
+a zip deployment without __pycache__.
+
+    python -m tests.benchmarks.bench_import_time --budget-ms 100 --runs 5
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+from tests.benchmarks import stubs
+
+# Imported lazily by the handler; none of these should load at init
+LAZY_MODULES = ('boto3', 'botocore', 'traceback', 'random', 'uuid')
+
+IMPORT_BUDGET_MS = float(os.environ.get("HANDLER_IMPORT_BUDGET_MS", "100"))
+
+
+def profile_import(module='handler', path=stubs.LAMBDA_DIR):
+    """Import a module in a fresh interpreter with -X importtime.
+    
+    Returns:
+        Tuple of (total_ms, [(cumulative_ms, name), ...], lazy modules that were loaded)
+    """
+    script = (f"import sys; sys.path.insert(0, {path!r}); import {module}; "
+              f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))")
+    env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], env=env,
+                          capture_output=True, text=True, check=True)
+    imports = []
+    total_ms = None
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        cumulative_ms = int(cumulative) / 1000
+        imports.append((cumulative_ms, name.rstrip()))
+        if name.strip() == module:
+            total_ms = cumulative_ms
+    loaded = [m for m in proc.stdout.strip().split(',') if m]
+    return total_ms, imports, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--runs', type=int, default=5, help='Report the fastest of this many imports')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [profile_import() for _ in range(args.runs)]
+    total_ms, imports, loaded = min(runs, key=lambda run: run[0])
+    print(f"Slowest imports (cumulative ms) of the fastest of {args.runs} runs:")
+    for cumulative_ms, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"  {cumulative_ms:8.2f}  {name}")
+    print(f"handler import: {total_ms:.2f}ms (budget {args.budget_ms:.0f}ms)")
+    if loaded:
+        print(f"Loaded at init but expected lazily: {', '.join(loaded)}")
+    if total_ms > args.budget_ms or loaded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Benchmark Lambda handler latency and log volume for long inputs.
+
+Runs lambda_handler against a fake AgentCore client and counts the bytes
+written to stdout (what CloudWatch would ingest). Compares the structured
+logger at INFO and DEBUG, and optionally the handler at an older git ref.
+
+    python -m tests.benchmarks.bench_lambda_logging --message-kb 16 --requests 500 --baseline-ref e062b0f
+"""
+
+import argparse
+import contextlib
+import json
+import statistics
+import time
+
+from tests.benchmarks import stubs
+
+
+def make_event(message):
+    return {
+        'requestContext': {'http': {'method': 'POST'}},
+        'body': json.dumps({'message': message, 'session_id': 'bench-session'}),
+        'isBase64Encoded': False,
+    }
+
+
+def run(label, module, event, requests):
+    module.agent_core_client = stubs.FakeAgentCoreClient()
+    counter = stubs.ByteCounter()
+    samples = []
+    with contextlib.redirect_stdout(counter):
+        for _ in range(requests):
+            start = time.perf_counter()
+            module.lambda_handler(event, None)
+            samples.append((time.perf_counter() - start) * 1000)
+    print(f"{label:<16} mean={statistics.mean(samples):7.3f}ms p99={stubs.percentile(samples, 99):7.3f}ms "
+          f"log={counter.bytes / requests:9.0f} bytes/request ({counter.lines / requests:.1f} lines)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--message-kb', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--baseline-ref', help='Git ref of a handler.py to compare against')
+    args = parser.parse_args()
+
+    event = make_event("I want to travel from Budapest to Paris. " * (args.message_kb * 1024 // 42))
+
+    if args.baseline_ref:
+        stubs.import_handler()  # registers a boto3 placeholder if needed
+        baseline = stubs.import_module_at_ref('lambda/handler.py', args.baseline_ref, 'handler_baseline')
+        run(f"{args.baseline_ref[:12]}", baseline, event, args.requests)
+
+    for level in ('INFO', 'DEBUG'):
+        handler = stubs.import_handler({'LOG_LEVEL': level})
+        run(f"LOG_LEVEL={level}", handler, event, args.requests)
+
+
+if __name__ == '__main__':
+    main()
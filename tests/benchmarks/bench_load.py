@@ -0,0 +1,233 @@
+"""Load test the Lambda and runtime with many concurrent sessions.
+
+Drives lambda_handler, travel_agent_entrypoint, or both chained in-process
+(the Lambda's AgentCore client calls the runtime entrypoint directly)
+against the fakes in stubs.py. Bedrock, Memory and Tavily latencies are
+configurable. Reports p50/p95/p99 latency, throughput and RSS growth, and
+can save results as JSON and compare them with a run from another commit.
+
+    python -m tests.benchmarks.bench_load --target e2e --sessions 2000 --concurrency 500 \\
+        --turns 3 --model-ms 200 --memory-ms 30 --search-ms 150 --search-rate 0.5 --repeat 3 --save head.json
+    git checkout <older commit> && python -m tests.benchmarks.bench_load ... --save base.json
+    python -m tests.benchmarks.bench_load ... --compare base.json --max-regression 10
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tests.benchmarks import stubs
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'rss_growth_mb')
+
+
+def rss_mb():
+    """Current resident set size of this process in MB."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        import resource
+        # Peak RSS; KB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class RuntimeAgentCoreClient:
+    """AgentCore client that invokes the runtime entrypoint in-process.
+    
+    Streamed replies are re-encoded as server-sent events, as AgentCore does.
+    """
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    def invoke_agent_runtime(self, agentRuntimeArn=None, payload=b'{}', **kwargs):
+        result = self.runtime.travel_agent_entrypoint(json.loads(payload))
+        if hasattr(result, '__aiter__'):
+            async def collect():
+                return [chunk async for chunk in result]
+            events = ''.join(f"data: {json.dumps(chunk)}\n\n" for chunk in asyncio.run(collect()))
+            return {'response': stubs.FakeStreamingBody(events.encode('utf-8')),
+                    'contentType': 'text/event-stream'}
+        return {'response': stubs.FakeStreamingBody(json.dumps(result).encode('utf-8')),
+                'contentType': 'application/json'}
+
+
+def lambda_event(session_id, message):
+    return {
+        'requestContext': {'http': {'method': 'POST'}},
+        'body': json.dumps({'message': message, 'session_id': session_id}),
+        'isBase64Encoded': False,
+    }
+
+
+def build_target(args, env):
+    """Return a callable(session_id, message) for the chosen target."""
+    runtime = None
+    if args.target in ('runtime', 'e2e'):
+        runtime = stubs.import_runtime(env)
+
+    if args.target == 'runtime':
+        return runtime, lambda session_id, message: runtime.travel_agent_entrypoint(
+            {'input': message, 'session_id': session_id})
+
+    handler = stubs.import_handler(env)
+    client = RuntimeAgentCoreClient(runtime) if runtime else stubs.FakeAgentCoreClient()
+    handler.agent_core_client = client
+
+    def call(session_id, message):
+        response = handler.lambda_handler(lambda_event(session_id, message), None)
+        if response['statusCode'] != 200:
+            raise RuntimeError(response['body'])
+        return response
+    return runtime, call
+
+
+def run_load(args, env):
+    with contextlib.redirect_stdout(stubs.ByteCounter()):
+        runtime, call = build_target(args, env)
+
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def session(index):
+        session_id = f"load-session-{index:06d}"
+        local = []
+        for turn in range(args.turns):
+            message = f"Plan day {turn + 1} of a trip to city {index % 50} in October"
+            start = time.perf_counter()
+            try:
+                call(session_id, message)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                continue
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            samples.extend(local)
+
+    rss_before = rss_mb()
+    log_bytes = stubs.ByteCounter()
+    with contextlib.redirect_stdout(log_bytes):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(session, range(args.sessions)))
+        elapsed = time.perf_counter() - start
+        if runtime is not None and runtime.memory_writer is not None:
+            runtime.memory_writer.flush(timeout=30)
+    rss_after = rss_mb()
+
+    requests = len(samples) + len(errors)
+    return {
+        'commit': git_commit(),
+        'target': args.target,
+        'sessions': args.sessions,
+        'turns': args.turns,
+        'concurrency': args.concurrency,
+        'latency_ms': {'model': args.model_ms, 'memory': args.memory_ms, 'search': args.search_ms},
+        'search_rate': args.search_rate,
+        'requests': requests,
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'p50_ms': round(stubs.percentile(samples, 50), 2),
+        'p95_ms': round(stubs.percentile(samples, 95), 2),
+        'p99_ms': round(stubs.percentile(samples, 99), 2),
+        'throughput_rps': round(requests / elapsed, 1) if elapsed else 0.0,
+        'rss_growth_mb': round(rss_after - rss_before, 1),
+        'log_bytes_per_request': round(log_bytes.bytes / requests) if requests else 0,
+    }
+
+
+def compare(result, baseline, max_regression):
+    """Print metric deltas against a baseline; return True if within budget."""
+    ok = True
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    if baseline.get('target') != result.get('target'):
+        print(f"  warning: baseline target is {baseline.get('target')}, this run is {result.get('target')}")
+    for metric in METRICS:
+        old, new = baseline.get(metric), result.get(metric)
+        if not old:
+            continue
+        change = (new - old) / old * 100
+        # Throughput regresses when it drops; everything else when it grows
+        regressed = -change if metric == 'throughput_rps' else change
+        flag = ''
+        if metric != 'rss_growth_mb' and regressed > max_regression:
+            flag = '  REGRESSION'
+            ok = False
+        print(f"  {metric:<16} {old:>10} -> {new:>10} ({change:+.1f}%){flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=('lambda', 'runtime', 'e2e'), default='e2e')
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--turns', type=int, default=3, help='Sequential turns per session')
+    parser.add_argument('--concurrency', type=int, default=200, help='Sessions in flight at once')
+    parser.add_argument('--model-ms', type=float, default=100.0, help='Simulated Bedrock call latency')
+    parser.add_argument('--memory-ms', type=float, default=20.0, help='Simulated Memory read/write latency')
+    parser.add_argument('--search-ms', type=float, default=100.0, help='Simulated Tavily latency')
+    parser.add_argument('--search-rate', type=float, default=0.3, help='Fraction of turns that search')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Runtime/Lambda environment overrides (repeatable)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Run the load this many times and report the median of each metric')
+    parser.add_argument('--save', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON file from an earlier run')
+    parser.add_argument('--max-regression', type=float, default=10.0,
+                        help='Allowed %% regression in latency/throughput when comparing')
+    args = parser.parse_args()
+
+    stubs.Latency.model_call = args.model_ms / 1000.0
+    stubs.Latency.memory_read = stubs.Latency.memory_write = args.memory_ms / 1000.0
+    stubs.Latency.search = args.search_ms / 1000.0
+    stubs.FakeAgent.search_rate = args.search_rate
+    env = {'SESSION_CACHE_MAX_ENTRIES': str(max(args.sessions, 1)),
+           'HISTORY_CACHE_MAX_SESSIONS': str(max(args.sessions, 1)),
+           'SEARCH_ASYNC_ENABLED': 'false'}
+    env.update(item.split('=', 1) for item in args.env)
+
+    runs = [run_load(args, env) for _ in range(max(args.repeat, 1))]
+    result = dict(runs[-1])
+    for metric in METRICS:
+        result[metric] = statistics.median(run[metric] for run in runs)
+    result['runs'] = len(runs)
+    result['errors'] = sum(run['errors'] for run in runs)
+    print(f"{result['target']}: {result['requests']} requests from {args.sessions} sessions "
+          f"(concurrency {args.concurrency}) x {len(runs)} runs, {result['errors']} errors")
+    print(f"  p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms "
+          f"throughput={result['throughput_rps']} req/s RSS +{result['rss_growth_mb']}MB")
+    for error in result['error_samples']:
+        print(f"  error: {error}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark the incremental thinking-tag filter against the regex cleanup.
+
+Builds a multi-hundred-KB response with interleaved <thinking> blocks and
+compares the previous buffered regex, the filter on the buffered text and
+the filter fed in stream-sized chunks, reporting time and peak memory.
+
+    python -m tests.benchmarks.bench_thinking_filter --size-kb 500 --chunk-size 64
+"""
+
+import argparse
+import re
+import time
+import tracemalloc
+
+from tests.benchmarks import stubs
+
+THINKING_RE = re.compile(r'<thinking>.*?</thinking>\s*', flags=re.DOTALL)
+
+
+def build_response(size_kb):
+    block = ("<thinking>Compare the Ryanair and Wizz Air fares, then check hotel "
+             "availability near the old town.</thinking>\n"
+             + "1. Ryanair BUD-CDG on 2025-10-12 for EUR 89, direct, 2h 25m. "
+               "Source: https://example.com/flights/ryanair\n" * 3)
+    return block * max(1, size_kb * 1024 // len(block))
+
+
+def measure(label, fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        output = fn()
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    # Memory is traced in a separate run; tracing slows allocations down
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<18} {elapsed:8.2f}ms  peak {peak / 1024:8.1f}KB")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-kb', type=int, default=500)
+    parser.add_argument('--chunk-size', type=int, default=64, help='Characters per streamed chunk')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    handler = stubs.import_handler()
+    text = build_response(args.size_kb)
+    chunks = [text[i:i + args.chunk_size] for i in range(0, len(text), args.chunk_size)]
+
+    def streamed():
+        thinking_filter = handler.ThinkingTagFilter()
+        size = 0
+        for chunk in chunks:
+            size += len(thinking_filter.feed(chunk))
+        return size + len(thinking_filter.flush())
+
+    print(f"Response: {len(text) / 1024:.0f}KB, {len(chunks)} chunks of {args.chunk_size} chars")
+    expected = measure("regex (buffered)", lambda: THINKING_RE.sub('', text), args.repeat)
+    actual = measure("filter (buffered)", lambda: handler.strip_thinking(text), args.repeat)
+    streamed_size = measure("filter (streamed)", streamed, args.repeat)
+    assert actual == expected and streamed_size == len(expected), "filter output differs from regex"
+
+
+if __name__ == '__main__':
+    main()
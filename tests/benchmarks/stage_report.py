@@ -0,0 +1,59 @@
+"""Summarize per-stage timings written to STAGE_TIMINGS_FILE.
+
+Reads the JSON lines appended by the Lambda and the runtime, prints
+p50/p95/p99 per component and stage, and joins the two sides by trace ID
+to show how much of the Lambda's invoke time the runtime accounts for.
+
+    python -m tests.benchmarks.stage_report /tmp/stages.jsonl [more files...]
+"""
+
+import argparse
+import json
+from collections import defaultdict
+
+from tests.benchmarks import stubs
+
+
+def load_records(paths):
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="+", help="JSON-lines timing files")
+    args = parser.parse_args()
+    
+    records = load_records(args.files)
+    samples = defaultdict(list)
+    for record in records:
+        samples[(record["component"], "total")].append(record["total_ms"])
+        for name, ms in record.get("stages", {}).items():
+            samples[(record["component"], name)].append(ms)
+    
+    print(f"{'component':<10} {'stage':<22} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for (component, name), values in sorted(samples.items()):
+        print(f"{component:<10} {name:<22} {len(values):>6} "
+              f"{stubs.percentile(values, 50):9.1f} {stubs.percentile(values, 95):9.1f} "
+              f"{stubs.percentile(values, 99):9.1f}")
+    
+    # Time spent between the Lambda and the runtime (network, AgentCore routing)
+    runtime_totals = {r["trace_id"]: r["total_ms"] for r in records
+                      if r["component"] == "runtime" and r.get("trace_id")}
+    overhead = [r["stages"]["invoke_agent_runtime"] + r["stages"].get("read_response", 0) - runtime_totals[r["trace_id"]]
+                for r in records
+                if r["component"] == "lambda" and r.get("trace_id") in runtime_totals
+                and "invoke_agent_runtime" in r.get("stages", {})]
+    if overhead:
+        print(f"\nJoined {len(overhead)} requests by trace ID; invoke overhead outside the runtime: "
+              f"p50={stubs.percentile(overhead, 50):.1f}ms p99={stubs.percentile(overhead, 99):.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""Local stand-ins for strands, bedrock_agentcore and tavily.
+
+The runtime module imports these packages at load time. Benchmarks install
+lightweight fakes with configurable latency so that the runtime's own
+overhead can be measured without AWS credentials or network access.
+"""
+
+import asyncio
+import importlib
+import importlib.util
+import inspect
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AGENTCORE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'agentcore'))
+LAMBDA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'lambda'))
+
+
+class Latency:
+    """Simulated latencies in seconds, shared by all fakes."""
+    model_init = 0.0
+    agent_init = 0.0
+    model_call = 0.0
+    memory_read = 0.0
+    memory_write = 0.0
+    search = 0.0
+
+
+class FakeBedrockModel:
+    def __init__(self, model_id=None, **kwargs):
+        # Stands in for boto client creation and credential resolution
+        time.sleep(Latency.model_init)
+        self.model_id = model_id
+        self.config = kwargs
+
+
+class FakeAgentResult:
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+
+class FakeAgent:
+    # Fraction of turns that call the first tool (search) before replying
+    search_rate = 0.0
+
+    def __init__(self, name=None, model=None, tools=None, system_prompt=None, messages=None, **kwargs):
+        # Stands in for tool registration and validation
+        time.sleep(Latency.agent_init)
+        if isinstance(model, str):
+            model = FakeBedrockModel(model_id=model)
+        self.name = name
+        self.model = model
+        self.tools = tools or []
+        self.system_prompt = system_prompt
+        self.messages = list(messages or [])
+
+    def __call__(self, prompt):
+        if self.tools and random.random() < self.search_rate:
+            result = self.tools[0](query=str(prompt)[-80:])
+            if inspect.iscoroutine(result):
+                asyncio.run(result)
+        time.sleep(Latency.model_call)
+        text = f"Here is a plan for: {str(prompt)[-80:]}"
+        self.messages.append({"role": "user", "content": [{"text": str(prompt)}]})
+        self.messages.append({"role": "assistant", "content": [{"text": text}]})
+        return FakeAgentResult(text)
+
+    async def stream_async(self, prompt):
+        text = str(self(prompt))
+        for start in range(0, len(text), 16):
+            yield {"data": text[start:start + 16]}
+        yield {"result": FakeAgentResult(text)}
+
+
+def fake_tool(func=None, **kwargs):
+    if func is None:
+        return lambda f: f
+    return func
+
+
+class FakeApp:
+    def entrypoint(self, func):
+        return func
+
+    def run(self):
+        pass
+
+
+class FakeMemoryClient:
+    def __init__(self, region_name=None):
+        self.events = {}
+
+    def get_last_k_turns(self, memory_id, actor_id, session_id, k=5, branch_name=None):
+        time.sleep(Latency.memory_read)
+        turns = []
+        for messages in self.events.get(session_id, [])[-k:]:
+            turns.append([{"role": role.upper(), "content": {"text": text}} for text, role in messages])
+        return turns
+
+    def list_events(self, memory_id, actor_id, session_id, branch_name=None, max_results=100, **kwargs):
+        time.sleep(Latency.memory_read)
+        events = []
+        for index, messages in enumerate(self.events.get(session_id, [])):
+            events.append({
+                "eventId": f"event-{index + 1}",
+                "eventTimestamp": float(index + 1),
+                "payload": [{"conversational": {"role": role.upper(), "content": {"text": text}}}
+                            for text, role in messages],
+            })
+        return events[-max_results:]
+
+    def create_event(self, memory_id, actor_id, session_id, messages, **kwargs):
+        time.sleep(Latency.memory_write)
+        self.events.setdefault(session_id, []).append(list(messages))
+        return {"eventId": f"event-{len(self.events[session_id])}"}
+
+
+class FakeTavilyClient:
+    def __init__(self, api_key=None):
+        self.calls = 0
+
+    def search(self, query, max_results=5, include_answer=True, **kwargs):
+        time.sleep(Latency.search)
+        self.calls += 1
+        return {
+            "answer": f"Summary for {query}",
+            "results": [
+                {"title": f"Result {i} for {query}", "url": f"https://example.com/{i}",
+                 "content": f"Flights from EUR {80 + i} on 2025-10-0{i + 1}"}
+                for i in range(max_results)
+            ],
+        }
+
+
+class _StubTavilyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        time.sleep(Latency.search)
+        body = json.dumps(FakeTavilyClient().search(
+            request.get('query', ''), request.get('max_results', 5))).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_tavily_server():
+    """Start a local HTTP server mimicking POST /search.
+    
+    Returns:
+        Tuple of (server, search_url); call server.shutdown() when done
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubTavilyHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/search"
+
+
+def install_runtime_stubs():
+    """Register the fake packages in sys.modules."""
+    strands = types.ModuleType('strands')
+    strands.Agent = FakeAgent
+    strands.tool = fake_tool
+    models = types.ModuleType('strands.models')
+    models.BedrockModel = FakeBedrockModel
+    strands.models = models
+
+    agentcore = types.ModuleType('bedrock_agentcore')
+    runtime = types.ModuleType('bedrock_agentcore.runtime')
+    runtime.BedrockAgentCoreApp = FakeApp
+    memory = types.ModuleType('bedrock_agentcore.memory')
+    memory.MemoryClient = FakeMemoryClient
+
+    tavily = types.ModuleType('tavily')
+    tavily.TavilyClient = FakeTavilyClient
+
+    sys.modules.update({
+        'strands': strands,
+        'strands.models': models,
+        'bedrock_agentcore': agentcore,
+        'bedrock_agentcore.runtime': runtime,
+        'bedrock_agentcore.memory': memory,
+        'tavily': tavily,
+    })
+
+
+def import_runtime(env=None):
+    """Import a fresh copy of runtime_agent_main against the stubs.
+    
+    Args:
+        env: Extra environment variables applied before import
+    
+    Returns:
+        The runtime module
+    """
+    install_runtime_stubs()
+    os.environ.setdefault('TAVILY_API_KEY', 'bench-key')
+    os.environ.update(env or {})
+    if AGENTCORE_DIR not in sys.path:
+        sys.path.insert(0, AGENTCORE_DIR)
+    sys.modules.pop('runtime_agent_main', None)
+    return importlib.import_module('runtime_agent_main')
+
+
+def import_handler(env=None):
+    """Import a fresh copy of the Lambda handler.
+    
+    A placeholder boto3 module is registered when boto3 is not installed;
+    benchmarks replace the AgentCore client with their own fake anyway.
+    """
+    try:
+        import boto3  # noqa: F401
+    except ImportError:
+        boto3 = types.ModuleType('boto3')
+        boto3.client = lambda *args, **kwargs: None
+        sys.modules['boto3'] = boto3
+    os.environ.update(env or {})
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+    sys.modules.pop('handler', None)
+    return importlib.import_module('handler')
+
+
+def import_module_at_ref(relative_path, ref, module_name):
+    """Import a module as it was at a git ref, for before/after comparisons.
+    
+    Args:
+        relative_path: Path of the file from the repository root
+        ref: Git ref (commit, tag or branch)
+        module_name: Name to register the module under
+    """
+    repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+    source = subprocess.run(['git', 'show', f'{ref}:{relative_path}'], cwd=repo_root,
+                            check=True, capture_output=True, text=True).stdout
+    spec = importlib.util.spec_from_loader(module_name, loader=None)
+    module = importlib.util.module_from_spec(spec)
+    module.__file__ = f'{ref}:{relative_path}'
+    sys.modules[module_name] = module
+    exec(compile(source, module.__file__, 'exec'), module.__dict__)
+    return module
+
+
+class FakeStreamingBody:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class FakeAgentCoreClient:
+    """Stand-in for the bedrock-agentcore boto3 client used by the Lambda."""
+
+    def __init__(self, reply=b'"Here is your trip plan."'):
+        self.reply = reply
+        self.calls = 0
+
+    def invoke_agent_runtime(self, **kwargs):
+        time.sleep(Latency.model_call)
+        self.calls += 1
+        return {'response': FakeStreamingBody(self.reply), 'contentType': 'application/json'}
+
+
+class ByteCounter:
+    """File-like object that counts what is written to it."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.lines = 0
+
+    def write(self, text):
+        self.bytes += len(text.encode('utf-8'))
+        self.lines += text.count('\n')
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def percentile(samples, pct):
+    """Return the pct-th percentile of a list of numbers."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
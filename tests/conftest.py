@@ -52,6 +52,7 @@ def mock_memory_client():
     """Mock AgentCore memory client."""
     client = Mock()
     client.get_last_k_turns = Mock(return_value=[])
+    client.list_events = Mock(return_value=[])
     client.create_event = Mock(return_value={'success': True})
     return client
 
@@ -6,6 +6,8 @@ Simplified tests focusing on testable components.
 import pytest
 import sys
 import os
+import threading
+import time
 from unittest.mock import patch, Mock, MagicMock
 
 # Mock heavy dependencies before importing
@@ -57,12 +59,12 @@ class TestConfiguration:
 class TestAgentStructure:
     """Test agent structure and initialization."""
     
-    def test_session_agents_dictionary_exists(self):
-        """Session agents dictionary should exist."""
+    def test_session_agents_cache_exists(self):
+        """Session agents cache should exist."""
         import runtime_agent_main
         
         assert hasattr(runtime_agent_main, 'session_agents')
-        assert isinstance(runtime_agent_main.session_agents, dict)
+        assert isinstance(runtime_agent_main.session_agents, runtime_agent_main.SessionAgentCache)
     
     def test_memory_client_initialized(self):
         """Memory client should be initialized."""
@@ -79,6 +81,80 @@ class TestAgentStructure:
         assert runtime_agent_main.app is not None
 
 
+class TestSessionAgentCache:
+    """Test bounded session agent cache."""
+    
+    class FakeClock:
+        def __init__(self):
+            self.now = 0.0
+        
+        def __call__(self):
+            return self.now
+    
+    def test_reuses_agent_for_same_session(self):
+        """Same session should get the same agent."""
+        import runtime_agent_main
+        
+        cache = runtime_agent_main.SessionAgentCache(max_entries=10)
+        first = cache.get_or_create('s1', object)
+        second = cache.get_or_create('s1', object)
+        
+        assert first is second
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+    
+    def test_evicts_least_recently_used(self):
+        """Oldest session should be evicted when over capacity."""
+        import runtime_agent_main
+        
+        cache = runtime_agent_main.SessionAgentCache(max_entries=2)
+        cache.get_or_create('s1', object)
+        cache.get_or_create('s2', object)
+        cache.get_or_create('s1', object)
+        cache.get_or_create('s3', object)
+        
+        assert 's1' in cache
+        assert 's2' not in cache
+        assert len(cache) == 2
+        assert cache.stats()['evictions']['capacity'] == 1
+    
+    def test_evicts_idle_sessions(self):
+        """Sessions idle longer than the TTL should be evicted."""
+        import runtime_agent_main
+        
+        clock = self.FakeClock()
+        cache = runtime_agent_main.SessionAgentCache(max_entries=10, idle_ttl=60, clock=clock)
+        cache.get_or_create('s1', object)
+        clock.now = 61
+        
+        assert cache.get('s1') is None
+        assert cache.stats()['evictions']['idle'] == 1
+    
+    def test_evicts_on_memory_budget(self):
+        """Sessions should be evicted when the memory budget is exceeded."""
+        import runtime_agent_main
+        
+        cache = runtime_agent_main.SessionAgentCache(max_entries=10, max_bytes=100, sizer=lambda agent: 60)
+        cache.get_or_create('s1', object)
+        cache.get_or_create('s2', object)
+        
+        assert 's1' not in cache
+        assert 's2' in cache
+        assert cache.stats()['evictions']['memory'] == 1
+    
+    def test_concurrent_creation_returns_single_agent(self):
+        """Concurrent requests for one session should share one agent."""
+        import runtime_agent_main
+        from concurrent.futures import ThreadPoolExecutor
+        
+        cache = runtime_agent_main.SessionAgentCache(max_entries=10)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            agents = list(executor.map(lambda _: cache.get_or_create('s1', object), range(32)))
+        
+        assert all(agent is agents[0] for agent in agents)
+        assert len(cache) == 1
+
+
 class TestSearchToolStructure:
     """Test search tool structure."""
     
@@ -104,6 +180,535 @@ class TestSearchToolStructure:
         # Can be None if TAVILY_API_KEY not set
 
 
+class TestSearchResultCache:
+    """Test Tavily search result caching."""
+    
+    def test_normalized_queries_share_key(self):
+        """Case, punctuation and whitespace should not change the cache key."""
+        import runtime_agent_main
+        
+        make_key = runtime_agent_main.SearchResultCache.make_key
+        assert make_key('Flights Budapest to Paris, October!', 5, True) == make_key('  flights budapest  to paris october', 5, True)
+        assert make_key('flights budapest', 5, True) != make_key('flights budapest', 3, True)
+    
+    def test_ttl_depends_on_query_class(self):
+        """Flight prices should expire sooner than general information."""
+        import runtime_agent_main
+        
+        cache = runtime_agent_main.SearchResultCache(ttls={'flights': 60, 'general': 3600})
+        assert cache.ttl_for('cheap flights to Rome') == 60
+        assert cache.ttl_for('history of the Colosseum') == 3600
+    
+    def test_entries_expire(self):
+        """Expired entries should be treated as misses."""
+        import runtime_agent_main
+        
+        now = [0.0]
+        cache = runtime_agent_main.SearchResultCache(clock=lambda: now[0])
+        cache.set('k', {'results': []}, ttl=10)
+        assert cache.get('k') == {'results': []}
+        now[0] = 11
+        assert cache.get('k') is None
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+    
+    def test_falls_back_to_shared_store(self):
+        """Local misses should be served from the shared store."""
+        import runtime_agent_main
+        
+        store = Mock()
+        store.get.return_value = '{"answer": "shared"}'
+        cache = runtime_agent_main.SearchResultCache(shared_store=store)
+        
+        assert cache.get('k') == {'answer': 'shared'}
+        assert cache.stats()['shared_hits'] == 1
+    
+    def test_repeated_search_hits_cache(self, mock_tavily_client):
+        """Identical searches should call Tavily once."""
+        import runtime_agent_main
+        
+        cache = runtime_agent_main.SearchResultCache()
+        with patch('runtime_agent_main.tavily_client', mock_tavily_client), \
+                patch('runtime_agent_main.search_cache', cache):
+            first = runtime_agent_main.tavily_search('Flights Barcelona to Athens')
+            second = runtime_agent_main.tavily_search('flights barcelona to athens')
+        
+        assert first == second
+        assert mock_tavily_client.search.call_count == 1
+
+
+class TestResponseCache:
+    """Test the first-turn response cache."""
+    
+    def make_cache(self, **kwargs):
+        import runtime_agent_main
+        return runtime_agent_main.ResponseCache(today=lambda: '2026-10-17', **kwargs)
+    
+    def test_exact_match_after_normalization(self):
+        """Case and punctuation should not change the cached question."""
+        cache = self.make_cache()
+        cache.set(cache.make_key('Weekend in Rome from Budapest next month?'), 'Try Trastevere.', 8.0)
+        
+        assert cache.get(cache.make_key('weekend in rome from budapest next month')) == ('Try Trastevere.', 'exact')
+        assert cache.stats()['saved_seconds'] == 8.0
+    
+    def test_similar_question_hits_above_threshold(self):
+        """Rephrasings with the same content words should hit; other cities should not."""
+        cache = self.make_cache(similarity=0.9)
+        cache.set(cache.make_key('Weekend in Rome from Budapest next month'), 'Rome plan')
+        
+        assert cache.get(cache.make_key('Plan a weekend in Rome from Budapest next month please')) == ('Rome plan', 'similar')
+        assert cache.get(cache.make_key('Weekend in Vienna from Budapest next month')) == (None, None)
+        assert cache.stats()['similar_hits'] == 1
+        assert cache.stats()['misses'] == 1
+    
+    def test_swapped_origin_and_destination_do_not_match(self):
+        """The same words in the opposite direction are a different trip."""
+        cache = self.make_cache(similarity=0.5)
+        cache.set(cache.make_key('Weekend in Rome from Budapest next month'), 'Budapest to Rome')
+        cache.set(cache.make_key('Flights from London to Paris'), 'London to Paris')
+        
+        assert cache.get(cache.make_key('Weekend in Budapest from Rome next month')) == (None, None)
+        assert cache.get(cache.make_key('Flights from Paris to London')) == (None, None)
+        assert cache.get(cache.make_key('Flights to Paris from London')) == ('London to Paris', 'similar')
+    
+    def test_different_month_does_not_match(self):
+        """Questions that differ only in the month should miss, however long they are."""
+        cache = self.make_cache(similarity=0.5)
+        question = 'Cheap family friendly beach holiday with kids club and pool near Barcelona in {}'
+        cache.set(cache.make_key(question.format('October')), 'October plan')
+        
+        assert cache.get(cache.make_key(question.format('November'))) == (None, None)
+        assert cache.get(cache.make_key(question.format('October') + ' please')) == ('October plan', 'similar')
+    
+    def test_personal_questions_bypass(self):
+        """Questions referring to the user's context should not be cacheable."""
+        cache = self.make_cache()
+        
+        assert cache.make_key('Rome again but with my kids') is None
+        assert cache.make_key('x' * 400) is None
+        assert cache.make_key('Weekend in Rome') is not None
+    
+    def test_entries_expire_and_are_bounded(self):
+        """Entries should expire after the TTL and be evicted beyond max_entries."""
+        now = [0.0]
+        cache = self.make_cache(ttl=10, max_entries=2, clock=lambda: now[0])
+        for city in ('rome', 'paris', 'lisbon'):
+            cache.set(cache.make_key(f'weekend in {city}'), city)
+        
+        assert cache.stats()['entries'] == 2
+        assert cache.get(cache.make_key('weekend in rome')) == (None, None)
+        now[0] = 11
+        assert cache.get(cache.make_key('weekend in lisbon')) == (None, None)
+    
+    def test_keys_change_with_the_date(self):
+        """Answers about relative dates should not be reused on another day."""
+        import runtime_agent_main
+        
+        today = ['2026-10-17']
+        cache = runtime_agent_main.ResponseCache(today=lambda: today[0])
+        cache.set(cache.make_key('trip to rome next weekend'), 'Oct 24-25')
+        today[0] = '2026-10-18'
+        
+        assert cache.get(cache.make_key('trip to rome next weekend')) == (None, None)
+    
+    def test_only_first_turn_is_cacheable(self):
+        """Sessions with conversation history should bypass the cache."""
+        import runtime_agent_main
+        
+        cache = self.make_cache()
+        new_agent, follow_up = Mock(messages=[]), Mock(messages=[{'role': 'user'}])
+        with patch('runtime_agent_main.response_cache', cache):
+            assert runtime_agent_main.response_cache_key(new_agent, 'Weekend in Rome', {}) is not None
+            assert runtime_agent_main.response_cache_key(follow_up, 'Weekend in Rome', {}) is None
+            assert runtime_agent_main.response_cache_key(new_agent, 'Weekend in Rome', {'no_cache': True}) is None
+        
+        assert cache.stats()['bypassed'] == 2
+    
+    def test_greeting_does_not_block_first_turn_cache(self):
+        """A canned "hi" before the first question should keep it cacheable."""
+        import runtime_agent_main
+        
+        cache = self.make_cache()
+        agent = Mock(messages=[])
+        runtime_agent_main.add_cached_turn(agent, 'hi', runtime_agent_main.canned_reply('hi'))
+        with patch('runtime_agent_main.response_cache', cache):
+            assert runtime_agent_main.response_cache_key(agent, 'Weekend in Rome', {}) is not None
+            runtime_agent_main.add_cached_turn(agent, 'Weekend in Rome', 'Colosseum and Trastevere')
+            assert runtime_agent_main.response_cache_key(agent, 'And in Paris?', {}) is None
+    
+    def test_cached_answer_added_to_conversation(self):
+        """A cache hit should leave the agent ready for follow-up questions."""
+        import runtime_agent_main
+        
+        agent = Mock(messages=[])
+        runtime_agent_main.add_cached_turn(agent, 'Weekend in Rome', 'Rome plan')
+        
+        assert [m['role'] for m in agent.messages] == ['user', 'assistant']
+        assert agent.messages[1]['content'] == [{'text': 'Rome plan'}]
+
+
+class TestSearchResultCompaction:
+    """Test compaction of search results before they reach the model."""
+    
+    RESPONSE = {
+        'answer': 'Ryanair and Wizz Air fly direct from Budapest to Rome.',
+        'results': [
+            {'title': 'Cheap flights Budapest to Rome', 'url': 'https://www.ryanair.com/hu/en/rome?utm=x',
+             'content': 'Ryanair fares from €39.99 one way, departing 12 Oct 2026. ' + 'Book now. ' * 30},
+            {'title': 'Hotel Artemide Rome - official site', 'url': 'https://hotelartemide.it/',
+             'content': 'Rooms from 120 EUR per night on Via Nazionale, close to Termini station.'},
+        ],
+    }
+    
+    def test_extracts_structured_fields(self):
+        """Prices, dates and airline or hotel names should be extracted."""
+        import runtime_agent_main
+        
+        fields = runtime_agent_main.extract_result_fields(
+            'Cheap flights', 'Ryanair fares from €39.99 one way, departing 12 Oct 2026.')
+        
+        assert fields == {'price': '€39.99', 'dates': '12 Oct 2026', 'provider': 'Ryanair'}
+        assert runtime_agent_main.extract_result_fields('Hotel Artemide Rome', '')['provider'] == 'Hotel Artemide Rome'
+    
+    def test_compact_table_is_smaller_than_full_format(self):
+        """The compact form should keep the fields and cost fewer tokens."""
+        import runtime_agent_main
+        
+        ledger = runtime_agent_main.SearchResultLedger()
+        text = runtime_agent_main.compact_search_results(self.RESPONSE, ledger)
+        
+        assert 'title | price | dates | provider | details | url' in text
+        assert '€39.99' in text and '120 EUR' in text
+        assert 'https://www.ryanair.com/hu/en/rome' in text and 'utm=x' not in text
+        report = ledger.report()
+        assert report['search_calls'] == 1
+        assert report['search_tokens_out'] < report['search_tokens_in']
+    
+    def test_duplicates_across_searches_are_dropped(self):
+        """The same page from a second search of the turn should be omitted."""
+        import runtime_agent_main
+        
+        ledger = runtime_agent_main.SearchResultLedger()
+        runtime_agent_main.compact_search_results(self.RESPONSE, ledger)
+        repeat = {'results': [
+            dict(self.RESPONSE['results'][0], url='http://ryanair.com/hu/en/rome/'),
+            {'title': 'Colosseum tickets', 'url': 'https://colosseum.example/tickets', 'content': 'Skip the line.'},
+        ]}
+        text = runtime_agent_main.compact_search_results(repeat, ledger)
+        
+        assert 'Colosseum tickets' in text
+        assert 'Cheap flights' not in text
+        assert '(1 results already shown above omitted)' in text
+        assert ledger.report()['search_duplicates'] == 1
+    
+    def test_budget_drops_rows(self):
+        """Rows should be dropped from the end to fit the token budget."""
+        import runtime_agent_main
+        
+        response = {'results': [
+            {'title': f'Result {i}', 'url': f'https://example.com/{i}', 'content': f'Topic {i} ' + 'x' * 100}
+            for i in range(5)
+        ]}
+        text = runtime_agent_main.compact_search_results(response, budget_tokens=80)
+        
+        assert runtime_agent_main._text_tokens(text) <= 80
+        assert 'Result 0' in text and 'Result 4' not in text
+        assert 'more results omitted to save context' in text
+
+
+class TestOfferIndex:
+    """Test the per-session index of offers found by searches."""
+    
+    FLIGHTS = {'results': [
+        {'title': 'Budapest to Rome flights', 'url': 'https://www.ryanair.com/rome?utm=1',
+         'content': 'Ryanair from €39.99, departing 12 Oct.'},
+        {'title': 'Wizz Air Budapest - Rome', 'url': 'https://wizzair.com/rome',
+         'content': 'Fares from €54 on 13 Oct.'},
+        {'title': 'Rome travel guide', 'url': 'https://example.com/guide', 'content': 'See the Colosseum.'},
+    ]}
+    
+    def test_parse_price_formats(self):
+        """Prices should parse with their currency and thousands separators."""
+        import runtime_agent_main
+        
+        assert runtime_agent_main.parse_price('€39.99') == (39.99, 'EUR')
+        assert runtime_agent_main.parse_price('1,234 USD') == (1234.0, 'USD')
+        assert runtime_agent_main.parse_price('25.000 Ft') == (25000.0, 'HUF')
+        assert runtime_agent_main.parse_price('€12,50') == (12.5, 'EUR')
+    
+    def test_offers_extracted_from_results(self):
+        """Results with a price or provider should become typed offers."""
+        import runtime_agent_main
+        
+        offers = runtime_agent_main.extract_offers('flights Budapest to Rome', self.FLIGHTS)
+        
+        assert [o['provider'] for o in offers] == ['Ryanair', 'Wizz Air']
+        assert offers[0]['type'] == 'flights'
+        assert offers[0]['price'] == 39.99
+        assert offers[0]['url'] == 'https://www.ryanair.com/rome'
+    
+    def test_find_filters_and_sorts(self):
+        """Lookups should filter by type, price and provider and sort by price."""
+        import runtime_agent_main
+        
+        index = runtime_agent_main.OfferIndex()
+        index.add(runtime_agent_main.extract_offers('flights Budapest to Rome', self.FLIGHTS))
+        index.add(runtime_agent_main.extract_offers('hotels in Rome', {'results': [
+            {'title': 'Hotel Artemide Rome', 'url': 'https://hotelartemide.it', 'content': 'From 120 EUR per night.'},
+        ]}))
+        
+        assert [o['price'] for o in index.find(offer_type='flights', sort='price_desc')] == [54.0, 39.99]
+        assert [o['provider'] for o in index.find(max_price=50)] == ['Ryanair']
+        assert index.find(provider='wizz')[0]['price'] == 54.0
+        assert index.find(offer_type='hotels', text='rome')[0]['title'] == 'Hotel Artemide Rome'
+        assert len(index) == 3
+    
+    def test_search_results_indexed_for_current_session(self):
+        """Searches should fill the index of the session being answered."""
+        import runtime_agent_main
+        
+        indexes = runtime_agent_main.SessionOfferIndexes()
+        token = runtime_agent_main._current_offer_index.set(indexes.get('s1'))
+        try:
+            runtime_agent_main.index_search_results('flights Budapest to Rome', self.FLIGHTS)
+            text = runtime_agent_main.lookup_offers(offer_type='flights', limit=1)
+        finally:
+            runtime_agent_main._current_offer_index.reset(token)
+        
+        assert '39.99 EUR' in text and 'Wizz' not in text
+        assert len(indexes.get('s2')) == 0
+        assert 'No offers found' in runtime_agent_main.lookup_offers()
+    
+    def test_index_is_bounded(self):
+        """The oldest offers and sessions should be dropped beyond the limits."""
+        import runtime_agent_main
+        
+        indexes = runtime_agent_main.SessionOfferIndexes(max_sessions=1, max_offers=1)
+        index = indexes.get('s1')
+        index.add(runtime_agent_main.extract_offers('flights', self.FLIGHTS))
+        
+        assert [o['provider'] for o in index.find()] == ['Wizz Air']
+        indexes.get('s2')
+        assert indexes.get('s1') is not index
+
+
+class TestSingleFlight:
+    """Test coalescing of concurrent identical calls."""
+    
+    def test_concurrent_threads_share_one_call(self):
+        """Threads asking for the same key should trigger one execution."""
+        import runtime_agent_main
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        
+        flight = runtime_agent_main.SingleFlight()
+        release = threading.Event()
+        calls = []
+        
+        def slow_search():
+            calls.append(1)
+            release.wait(timeout=5)
+            return 'result'
+        
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [executor.submit(flight.do, 'key', slow_search) for _ in range(5)]
+            while flight.stats()['coalesced'] < 4:
+                time.sleep(0.001)
+            release.set()
+            results = [f.result() for f in futures]
+        
+        assert results == ['result'] * 5
+        assert len(calls) == 1
+        assert flight.stats()['executions'] == 1
+        assert flight.stats()['coalesced'] == 4
+        assert flight.stats()['in_flight'] == 0
+    
+    def test_asyncio_callers_share_one_call(self):
+        """Coroutines asking for the same key should trigger one execution."""
+        import runtime_agent_main
+        import asyncio
+        
+        flight = runtime_agent_main.SingleFlight()
+        calls = []
+        
+        async def slow_search():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'result'
+        
+        async def run():
+            return await asyncio.gather(*[flight.do_async('key', slow_search) for _ in range(5)])
+        
+        assert asyncio.run(run()) == ['result'] * 5
+        assert len(calls) == 1
+        assert flight.stats()['coalesced'] == 4
+    
+    def test_errors_propagate_to_waiters(self):
+        """Errors should be raised and not remembered after the call."""
+        import runtime_agent_main
+        
+        flight = runtime_agent_main.SingleFlight()
+        
+        def failing():
+            raise RuntimeError('tavily down')
+        
+        with pytest.raises(RuntimeError):
+            flight.do('key', failing)
+        assert flight.do('key', lambda: 'recovered') == 'recovered'
+
+
+class TestAsyncSearch:
+    """Test async Tavily search path."""
+    
+    class FakeAsyncClient:
+        def __init__(self, fail=False):
+            self.fail = fail
+            self.calls = 0
+        
+        async def search(self, query, max_results=5, include_answer=True):
+            self.calls += 1
+            if self.fail:
+                raise ConnectionError('pool closed')
+            return {'answer': f'async {query}', 'results': []}
+    
+    def test_async_search_uses_cache(self):
+        """Repeated async searches should be served from the cache."""
+        import runtime_agent_main
+        import asyncio
+        
+        client = self.FakeAsyncClient()
+        with patch('runtime_agent_main.async_tavily_client', client), \
+                patch('runtime_agent_main.search_cache', runtime_agent_main.SearchResultCache()):
+            first = asyncio.run(runtime_agent_main.tavily_search_async('Hotels in Rome'))
+            second = asyncio.run(runtime_agent_main.tavily_search_async('hotels in rome'))
+        
+        assert first == second == {'answer': 'async Hotels in Rome', 'results': []}
+        assert client.calls == 1
+    
+    def test_async_failure_falls_back_to_sync_client(self, mock_tavily_client):
+        """A failing async request should fall back to the sync client."""
+        import runtime_agent_main
+        import asyncio
+        
+        with patch('runtime_agent_main.async_tavily_client', self.FakeAsyncClient(fail=True)), \
+                patch('runtime_agent_main.tavily_client', mock_tavily_client), \
+                patch('runtime_agent_main.search_cache', None):
+            response = asyncio.run(runtime_agent_main.tavily_search_async('flights to Athens'))
+        
+        assert mock_tavily_client.search.call_count == 1
+        assert response['answer'] == 'Found 3 flights from Barcelona to Athens'
+    
+    def test_pooled_client_against_local_server(self):
+        """The aiohttp client should reuse its session across event loops and close cleanly."""
+        pytest.importorskip('aiohttp')
+        from aiohttp import web
+        import runtime_agent_main
+        import asyncio
+        
+        received = []
+        
+        async def handle(request):
+            received.append((request.headers.get('Authorization'), await request.json()))
+            return web.json_response({'answer': 'stub answer', 'results': []})
+        
+        server_loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_post('/search', handle)
+        runner = web.AppRunner(app)
+        server_loop.run_until_complete(runner.setup())
+        server_loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', 0).start())
+        port = runner.addresses[0][1]
+        server = threading.Thread(target=server_loop.run_forever, daemon=True)
+        server.start()
+        
+        client = runtime_agent_main.AsyncTavilyClient(api_key='test-key', api_url=f'http://127.0.0.1:{port}/search')
+        try:
+            # Each agent call runs on its own loop, as under Strands
+            first = asyncio.run(client.search('Hotels in Rome', max_results=3))
+            session = client._session
+            second = asyncio.run(client.search('Flights to Paris'))
+            
+            assert first == second == {'answer': 'stub answer', 'results': []}
+            assert client._session is session
+            assert received == [
+                ('Bearer test-key', {'query': 'Hotels in Rome', 'max_results': 3, 'include_answer': True}),
+                ('Bearer test-key', {'query': 'Flights to Paris', 'max_results': 5, 'include_answer': True}),
+            ]
+        finally:
+            client.close()
+            asyncio.run_coroutine_threadsafe(runner.cleanup(), server_loop).result(timeout=5)
+            server_loop.call_soon_threadsafe(server_loop.stop)
+            server.join(5)
+            server_loop.close()
+        
+        assert client._loop is None and client._session is None
+
+
+class TestBatchSearch:
+    """Test parallel multi-query search."""
+    
+    def test_batch_runs_queries_concurrently(self):
+        """Queries in a batch should overlap rather than run one by one."""
+        import runtime_agent_main
+        import asyncio
+        import threading
+        
+        active = []
+        peak = []
+        lock = threading.Lock()
+        
+        def slow_search(query, max_results=5, include_answer=True):
+            with lock:
+                active.append(query)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.remove(query)
+            return {'answer': f'answer for {query}', 'results': []}
+        
+        with patch('runtime_agent_main.async_tavily_client', None), \
+                patch('runtime_agent_main.tavily_search', side_effect=slow_search):
+            text = asyncio.run(runtime_agent_main.run_search_batch(
+                ['flights BUD-CDG', 'hotels Paris', 'activities Paris']))
+        
+        assert max(peak) > 1
+        assert text.index('flights BUD-CDG') < text.index('hotels Paris') < text.index('activities Paris')
+        assert 'answer for hotels Paris' in text
+    
+    def test_batch_deduplicates_and_caps_queries(self):
+        """Duplicate queries should run once and the batch should be capped."""
+        import runtime_agent_main
+        import asyncio
+        
+        search = Mock(return_value={'results': []})
+        queries = ['a', 'a', ' ', 'b', 'c', 'd']
+        with patch('runtime_agent_main.async_tavily_client', None), \
+                patch('runtime_agent_main.tavily_search', search), \
+                patch('runtime_agent_main.SEARCH_BATCH_MAX_QUERIES', 2):
+            text = asyncio.run(runtime_agent_main.run_search_batch(queries))
+        
+        assert search.call_count == 2
+        assert 'Skipped 2 queries' in text
+    
+    def test_batch_reports_errors_per_query(self):
+        """One failing query should not fail the whole batch."""
+        import runtime_agent_main
+        import asyncio
+        
+        def flaky_search(query, max_results=5, include_answer=True):
+            if query == 'bad':
+                raise RuntimeError('quota exceeded')
+            return {'answer': 'ok', 'results': []}
+        
+        with patch('runtime_agent_main.async_tavily_client', None), \
+                patch('runtime_agent_main.tavily_search', side_effect=flaky_search):
+            text = asyncio.run(runtime_agent_main.run_search_batch(['good', 'bad']))
+        
+        assert 'Summary: ok' in text
+        assert 'Search error: quota exceeded' in text
+
+
 class TestAgentCreationStructure:
     """Test agent creation function structure."""
     
@@ -121,6 +726,576 @@ class TestAgentCreationStructure:
         assert runtime_agent_main.get_or_create_agent.__doc__ is not None
 
 
+class TestSharedAgentResources:
+    """Test process-wide model and tool registry."""
+    
+    def test_resources_built_at_startup(self):
+        """Shared resources should exist with a system prompt."""
+        import runtime_agent_main
+        
+        resources = runtime_agent_main.agent_resources
+        assert isinstance(resources, runtime_agent_main.AgentResources)
+        assert 'travel planning assistant' in resources.system_prompt
+    
+    @patch('runtime_agent_main.Agent')
+    def test_sessions_share_model_and_tools(self, mock_agent_class):
+        """New session agents should reuse the shared model and tools."""
+        import runtime_agent_main
+        
+        runtime_agent_main._create_agent('session-a')
+        runtime_agent_main._create_agent('session-b')
+        
+        resources = runtime_agent_main.agent_resources
+        for call in mock_agent_class.call_args_list:
+            assert call.kwargs['model'] is resources.model
+            assert call.kwargs['tools'] is resources.tools
+            assert call.kwargs['system_prompt'] == resources.system_prompt
+
+
+class TestAgentWarmPool:
+    """Test the pool of pre-built agents and startup timings."""
+    
+    def test_take_returns_prebuilt_agents_until_empty(self):
+        """Pre-built agents should be handed out, then None when empty."""
+        import runtime_agent_main
+        
+        pool = runtime_agent_main.AgentWarmPool(Mock, 2)
+        pool.fill()
+        
+        assert len(pool) == 2
+        assert pool.take() is not None
+        assert pool.take() is not None
+        assert pool.take() is None
+        assert pool.stats()['taken'] == 2
+        assert pool.stats()['empty'] == 1
+    
+    def test_background_refill(self):
+        """Taking an agent should trigger a background refill."""
+        import runtime_agent_main
+        
+        pool = runtime_agent_main.AgentWarmPool(Mock, 2)
+        pool.start()
+        deadline = time.time() + 2
+        while len(pool) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        pool.take()
+        while len(pool) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        
+        assert len(pool) == 2
+        assert pool.stats()['built'] == 3
+    
+    def test_new_session_uses_pooled_agent_with_history(self):
+        """A new session should get a pooled agent seeded with its history."""
+        import runtime_agent_main
+        
+        pooled = Mock()
+        pool = runtime_agent_main.AgentWarmPool(lambda: pooled, 1)
+        pool.fill()
+        history = [{'role': 'user', 'content': [{'text': 'Hi'}]}]
+        
+        with patch('runtime_agent_main.agent_warm_pool', pool), \
+                patch('runtime_agent_main.load_history_turns', return_value=[]), \
+                patch('runtime_agent_main.turns_to_agent_messages', return_value=history), \
+                patch('runtime_agent_main.Agent') as mock_agent_class:
+            agent = runtime_agent_main._create_agent('new-user')
+        
+        assert agent is pooled
+        assert agent.messages == history
+        mock_agent_class.assert_not_called()
+    
+    def test_startup_timings_recorded(self):
+        """Init steps should be timed at import."""
+        import runtime_agent_main
+        
+        timings = runtime_agent_main.startup_timings
+        assert {'imports', 'memory_client', 'agent_resources', 'total'} <= set(timings)
+        assert timings['total'] >= timings['imports']
+
+
+class TestSessionHistoryCache:
+    """Test incremental in-process conversation history."""
+    
+    TURNS = [
+        [{'role': 'USER', 'content': {'text': 'Flights to Athens?'}},
+         {'role': 'ASSISTANT', 'content': {'text': 'Here are some options.'}}],
+    ]
+    
+    def test_memory_read_once_then_appended_locally(self, mock_memory_client):
+        """Memory should be read on the first load only."""
+        import runtime_agent_main
+        
+        mock_memory_client.list_events.return_value = [
+            {'eventId': 'e1', 'eventTimestamp': 1, 'payload': [{'conversational': message} for message in self.TURNS[0]]},
+        ]
+        cache = runtime_agent_main.SessionHistoryCache()
+        with patch('runtime_agent_main.memory_client', mock_memory_client), \
+                patch('runtime_agent_main.history_cache', cache):
+            runtime_agent_main.load_history_turns('s1', 5)
+            cache.append('s1', 'And hotels?', 'Hotel list.')
+            turns = runtime_agent_main.load_history_turns('s1', 5)
+        
+        assert mock_memory_client.list_events.call_count == 1
+        assert len(turns) == 2
+        assert turns[-1][0]['content']['text'] == 'And hotels?'
+    
+    def test_incomplete_history_is_a_miss_for_larger_k(self):
+        """A cache filled with k turns cannot answer a request for more."""
+        import runtime_agent_main
+        
+        cache = runtime_agent_main.SessionHistoryCache()
+        cache.store('s1', self.TURNS * 3, k=3)
+        
+        assert cache.get('s1', k=3) is not None
+        assert cache.get('s1', k=10) is None
+    
+    def test_agent_messages_alternate_roles(self):
+        """Seeded conversations should start with user and alternate roles."""
+        import runtime_agent_main
+        
+        turns = [
+            [{'role': 'ASSISTANT', 'content': {'text': 'orphan'}}],
+            self.TURNS[0],
+            [{'role': 'USER', 'content': {'text': 'unanswered'}}],
+        ]
+        messages = runtime_agent_main.turns_to_agent_messages(turns)
+        
+        assert [m['role'] for m in messages] == ['user', 'assistant']
+        assert messages[0]['content'] == [{'text': 'Flights to Athens?'}]
+
+    
+    def test_lambda_history_normalization_matches(self):
+        """The Lambda's direct history path should normalize messages identically."""
+        import runtime_agent_main
+        import handler
+        
+        turns = [
+            [{'role': 'USER', 'content': {'text': 'Hi'}}, {'role': 'ASSISTANT', 'content': {'text': 'Hello'}}],
+            [{'role': 'USER', 'content': 'plain'}, {'role': 'TOOL', 'content': {'text': 'ignored'}}],
+        ]
+        
+        assert handler.turns_to_messages(turns) == runtime_agent_main.turns_to_messages(turns)
+
+    
+    def test_history_pages_match_lambda(self):
+        """Runtime and Lambda should page and format history identically."""
+        import runtime_agent_main
+        import handler
+        
+        events = [{'eventId': f'e{i}', 'eventTimestamp': float(i), 'payload': [
+            {'conversational': {'role': 'USER', 'content': {'text': f'Q{i}'}}},
+            {'conversational': {'role': 'ASSISTANT', 'content': {'text': f'A{i}'}}},
+        ]} for i in range(1, 8)]
+        
+        for kwargs in ({}, {'before': 'e4'}, {'after': 'e2'}, {'since': 5}, {'after': 'missing'}):
+            runtime_page = runtime_agent_main.history_page_body(runtime_agent_main.page_history_events(events, 3, **kwargs))
+            lambda_page = handler.history_page_body(handler.page_history_events(events, 3, **kwargs))
+            assert runtime_page == lambda_page
+
+
+class TestContextBudget:
+    """Test token-budgeted compaction of the conversation sent to the model."""
+    
+    @staticmethod
+    def conversation(turns, answer_chars=2000, result_chars=4000):
+        messages = []
+        for i in range(turns):
+            messages += [
+                {'role': 'user', 'content': [{'text': f'Question {i}'}]},
+                {'role': 'assistant', 'content': [{'toolUse': {'toolUseId': f't{i}', 'name': 'search_web', 'input': {}}}]},
+                {'role': 'user', 'content': [{'toolResult': {'toolUseId': f't{i}', 'status': 'success',
+                                                             'content': [{'text': 'r' * result_chars}]}}]},
+                {'role': 'assistant', 'content': [{'text': 'a' * answer_chars}]},
+            ]
+        return messages
+    
+    def test_under_budget_is_unchanged(self):
+        """Conversations within budget should not be modified."""
+        import runtime_agent_main
+        
+        messages = self.conversation(1, 100, 100)
+        original = [dict(m) for m in messages]
+        
+        before, after = runtime_agent_main.compact_messages(messages, budget_tokens=10000)
+        
+        assert before == after
+        assert messages == original
+    
+    def test_older_tool_results_dropped_first(self):
+        """Search results of older turns should go before any text is cut."""
+        import runtime_agent_main
+        
+        messages = self.conversation(4, answer_chars=200)
+        before, after = runtime_agent_main.compact_messages(messages, budget_tokens=2500, keep_turns=2)
+        
+        results = [block['toolResult']['content'][0]['text'] for m in messages for block in m['content'] if 'toolResult' in block]
+        assert results[0] == runtime_agent_main._OMITTED_TOOL_RESULT
+        assert results[-1] == 'r' * 4000
+        assert len(messages) == 16
+        assert after < before
+    
+    def test_budget_enforced_keeping_recent_turns(self):
+        """Older turns should be truncated and dropped until the budget is met."""
+        import runtime_agent_main
+        
+        messages = self.conversation(6, answer_chars=3000, result_chars=200)
+        before, after = runtime_agent_main.compact_messages(messages, budget_tokens=2000, keep_turns=1, truncate_chars=100)
+        
+        assert after <= 2000
+        assert after == runtime_agent_main.estimate_tokens(messages)
+        assert messages[0]['role'] == 'user' and 'text' in messages[0]['content'][0]
+        assert messages[-1]['content'][0]['text'] == 'a' * 3000
+    
+    def test_tokens_saved_reported(self):
+        """Compacting an agent should report tokens on the request's timer."""
+        import runtime_agent_main
+        
+        agent = Mock()
+        agent.messages = self.conversation(5)
+        timer = runtime_agent_main.StageTimer('runtime')
+        
+        with patch('runtime_agent_main.CONTEXT_TOKEN_BUDGET', 3000), patch('runtime_agent_main.CONTEXT_KEEP_TURNS', 1):
+            runtime_agent_main.compact_agent_context(agent, timer)
+        
+        assert timer.fields['context_tokens'] <= 3000
+        assert timer.fields['context_tokens_saved'] > 0
+
+
+class TestMemoryWriteBehind:
+    """Test background writes to AgentCore Memory."""
+    
+    def test_turns_written_in_background_and_flushed(self):
+        """Queued turns should be persisted by flush time."""
+        import runtime_agent_main
+        
+        writes = []
+        writer = runtime_agent_main.MemoryWriteBehind(lambda a, s, m: writes.append((s, m)))
+        writer.submit('actor', 's1', [('hi', 'user'), ('hello', 'assistant')])
+        
+        assert writer.flush(timeout=5)
+        assert writes == [('s1', [('hi', 'user'), ('hello', 'assistant')])]
+        assert writer.stats()['queue_depth'] == 0
+        assert writer.stats()['written_turns'] == 1
+    
+    def test_turns_of_one_session_are_batched(self):
+        """Turns queued together for one session should become one write."""
+        import runtime_agent_main
+        import threading
+        
+        gate = threading.Event()
+        writes = []
+        
+        def write(actor_id, session_id, messages):
+            gate.wait(timeout=5)
+            writes.append((session_id, messages))
+        
+        writer = runtime_agent_main.MemoryWriteBehind(write)
+        writer.submit('actor', 'blocker', [('0', 'user')])
+        for i in range(3):
+            writer.submit('actor', 's1', [(f'q{i}', 'user'), (f'a{i}', 'assistant')])
+        gate.set()
+        writer.flush(timeout=5)
+        
+        s1_writes = [m for s, m in writes if s == 's1']
+        assert len(s1_writes) == 1
+        assert [text for text, _ in s1_writes[0]] == ['q0', 'a0', 'q1', 'a1', 'q2', 'a2']
+    
+    def test_failed_writes_are_retried(self):
+        """Transient failures should be retried with backoff."""
+        import runtime_agent_main
+        
+        attempts = []
+        
+        def flaky(actor_id, session_id, messages):
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise RuntimeError('throttled')
+        
+        writer = runtime_agent_main.MemoryWriteBehind(flaky, base_delay=0.001)
+        writer.submit('actor', 's1', [('hi', 'user')])
+        writer.flush(timeout=5)
+        
+        assert len(attempts) == 3
+        assert writer.stats()['retries'] == 2
+        assert writer.stats()['failed_turns'] == 0
+    
+    def test_full_queue_writes_synchronously(self):
+        """A full queue should apply backpressure instead of dropping turns."""
+        import runtime_agent_main
+        import threading
+        
+        gate = threading.Event()
+        writes = []
+        
+        def write(actor_id, session_id, messages):
+            if session_id == 'blocker':
+                gate.wait(timeout=5)
+            writes.append(session_id)
+        
+        writer = runtime_agent_main.MemoryWriteBehind(write, max_queue=1)
+        writer.submit('actor', 'blocker', [('0', 'user')])
+        while writer._queue.qsize():
+            time.sleep(0.001)
+        writer.submit('actor', 'queued', [('1', 'user')])
+        writer.submit('actor', 'overflow', [('2', 'user')])
+        
+        assert writes == ['overflow']
+        assert writer.stats()['sync_writes'] == 1
+        gate.set()
+        writer.flush(timeout=5)
+        assert sorted(writes) == ['blocker', 'overflow', 'queued']
+
+
+class TestModelRouting:
+    """Test routing turns between canned replies and models."""
+    
+    def test_small_talk_gets_canned_reply(self):
+        """Thanks and greetings should be answered without a model, in the user's language."""
+        import runtime_agent_main
+        
+        assert runtime_agent_main.route_request('Thanks!')[0] == 'canned'
+        assert runtime_agent_main.route_request('thank you so much')[0] == 'canned'
+        assert 'Szívesen' in runtime_agent_main.canned_reply('Köszönöm szépen!')
+        assert runtime_agent_main.canned_reply('thanks, and what about hotels in Rome?') is None
+    
+    def test_planning_requests_route_to_planning(self):
+        """Requests with dates, places or planning words should use the planning route."""
+        import runtime_agent_main
+        
+        assert runtime_agent_main.route_request('Weekend in Rome from Budapest next month') == ('planning', None)
+        assert runtime_agent_main.route_request('What is the capital of Portugal?') == ('simple', None)
+    
+    def test_short_reply_keeps_planning_route(self):
+        """A short answer to a planning turn should stay on the planning model."""
+        import runtime_agent_main
+        
+        messages = [
+            {'role': 'user', 'content': [{'text': 'Plan a trip from Budapest to Paris in May'}]},
+            {'role': 'assistant', 'content': [{'text': 'Which dates exactly?'}]},
+        ]
+        
+        assert runtime_agent_main.route_request('the second week', messages)[0] == 'planning'
+        
+        # The planning turn searched before asking, so it ends in tool results
+        messages = [
+            {'role': 'user', 'content': [{'text': 'Plan a trip from Budapest to Paris in May'}]},
+            {'role': 'assistant', 'content': [{'toolUse': {'toolUseId': 't1', 'name': 'web_search', 'input': {}}}]},
+            {'role': 'user', 'content': [{'toolResult': {'toolUseId': 't1', 'content': [{'text': 'Flights from 39 EUR'}]}}]},
+            {'role': 'assistant', 'content': [{'text': 'Which dates exactly?'}]},
+        ]
+        
+        assert runtime_agent_main.route_request('the second week', messages)[0] == 'planning'
+    
+    def test_route_model_uses_configured_table(self):
+        """The agent should be pointed at the model configured for its route."""
+        import runtime_agent_main
+        
+        resources = runtime_agent_main.AgentResources(
+            model='micro', tools=[], system_prompt='', models={'micro-id': 'micro', 'lite-id': 'lite'})
+        agent = Mock()
+        with patch('runtime_agent_main.agent_resources', resources), \
+                patch('runtime_agent_main.model_routes', {'simple': 'micro-id', 'planning': 'lite-id'}):
+            assert runtime_agent_main.route_model(agent, 'planning') == 'lite-id'
+            assert agent.model == 'lite'
+    
+    def test_route_stats_count_latency_tokens_and_cost(self):
+        """Per-route counters should include token usage and cost from the metrics."""
+        import runtime_agent_main
+        
+        stats = runtime_agent_main.ModelRouteStats(prices={'lite-id': [0.001, 0.002]})
+        response = Mock()
+        response.metrics.accumulated_usage = {'inputTokens': 1000, 'outputTokens': 500}
+        stats.record('planning', 'lite-id', 2.0, response)
+        stats.record('canned', None, 0.0)
+        
+        report = stats.stats()
+        assert report['planning'] == {
+            'requests': 1, 'avg_ms': 2000.0, 'input_tokens': 1000, 'output_tokens': 500, 'cost_usd': 0.002,
+        }
+        assert report['canned']['requests'] == 1
+
+
+class TestSessionGate:
+    """Test per-session serialization and the container-wide limiter."""
+    
+    def test_queue_policy_serializes_a_session(self):
+        """A second turn of a session should wait until the first is released."""
+        import runtime_agent_main
+        import threading
+        
+        gate = runtime_agent_main.SessionGate(policy='queue', max_concurrent=0)
+        first, _ = gate.enter('s1', 'Rome')
+        admitted = threading.Event()
+        
+        def second():
+            ticket, _ = gate.enter('s1', 'Paris')
+            admitted.set()
+            ticket.release('ok')
+        
+        thread = threading.Thread(target=second)
+        thread.start()
+        assert not admitted.wait(0.1)
+        assert gate.stats()['waiting'] == 1
+        first.release('done')
+        thread.join(1)
+        
+        assert admitted.is_set()
+        assert gate.stats()['sessions'] == 0
+    
+    def test_reject_policy_raises_busy(self):
+        """Reject should fail fast for a busy session but admit other sessions."""
+        import runtime_agent_main
+        
+        gate = runtime_agent_main.SessionGate(policy='reject', max_concurrent=0)
+        ticket, _ = gate.enter('s1', 'Rome')
+        
+        with pytest.raises(runtime_agent_main.GateBusy) as exc:
+            gate.enter('s1', 'Rome')
+        assert exc.value.reason == 'session_busy'
+        other, _ = gate.enter('s2', 'Rome')
+        
+        ticket.release('a')
+        other.release('b')
+        assert gate.stats()['rejected'] == 1
+    
+    def test_coalesce_shares_running_answer(self):
+        """An identical message should receive the running turn's answer."""
+        import runtime_agent_main
+        
+        gate = runtime_agent_main.SessionGate(policy='coalesce', max_concurrent=0)
+        ticket, _ = gate.enter('s1', 'Weekend in Rome?')
+        none, running = gate.enter('s1', 'weekend in rome')
+        
+        assert none is None
+        ticket.release('Rome plan')
+        ticket.release()  # later releases are no-ops
+        assert running.result(timeout=1) == 'Rome plan'
+        assert gate.stats()['coalesced'] == 1
+    
+    def test_global_limit_rejects_when_overloaded(self):
+        """Requests beyond the container limit should time out as overloaded."""
+        import runtime_agent_main
+        
+        gate = runtime_agent_main.SessionGate(max_concurrent=1, global_timeout=0.05)
+        ticket, _ = gate.enter('s1', 'Rome')
+        
+        with pytest.raises(runtime_agent_main.GateBusy) as exc:
+            gate.enter('s2', 'Paris')
+        
+        assert exc.value.reason == 'overloaded'
+        assert gate.stats()['active'] == 1
+        ticket.release('ok')
+        gate.enter('s2', 'Paris')[0].release('ok')
+    
+    def test_busy_reply_carries_retry_after(self):
+        """The busy marker should name the reason and a retry delay for the Lambda."""
+        import runtime_agent_main
+        
+        reply = runtime_agent_main.busy_response('overloaded')
+        
+        assert reply['error'] == 'overloaded'
+        assert reply['retry_after'] == runtime_agent_main.BUSY_RETRY_AFTER
+
+
+class TestStreamingResponse:
+    """Test streamed agent responses."""
+    
+    class FakeStreamingAgent:
+        messages = []
+        
+        async def stream_async(self, prompt):
+            for event in [{'init_event_loop': True}, {'data': 'Hello '}, {'data': 'traveler'}, {'result': 'done'}]:
+                yield event
+    
+    def test_yields_text_deltas_and_records_turn(self):
+        """Only text deltas should be yielded and the full turn recorded."""
+        import runtime_agent_main
+        import asyncio
+        
+        async def collect():
+            return [chunk async for chunk in runtime_agent_main.stream_agent_response(
+                self.FakeStreamingAgent(), 's1', 'actor', 'Hi')]
+        
+        with patch('runtime_agent_main.record_turn') as record_turn:
+            chunks = asyncio.run(collect())
+        
+        assert chunks == ['Hello ', 'traveler']
+        record_turn.assert_called_once_with('s1', 'actor', 'Hi', 'Hello traveler')
+
+
+class TestStageTimings:
+    """Test per-stage latency instrumentation."""
+    
+    def test_stages_recorded_for_current_request(self):
+        """Stages should be summed on the current request's timer."""
+        import runtime_agent_main
+        
+        timer = runtime_agent_main.StageTimer('runtime', trace_id='abc')
+        token = runtime_agent_main._current_timer.set(timer)
+        try:
+            for _ in range(2):
+                with runtime_agent_main.stage('tavily_search'):
+                    pass
+        finally:
+            runtime_agent_main._current_timer.reset(token)
+        
+        assert timer.counts == {'tavily_search': 2}
+        assert timer.stages['tavily_search'] >= 0
+    
+    def test_stage_outside_request_is_noop(self):
+        """Stages outside a request should not fail."""
+        import runtime_agent_main
+        
+        with runtime_agent_main.stage('tavily_search'):
+            result = 42
+        
+        assert result == 42
+    
+    def test_export_appends_json_line(self, tmp_path):
+        """Timings should be appended to the configured file with the trace ID."""
+        import runtime_agent_main
+        import json
+        
+        timings_file = tmp_path / 'stages.jsonl'
+        timer = runtime_agent_main.StageTimer('runtime', trace_id='abc', session_id='s1')
+        timer.add('agent_invoke', 0.25)
+        
+        with patch('runtime_agent_main.STAGE_TIMINGS_FILE', str(timings_file)):
+            timer.export(action='chat')
+        
+        record = json.loads(timings_file.read_text())
+        assert record['trace_id'] == 'abc'
+        assert record['stages'] == {'agent_invoke': 250.0}
+        assert record['action'] == 'chat'
+    
+    def test_streamed_response_exports_timings(self):
+        """A streamed turn should export its timings once the stream ends."""
+        import runtime_agent_main
+        import asyncio
+        
+        timer = runtime_agent_main.StageTimer('runtime', trace_id='abc')
+        
+        async def collect():
+            return [chunk async for chunk in runtime_agent_main.stream_agent_response(
+                TestStreamingResponse.FakeStreamingAgent(), 's1', 'actor', 'Hi', timer=timer)]
+        
+        with patch('runtime_agent_main.record_turn'), patch.object(timer, 'export') as export:
+            asyncio.run(collect())
+        
+        export.assert_called_once()
+        assert {'agent_invoke', 'first_chunk'} <= set(timer.stages)
+    
+    def test_model_latency_from_metrics(self):
+        """Model latency should be read from Strands metrics when present."""
+        import runtime_agent_main
+        
+        response = Mock()
+        response.metrics.accumulated_metrics = {'latencyMs': 1500}
+        
+        assert runtime_agent_main._model_latency_seconds(response) == 1.5
+        assert runtime_agent_main._model_latency_seconds('plain text') is None
+
+
 class TestEntrypointStructure:
     """Test entrypoint function structure."""
     
@@ -139,6 +1314,100 @@ class TestEntrypointStructure:
         assert callable(runtime_agent_main.travel_agent_entrypoint)
 
 
+class TestEntrypointFlow:
+    """Test the entrypoint's gate, canned replies and response cache with a stub agent."""
+    
+    class StubAgent:
+        """Agent that records its calls and can be held inside a call."""
+        
+        def __init__(self, hold=None):
+            self.messages = []
+            self.calls = []
+            self.entered = threading.Event()
+            self.hold = hold
+        
+        def __call__(self, prompt):
+            self.calls.append(prompt)
+            self.entered.set()
+            if self.hold is not None:
+                self.hold.wait(2)
+            return f'Plan for {prompt}'
+    
+    def entrypoint(self):
+        """The undecorated entrypoint (app.entrypoint is a mock in these tests)."""
+        import runtime_agent_main
+        return runtime_agent_main.app.entrypoint.call_args[0][0]
+    
+    def test_reject_policy_returns_busy_and_releases_ticket(self):
+        """A second request of a running session should get the busy payload."""
+        import runtime_agent_main
+        import threading
+        
+        gate = runtime_agent_main.SessionGate(policy='reject', max_concurrent=0)
+        release = threading.Event()
+        agent = self.StubAgent(hold=release)
+        entrypoint = self.entrypoint()
+        results = []
+        with patch('runtime_agent_main.session_gate', gate), \
+             patch('runtime_agent_main.get_or_create_agent', return_value=agent), \
+             patch('runtime_agent_main.record_turn'), \
+             patch('runtime_agent_main.MODEL_ROUTING_ENABLED', False), \
+             patch('runtime_agent_main.response_cache', None):
+            first = threading.Thread(target=lambda: results.append(
+                entrypoint({'input': 'Weekend in Rome', 'session_id': 's1'})))
+            first.start()
+            assert agent.entered.wait(2)
+            
+            busy = entrypoint({'input': 'Weekend in Paris', 'session_id': 's1'})
+            release.set()
+            first.join(2)
+            
+            assert busy == runtime_agent_main.busy_response('session_busy')
+            assert results == ['Plan for Weekend in Rome']
+            assert gate.stats()['sessions'] == 0
+            assert entrypoint({'input': 'Weekend in Paris', 'session_id': 's1'}) == 'Plan for Weekend in Paris'
+        
+        assert agent.calls == ['Weekend in Rome', 'Weekend in Paris']
+    
+    def test_greeting_gets_canned_reply(self):
+        """Small talk should be answered without calling the agent."""
+        import runtime_agent_main
+        
+        gate = runtime_agent_main.SessionGate(policy='reject', max_concurrent=0)
+        agent = self.StubAgent()
+        with patch('runtime_agent_main.session_gate', gate), \
+             patch('runtime_agent_main.get_or_create_agent', return_value=agent), \
+             patch('runtime_agent_main.record_turn') as record_turn, \
+             patch('runtime_agent_main.MODEL_ROUTING_ENABLED', True):
+            result = self.entrypoint()({'input': 'hi', 'session_id': 's1'})
+        
+        assert result == runtime_agent_main.canned_reply('hi')
+        assert agent.calls == []
+        assert len(agent.messages) == 2
+        record_turn.assert_called_once_with('s1', 'travel-user-s1', 'hi', result)
+        assert gate.stats()['sessions'] == 0
+    
+    def test_response_cache_hit_skips_agent(self):
+        """A cached first question should be answered without calling the agent."""
+        import runtime_agent_main
+        
+        cache = runtime_agent_main.ResponseCache(today=lambda: '2026-10-17')
+        cache.set(cache.make_key('Weekend in Rome'), 'Colosseum and Trastevere')
+        gate = runtime_agent_main.SessionGate(policy='reject', max_concurrent=0)
+        agent = self.StubAgent()
+        with patch('runtime_agent_main.session_gate', gate), \
+             patch('runtime_agent_main.get_or_create_agent', return_value=agent), \
+             patch('runtime_agent_main.record_turn'), \
+             patch('runtime_agent_main.MODEL_ROUTING_ENABLED', False), \
+             patch('runtime_agent_main.response_cache', cache):
+            result = self.entrypoint()({'input': 'weekend in rome?', 'session_id': 's1'})
+        
+        assert result == 'Colosseum and Trastevere'
+        assert agent.calls == []
+        assert cache.stats()['hits'] == 1
+        assert gate.stats()['sessions'] == 0
+
+
 class TestSystemPrompt:
     """Test agent system prompt."""
     
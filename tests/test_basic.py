@@ -98,6 +98,21 @@ class TestUnitTests:
         body = json.loads(response['body'])
         assert body['session_id'] == test_session_id
     
+    @patch('handler.agent_core_client')
+    def test_chat_pins_runtime_session(self, mock_client, sample_lambda_event, sample_lambda_context, env_vars):
+        """Chat turns should pass the padded session ID so they reach the session's container."""
+        mock_response = Mock()
+        mock_response.read = Mock(return_value=b'Response')
+        mock_client.invoke_agent_runtime.return_value = {'response': mock_response}
+        event = sample_lambda_event.copy()
+        event['body'] = json.dumps({'message': 'Test', 'session_id': 'short-session'})
+        
+        handler.lambda_handler(event, sample_lambda_context)
+        
+        runtime_session_id = mock_client.invoke_agent_runtime.call_args.kwargs['runtimeSessionId']
+        assert runtime_session_id == handler.to_runtime_session_id('short-session')
+        assert runtime_session_id.startswith('short-session') and len(runtime_session_id) == 33
+    
     @patch('handler.agent_core_client')
     def test_thinking_tags_removed(self, mock_client, sample_lambda_event, sample_lambda_context, env_vars):
         """Should remove <thinking> tags from response."""
@@ -115,6 +130,415 @@ class TestUnitTests:
         assert 'Internal reasoning' not in body['response']
         assert 'Here is the response' in body['response']
 
+    
+    @patch('handler.agent_core_client')
+    def test_busy_runtime_returns_429(self, mock_client, sample_lambda_event, sample_lambda_context, env_vars):
+        """A busy session reported by the runtime should map to 429 with Retry-After."""
+        mock_response = Mock()
+        mock_response.read = Mock(return_value=json.dumps(
+            {'error': 'session_busy', 'message': 'Still answering', 'retry_after': 2}).encode())
+        mock_client.invoke_agent_runtime.return_value = {'response': mock_response}
+        
+        response = handler.lambda_handler(sample_lambda_event, sample_lambda_context)
+        
+        assert response['statusCode'] == 429
+        assert response['headers']['Retry-After'] == '2'
+        assert json.loads(response['body'])['reason'] == 'session_busy'
+
+class TestStreamingResponses:
+    """Tests for streamed AgentCore responses."""
+    
+    @staticmethod
+    def sse_body(chunks):
+        body = Mock()
+        body.iter_lines = Mock(return_value=iter(
+            [f'data: {json.dumps(chunk)}'.encode('utf-8') for chunk in chunks] + [b'']
+        ))
+        return body
+    
+    @patch('handler.AGENT_STREAMING', True)
+    @patch('handler.agent_core_client')
+    def test_streamed_chunks_are_joined(self, mock_client, sample_lambda_event, sample_lambda_context, env_vars):
+        """Event stream chunks should be assembled into the response."""
+        mock_client.invoke_agent_runtime.return_value = {
+            'contentType': 'text/event-stream',
+            'response': self.sse_body(['Flights ', 'to Athens ', 'from €89.'])
+        }
+        
+        response = handler.lambda_handler(sample_lambda_event, sample_lambda_context)
+        
+        assert response['statusCode'] == 200
+        assert json.loads(response['body'])['response'] == 'Flights to Athens from €89.'
+        payload = json.loads(mock_client.invoke_agent_runtime.call_args.kwargs['payload'])
+        assert payload['stream'] is True
+    
+    @patch('handler.agent_core_client')
+    def test_streaming_off_by_default(self, mock_client, sample_lambda_event, sample_lambda_context, env_vars):
+        """The runtime should not be asked to stream unless AGENT_STREAMING is set."""
+        mock_response = Mock()
+        mock_response.read = Mock(return_value=b'Response')
+        mock_client.invoke_agent_runtime.return_value = {'response': mock_response}
+        
+        handler.lambda_handler(sample_lambda_event, sample_lambda_context)
+        
+        payload = json.loads(mock_client.invoke_agent_runtime.call_args.kwargs['payload'])
+        assert handler.AGENT_STREAMING is False
+        assert payload['stream'] is False
+    
+    @patch('handler.agent_core_client')
+    def test_thinking_removed_across_chunk_boundaries(self, mock_client, sample_lambda_event, sample_lambda_context, env_vars):
+        """Thinking tags split across chunks should still be removed."""
+        mock_client.invoke_agent_runtime.return_value = {
+            'contentType': 'text/event-stream',
+            'response': self.sse_body(['<think', 'ing>secret plan</thi', 'nking>  ', 'Here is the response'])
+        }
+        
+        response = handler.lambda_handler(sample_lambda_event, sample_lambda_context)
+        
+        body = json.loads(response['body'])
+        assert body['response'] == 'Here is the response'
+
+
+class TestThinkingTagFilter:
+    """Tests for the incremental thinking-tag filter."""
+    
+    SAMPLES = [
+        'Plain answer without tags',
+        '<thinking>plan</thinking>\n\nAnswer',
+        'Intro <thinking>a</thinking> middle <thinking>b\nc</thinking>  end',
+        'Price < 100 EUR and <think>not a tag</think>',
+        '<thinking></thinking>',
+    ]
+    
+    @staticmethod
+    def regex_strip(text):
+        import re
+        return re.sub(r'<thinking>.*?</thinking>\s*', '', text, flags=re.DOTALL)
+    
+    def test_matches_regex_on_buffered_text(self):
+        """Buffered filtering should match the previous regex cleanup."""
+        for sample in self.SAMPLES:
+            assert handler.strip_thinking(sample) == self.regex_strip(sample)
+    
+    def test_matches_regex_for_every_chunking(self):
+        """Output should not depend on where chunk boundaries fall."""
+        import random
+        
+        rng = random.Random(42)
+        for sample in self.SAMPLES:
+            for _ in range(50):
+                cuts = sorted(rng.sample(range(len(sample) + 1), k=min(4, len(sample) + 1)))
+                chunks = [sample[a:b] for a, b in zip([0] + cuts, cuts + [len(sample)])]
+                thinking_filter = handler.ThinkingTagFilter()
+                output = ''.join(thinking_filter.feed(c) for c in chunks) + thinking_filter.flush()
+                assert output == self.regex_strip(sample)
+    
+    def test_holds_back_only_partial_tags(self):
+        """Only text that could still become a tag should be held back."""
+        thinking_filter = handler.ThinkingTagFilter()
+        
+        assert thinking_filter.feed('Hello <thin') == 'Hello '
+        assert thinking_filter.feed('gs to do') == '<things to do'
+    
+    def test_unclosed_block_is_dropped(self):
+        """An unterminated thinking block should not leak into the output."""
+        assert handler.strip_thinking('Answer<thinking>never closed') == 'Answer'
+
+
+class TestStructuredLogging:
+    """Tests for per-request structured logging."""
+    
+    @staticmethod
+    def log_lines(capsys):
+        return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.strip()]
+    
+    @patch('handler.agent_core_client')
+    def test_single_json_line_per_request(self, mock_client, sample_lambda_event, sample_lambda_context, env_vars, capsys):
+        """A request should produce one summary line without payload dumps."""
+        mock_response = Mock()
+        mock_response.read = Mock(return_value=b'Here is your trip.')
+        mock_client.invoke_agent_runtime.return_value = {'response': mock_response}
+        
+        with patch('handler.LOG_LEVEL', 'INFO'), patch('handler.LOG_SAMPLE_RATE', 0):
+            handler.lambda_handler(sample_lambda_event, sample_lambda_context)
+        
+        lines = self.log_lines(capsys)
+        assert len(lines) == 1
+        assert lines[0]['status'] == 200
+        assert lines[0]['session_id'] == 'test-session-123'
+        assert 'Barcelona' not in json.dumps(lines[0])
+    
+    @patch('handler.agent_core_client')
+    def test_debug_dumps_are_truncated(self, mock_client, sample_lambda_event, sample_lambda_context, env_vars, capsys):
+        """Debug records should be written with truncated fields."""
+        mock_response = Mock()
+        mock_response.read = Mock(return_value=b'OK')
+        mock_client.invoke_agent_runtime.return_value = {'response': mock_response}
+        event = sample_lambda_event.copy()
+        event['body'] = json.dumps({'message': 'x' * 5000, 'session_id': 'debug-test'})
+        
+        with patch('handler.LOG_LEVEL', 'DEBUG'), patch('handler.LOG_MAX_FIELD_CHARS', 100):
+            handler.lambda_handler(event, sample_lambda_context)
+        
+        lines = self.log_lines(capsys)
+        assert any(line['level'] == 'DEBUG' for line in lines)
+        assert all(len(line.get('body', '')) < 200 for line in lines)
+        assert lines[-1]['message'] == 'request'
+    
+    @patch('handler.agent_core_client')
+    def test_errors_logged_with_traceback(self, mock_client, sample_lambda_event, sample_lambda_context, env_vars, capsys):
+        """Failures should be logged at ERROR level with the exception type."""
+        mock_client.invoke_agent_runtime.side_effect = RuntimeError('runtime unavailable')
+        
+        response = handler.lambda_handler(sample_lambda_event, sample_lambda_context)
+        
+        assert response['statusCode'] == 500
+        line = self.log_lines(capsys)[-1]
+        assert line['level'] == 'ERROR'
+        assert line['error_type'] == 'RuntimeError'
+        assert 'runtime unavailable' in line['traceback']
+
+    
+    @patch('handler.agent_core_client')
+    def test_stage_timings_exported(self, mock_client, sample_lambda_event, sample_lambda_context, env_vars, tmp_path, capsys):
+        """Stage timings should be logged and appended to the timings file."""
+        mock_response = Mock()
+        mock_response.read = Mock(return_value=b'OK')
+        mock_client.invoke_agent_runtime.return_value = {'response': mock_response}
+        timings_file = tmp_path / 'stages.jsonl'
+        
+        with patch('handler.STAGE_TIMINGS_FILE', str(timings_file)):
+            handler.lambda_handler(sample_lambda_event, sample_lambda_context)
+        
+        record = json.loads(timings_file.read_text().splitlines()[0])
+        assert record['component'] == 'lambda'
+        assert set(record['stages']) >= {'parse_body', 'invoke_agent_runtime', 'read_response', 'clean_response'}
+        assert self.log_lines(capsys)[-1]['trace_id'] == record['trace_id']
+    
+    @patch('handler.agent_core_client')
+    def test_trace_context_propagated_to_runtime(self, mock_client, sample_lambda_event, sample_lambda_context, env_vars):
+        """The runtime should receive the Lambda's trace ID and traceparent."""
+        mock_response = Mock()
+        mock_response.read = Mock(return_value=b'OK')
+        mock_client.invoke_agent_runtime.return_value = {'response': mock_response}
+        
+        handler.lambda_handler(sample_lambda_event, sample_lambda_context)
+        
+        kwargs = mock_client.invoke_agent_runtime.call_args.kwargs
+        assert len(kwargs['traceId']) == 32
+        assert kwargs['traceParent'].split('-')[1] == kwargs['traceId']
+        assert json.loads(kwargs['payload'])['trace_id'] == kwargs['traceId']
+
+
+class TestAgentCoreClient:
+    """Tests for the lazily created, connection-tuned AgentCore client."""
+    
+    def test_client_created_once_on_first_use(self):
+        """The client should be created on first use and then reused."""
+        with patch('handler.agent_core_client', None), \
+                patch('handler.create_agent_core_client', return_value=Mock()) as factory:
+            first = handler.get_agent_core_client()
+            second = handler.get_agent_core_client()
+        
+        assert first is second
+        factory.assert_called_once()
+    
+    def test_client_config(self):
+        """The client should use explicit timeouts, pool size, retries and keepalive."""
+        botocore_config = Mock()
+        boto3 = Mock()
+        with patch.dict(sys.modules, {'boto3': boto3, 'botocore': Mock(), 'botocore.config': botocore_config}), \
+                patch('handler.AGENTCORE_READ_TIMEOUT', 120.0), \
+                patch('handler.AGENTCORE_MAX_POOL_CONNECTIONS', 25):
+            handler.create_agent_core_client()
+        
+        config_kwargs = botocore_config.Config.call_args.kwargs
+        assert config_kwargs['read_timeout'] == 120.0
+        assert config_kwargs['max_pool_connections'] == 25
+        assert config_kwargs['retries']['mode'] == 'adaptive'
+        assert config_kwargs['tcp_keepalive'] is True
+        boto3.client.assert_called_once_with('bedrock-agentcore', config=botocore_config.Config.return_value)
+    
+    def test_health_check_does_not_create_client(self):
+        """Requests that never reach AgentCore should not create the client."""
+        event = {'requestContext': {'http': {'method': 'GET'}}, 'rawPath': '/health'}
+        with patch('handler.agent_core_client', None), patch('handler.create_agent_core_client') as factory:
+            response = handler.lambda_handler(event, Mock())
+        
+        assert response['statusCode'] == 200
+        factory.assert_not_called()
+
+
+class TestDirectHistory:
+    """Tests for reading history straight from AgentCore Memory."""
+    
+    @staticmethod
+    def event(timestamp, user, assistant):
+        return {
+            'eventTimestamp': timestamp,
+            'payload': [
+                {'conversational': {'role': 'USER', 'content': {'text': user}}},
+                {'conversational': {'role': 'ASSISTANT', 'content': {'text': assistant}}},
+            ],
+        }
+    
+    @patch('handler.agent_core_client')
+    def test_history_read_from_memory(self, mock_client, env_vars):
+        """History should come from ListEvents, oldest first, without invoking the runtime."""
+        mock_client.list_events.return_value = {'events': [
+            self.event(3, 'Hotels?', 'Here are hotels.'),
+            self.event(1, 'Hi', 'Hello!'),
+            self.event(2, 'Flights?', 'Here are flights.'),
+        ]}
+        
+        response = handler.handle_get_history('session-1', k=2)
+        
+        body = json.loads(response['body'])
+        assert [m['content'] for m in body['messages']] == ['Flights?', 'Here are flights.', 'Hotels?', 'Here are hotels.']
+        assert body['messages'][0]['role'] == 'user'
+        kwargs = mock_client.list_events.call_args.kwargs
+        assert kwargs['actorId'] == 'travel-user-session-1'
+        assert kwargs['includePayloads'] is True
+        mock_client.invoke_agent_runtime.assert_not_called()
+    
+    @patch('handler.agent_core_client')
+    def test_main_branch_sends_no_filter(self, mock_client, env_vars):
+        """Main-branch events have no branch name, so no branch filter should be sent."""
+        mock_client.list_events.return_value = {'events': []}
+        
+        with patch('handler.BRANCH_NAME', 'main'):
+            handler.list_session_events('session-1')
+        assert 'filter' not in mock_client.list_events.call_args.kwargs
+        
+        with patch('handler.BRANCH_NAME', 'experiment'):
+            handler.list_session_events('session-1')
+        assert mock_client.list_events.call_args.kwargs['filter']['branch']['name'] == 'experiment'
+    
+    @patch('handler.agent_core_client')
+    def test_history_pages_followed(self, mock_client, env_vars):
+        """Later ListEvents pages should be read."""
+        mock_client.list_events.side_effect = [
+            {'events': [self.event(2, 'Second', 'B')], 'nextToken': 'next'},
+            {'events': [self.event(1, 'First', 'A')]},
+        ]
+        
+        messages = handler.turns_to_messages(handler.events_to_turns(handler.list_session_events('session-1')))
+        
+        assert [m['content'] for m in messages] == ['First', 'A', 'Second', 'B']
+        assert mock_client.list_events.call_args.kwargs['nextToken'] == 'next'
+    
+    @patch('handler.agent_core_client')
+    def test_cursor_pagination(self, mock_client, env_vars):
+        """Pages should be returned oldest first with cursors for older and newer events."""
+        events = [dict(self.event(i, f'Q{i}', f'A{i}'), eventId=f'e{i}') for i in range(1, 6)]
+        mock_client.list_events.return_value = {'events': events}
+        
+        latest = json.loads(handler.handle_get_history('s1', cursor={'page_size': 2})['body'])
+        older = json.loads(handler.handle_get_history(
+            's1', cursor={'page_size': 2, 'before': latest['cursor']['before']})['body'])
+        newer = json.loads(handler.handle_get_history('s1', cursor={'after': 'e3'})['body'])
+        
+        assert [m['content'] for m in latest['messages']] == ['Q4', 'A4', 'Q5', 'A5']
+        assert latest['cursor'] == {'before': 'e4', 'after': 'e5', 'timestamp': 5.0}
+        assert latest['has_more'] is True
+        assert [m['content'] for m in older['messages']] == ['Q2', 'A2', 'Q3', 'A3']
+        assert [m['content'] for m in newer['messages']] == ['Q4', 'A4', 'Q5', 'A5']
+        assert newer['has_more'] is False
+    
+    def test_since_and_unknown_cursor(self):
+        """"since" should select newer events; an unknown cursor should reset to the latest page."""
+        events = [{'eventId': f'e{i}', 'eventTimestamp': float(i), 'payload': []} for i in range(1, 6)]
+        
+        since = handler.page_history_events(events, 10, since='1970-01-01T00:00:03Z')
+        unknown = handler.page_history_events(events, 2, after='gone')
+        
+        assert [e['eventId'] for e in since['events']] == ['e4', 'e5']
+        assert unknown['reset'] is True
+        assert [e['eventId'] for e in unknown['events']] == ['e4', 'e5']
+    
+    @patch('handler.agent_core_client')
+    def test_not_modified_when_etag_matches(self, mock_client, sample_lambda_context, env_vars):
+        """A matching If-None-Match should get a 304 without a body."""
+        mock_client.list_events.return_value = {'events': [dict(self.event(1, 'Hi', 'Hello!'), eventId='e1')]}
+        event = {
+            'requestContext': {'http': {'method': 'POST'}},
+            'body': json.dumps({'action': 'getHistory', 'sessionId': 's1', 'k': 3}),
+        }
+        
+        first = handler.lambda_handler(event, sample_lambda_context)
+        etag = first['headers']['ETag']
+        second = handler.lambda_handler(dict(event, headers={'if-none-match': etag}), sample_lambda_context)
+        
+        assert first['statusCode'] == 200
+        assert second['statusCode'] == 304
+        assert second['body'] == ''
+        assert second['headers']['ETag'] == etag
+    
+    @patch('handler.agent_core_client')
+    def test_etag_changes_with_new_events(self, mock_client, env_vars):
+        """A new event or different paging should produce a different ETag."""
+        events = [dict(self.event(1, 'Hi', 'Hello!'), eventId='e1')]
+        mock_client.list_events.return_value = {'events': events}
+        before = handler.handle_get_history('s1', k=3)['headers']['ETag']
+        paged = handler.handle_get_history('s1', k=3, cursor={'page_size': 1})['headers']['ETag']
+        
+        events.append(dict(self.event(2, 'Flights?', 'Here.'), eventId='e2'))
+        response = handler.handle_get_history('s1', k=3, if_none_match=before)
+        
+        assert paged != before
+        assert response['statusCode'] == 200
+        assert response['headers']['ETag'] != before
+    
+    @patch('handler.agent_core_client')
+    def test_unchanged_reloads_are_not_modified(self, mock_client, env_vars):
+        """Reloading with the cursor and ETag of the last response should get a 304 until a new event."""
+        events = [dict(self.event(i, f'Q{i}', f'A{i}'), eventId=f'e{i}') for i in range(1, 4)]
+        mock_client.list_events.return_value = {'events': events}
+        
+        first = handler.handle_get_history('s1', cursor={'page_size': 2})
+        cursor = {'page_size': 2, 'after': json.loads(first['body'])['cursor']['after']}
+        second = handler.handle_get_history('s1', cursor=cursor, if_none_match=first['headers']['ETag'])
+        third = handler.handle_get_history('s1', cursor=cursor, if_none_match=second['headers']['ETag'])
+        events.append(dict(self.event(4, 'Q4', 'A4'), eventId='e4'))
+        fourth = handler.handle_get_history('s1', cursor=cursor, if_none_match=third['headers']['ETag'])
+        
+        assert first['statusCode'] == 200
+        assert second['statusCode'] == 304
+        assert third['statusCode'] == 304
+        assert fourth['statusCode'] == 200
+        assert [m['content'] for m in json.loads(fourth['body'])['messages']] == ['Q4', 'A4']
+    
+    @patch('handler.agent_core_client')
+    def test_falls_back_to_runtime(self, mock_client, env_vars):
+        """A failed Memory read should fall back to the runtime's getHistory action."""
+        mock_client.list_events.side_effect = RuntimeError('AccessDenied')
+        mock_response = Mock()
+        mock_response.read = Mock(return_value=json.dumps(
+            {'messages': [{'role': 'user', 'content': 'Hi'}]}).encode('utf-8'))
+        mock_client.invoke_agent_runtime.return_value = {'response': mock_response}
+        
+        response = handler.handle_get_history('session-1', k=3)
+        
+        assert json.loads(response['body'])['messages'] == [{'role': 'user', 'content': 'Hi'}]
+        assert json.loads(mock_client.invoke_agent_runtime.call_args.kwargs['payload'])['action'] == 'getHistory'
+    
+    @patch('handler.agent_core_client')
+    def test_fallback_forwards_cursor(self, mock_client, env_vars):
+        """Cursor parameters and the page cursor should pass through the runtime fallback."""
+        mock_client.list_events.side_effect = RuntimeError('AccessDenied')
+        mock_response = Mock()
+        mock_response.read = Mock(return_value=json.dumps(
+            {'messages': [], 'cursor': {'before': None, 'after': None, 'timestamp': None},
+             'has_more': False, 'reset': False}).encode('utf-8'))
+        mock_client.invoke_agent_runtime.return_value = {'response': mock_response}
+        
+        response = handler.handle_get_history('session-1', cursor={'after': 'e7', 'before': None})
+        
+        payload = json.loads(mock_client.invoke_agent_runtime.call_args.kwargs['payload'])
+        assert payload['after'] == 'e7'
+        assert 'before' not in payload
+        assert json.loads(response['body'])['has_more'] is False
+
 
 class TestAdversarialTests:
     """Adversarial tests for security and robustness."""
@@ -238,6 +662,25 @@ class TestAdversarialTests:
 class TestPerformanceTests:
     """Performance tests for latency and throughput."""
     
+    @pytest.mark.skipif(os.environ.get('HANDLER_IMPORT_BUDGET_CHECK', 'false').lower() != 'true',
+                        reason='wall-clock check; set HANDLER_IMPORT_BUDGET_CHECK=true to run it')
+    def test_cold_import_within_budget(self):
+        """Importing the handler in a fresh interpreter should stay within the budget."""
+        from tests.benchmarks.bench_import_time import IMPORT_BUDGET_MS, profile_import
+        
+        total_ms = min(profile_import()[0] for _ in range(3))
+        
+        assert total_ms < IMPORT_BUDGET_MS, \
+            f"handler import took {total_ms:.1f}ms, budget is {IMPORT_BUDGET_MS:.0f}ms"
+    
+    def test_heavy_modules_loaded_lazily(self):
+        """boto3 and error-path modules should not be imported at init."""
+        from tests.benchmarks.bench_import_time import profile_import
+        
+        _, _, loaded = profile_import()
+        
+        assert loaded == []
+    
     @patch('handler.agent_core_client')
     def test_health_check_latency(self, mock_client, env_vars):
         """Health check should respond quickly."""